@@ -12,8 +12,10 @@ def config(data_dir):
 
 
 @pytest.fixture
-def database(config):
-    return uita.database.Database(config.bot.database)
+def database(config, event_loop):
+    database = uita.database.Database(config.bot.database, loop=event_loop)
+    event_loop.run_until_complete(database.open())
+    return database
 
 
 @pytest.fixture(autouse=True)
@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 import asyncio
 from pathlib import Path
@@ -40,7 +40,7 @@ def test_track_unique_ids():
 
 
 @pytest.mark.asyncio
-async def test_enqueue_file(init_queue):
+async def test_enqueue_file(init_queue, user):
     queue, mock_queue_change, mock_status_change = await init_queue("1")
 
     assert mock_queue_change.call_count == 1
@@ -53,6 +53,47 @@ async def test_enqueue_file(init_queue):
     assert not track.live
     assert track.local
 
+    # Probe results are reused when the same file is queued again
+    with patch("subprocess.run") as mock_run:
+        await queue.enqueue_file(track.path, user)
+        assert mock_run.call_count == 0
+    assert queue.queue()[1].title == track.title
+
+
+@pytest.mark.asyncio
+async def test_enqueue_playlist(user):
+    queue = uita.audio.Queue()
+    pages = [["vid1vid1vid", "vid2vid2vid"], ["vid3vid3vid"]]
+
+    async def playlist(playlist_id, api_key, referrer, loop):
+        for page in pages:
+            # Tracks become playable as soon as their page arrives
+            assert len(queue.queue()) == sum(len(p) for p in pages[:pages.index(page)])
+            yield page
+
+    async def scrape(url, loop):
+        return {
+            "extractor": "Youtube",
+            "id": uita.youtube_api.parse_video_id(url),
+            "title": "title",
+            "acodec": "opus",
+            "abr": 160,
+            "duration": 5,
+            "url": url,
+            "is_live": None
+        }
+
+    with patch("uita.youtube_api.playlist") as mock_playlist:
+        mock_playlist.side_effect = playlist
+        with patch("uita.youtube_api.scrape") as mock_scrape:
+            mock_scrape.side_effect = scrape
+            await queue.enqueue_url("https://youtube.com/playlist?list=PL1", user, api_key="key")
+        assert mock_playlist.call_args[0][0] == "PL1"
+        assert mock_scrape.call_count == 3
+    assert [track.url for track in queue.queue()] == [
+        uita.youtube_api.build_url(video_id) for page in pages for video_id in page
+    ]
+
 
 @pytest.mark.asyncio
 async def test_play(init_queue):
@@ -1,14 +1,16 @@
 import pytest
 from unittest.mock import patch
 
+import asyncio
 import json
+import time
 
 import uita.auth
 
 
 @pytest.mark.asyncio
 async def test_verify_session(config, database, data_dir):
-    session = database.add_session("token", 0)
+    session = await database.add_session("token", 0)
     raw_response = json.load(data_dir / "discord-api-user.json")
     with patch("uita.auth.uita.discord_api.get") as mock_get:
         async def get(*args, **kwargs): return raw_response
@@ -17,6 +19,38 @@ async def test_verify_session(config, database, data_dir):
     assert user.id == raw_response["id"]
 
 
+@pytest.mark.asyncio
+async def test_verify_session_cached(config, database, data_dir, event_loop):
+    session = await database.add_session("token", 0)
+    raw_response = json.load(data_dir / "discord-api-user.json")
+    cache = uita.auth.SessionCache(ttl=60, refresh=10)
+    with patch("uita.auth.uita.discord_api.get") as mock_get:
+        async def get(*args, **kwargs): return raw_response
+        mock_get.side_effect = get
+        user = await uita.auth.verify_session(session, database, config, event_loop, cache)
+        user.active_server_id = "1"
+        # Reconnects are verified locally and get their own user
+        cached_user = await uita.auth.verify_session(
+            session, database, config, event_loop, cache
+        )
+        assert cached_user.id == raw_response["id"]
+        assert cached_user.active_server_id is None
+        assert mock_get.call_count == 1
+        # Wrong secrets are never let through
+        with pytest.raises(uita.exceptions.AuthenticationError):
+            await uita.auth.verify_session(
+                uita.auth.Session(session.handle, "bad"), database, config, event_loop, cache
+            )
+        # Old sessions are verified again in the background
+        await database.delete_session(session)
+        with patch("time.monotonic", return_value=time.monotonic() + 30):
+            await uita.auth.verify_session(session, database, config, event_loop, cache)
+        await asyncio.sleep(0.1)
+        assert cache.get(session) is None
+        with pytest.raises(uita.exceptions.AuthenticationError):
+            await uita.auth.verify_session(session, database, config, event_loop, cache)
+
+
 @pytest.mark.asyncio
 async def test_verify_session_expired(config, database):
     # Should fail if session does not exist
@@ -31,4 +65,4 @@ async def test_verify_code(config, database, data_dir):
         async def auth(*args, **kwargs): return raw_response
         mock_auth.side_effect = auth
         session = await uita.auth.verify_code("code", database, config)
-    assert database.get_access_token(session) == raw_response["access_token"]
+    assert await database.get_access_token(session) == raw_response["access_token"]
@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import Mock, patch
 
+import asyncio
 import discord
 import uuid
 
@@ -21,10 +22,12 @@ def bot(config, event_loop, user):
         mock_bot.loop = event_loop
         mock_bot.user = user()
         mock_server.config = config
-        mock_server.database = uita.database.Database(config.bot.database)
+        mock_server.database = uita.database.Database(config.bot.database, loop=event_loop)
+        event_loop.run_until_complete(mock_server.database.open())
         mock_server.verify_active_servers.side_effect = async_stub
         uita.state.initialize_from_bot(mock_bot)
         yield mock_bot
+        event_loop.run_until_complete(uita.bot_events.flush_updates())
 
 
 @pytest.fixture
@@ -33,6 +36,7 @@ def channel():
         mock_channel = Mock()
         mock_channel.id = uuid.uuid4().int
         mock_channel.guild = guild
+        mock_channel.overwrites_for.return_value.is_empty.return_value = True
         return mock_channel
     return make_channel
 
@@ -76,6 +80,9 @@ def role():
         mock_role = Mock()
         mock_role.id = uuid.uuid4().int
         mock_role.guild = guild
+        mock_role.is_default.return_value = False
+        mock_role.members = []
+        mock_role.permissions = discord.Permissions.none()
         return mock_role
     return make_role
 
@@ -90,35 +97,105 @@ async def test_on_guild_channel(bot, guild, channel):
     with patch("uita.bot_events._sync_channels") as mock_sync:
         await uita.bot_events.on_guild_channel_create(mock_channel)
         assert str(mock_channel.id) in uita.state.servers[str(mock_guild.id)].channels
+        await uita.bot_events.flush_updates()
         assert mock_sync.call_count == 1
 
         await uita.bot_events.on_guild_channel_delete(mock_channel)
+        await uita.bot_events.flush_updates()
         assert str(mock_channel.id) not in uita.state.servers[str(mock_guild.id)].channels
         assert mock_sync.call_count == 2
 
 
 @pytest.mark.asyncio
-async def test_on_guild_role(bot, guild, channel, role):
+async def test_on_guild_role(bot, guild, channel, member, role):
     mock_guild = guild()
     mock_channel = channel(mock_guild)
+    mock_member = member(mock_guild)
     mock_guild.channels = [mock_channel]
+    mock_guild.members = [mock_guild.me, mock_member]
     mock_role = role(mock_guild)
+    updated_role = role(mock_guild)
+    updated_role.id = mock_role.id
+    updated_role.permissions = discord.Permissions(administrator=True)
+    server = uita.types.DiscordServer(str(mock_guild.id), mock_guild.name, {}, {}, None)
+    uita.state.server_add(server, bot)
+    await uita.state.server_set_role(str(mock_guild.id), "12345")
 
-    with patch("uita.bot_events.uita.utils.verify_channel_visibility") as mock_visibility:
-        # on create
+    with patch("uita.bot_events.uita.utils.verify_channel_visibility") as mock_visibility, \
+            patch("uita.bot_events._sync_channels") as mock_sync:
         mock_visibility.return_value = True
-        await uita.bot_events.on_guild_role_create(mock_role)
+        # Roles the bot doesn't have can't change its channel visibility
+        await uita.bot_events.on_guild_role_update(mock_role, updated_role)
+        await uita.bot_events.flush_updates()
+        assert len(uita.state.servers[str(mock_guild.id)].channels) == 0
+        assert mock_sync.call_count == 0
+
+        # on update
+        mock_guild.me.roles = [updated_role]
+        updated_role.members = [mock_guild.me, mock_member]
+        mock_member.guild_permissions.administrator = True
+        await uita.bot_events.on_guild_role_update(mock_role, updated_role)
+        await uita.bot_events.flush_updates()
         assert len(uita.state.servers[str(mock_guild.id)].channels) == 1
+        assert mock_sync.call_count == 1
+        assert str(mock_member.id) in uita.state.servers[str(mock_guild.id)].users
+
+        # Nothing is re-checked if permissions are unchanged
         mock_visibility.return_value = False
-        await uita.bot_events.on_guild_role_create(mock_role)
-        assert len(uita.state.servers[str(mock_guild.id)].channels) == 0
+        await uita.bot_events.on_guild_role_update(updated_role, updated_role)
+        await uita.bot_events.flush_updates()
+        assert len(uita.state.servers[str(mock_guild.id)].channels) == 1
+        assert mock_sync.call_count == 1
 
         # on delete
+        mock_member.guild_permissions.administrator = False
+        await uita.bot_events.on_guild_role_delete(updated_role)
+        await uita.bot_events.flush_updates()
+        assert len(uita.state.servers[str(mock_guild.id)].channels) == 0
+        assert mock_sync.call_count == 2
+        assert str(mock_member.id) not in uita.state.servers[str(mock_guild.id)].users
+
+    # Deleting the required role gives everyone access
+    required_role = role(mock_guild)
+    await uita.state.server_set_role(str(mock_guild.id), str(required_role.id))
+    await uita.bot_events.on_guild_role_delete(required_role)
+    assert uita.state.server_get_role(str(mock_guild.id)) is None
+    await uita.bot_events.flush_updates()
+    assert str(mock_member.id) in uita.state.servers[str(mock_guild.id)].users
+
+
+@pytest.mark.asyncio
+async def test_update_burst(bot, guild, channel, member, role):
+    mock_guild = guild()
+    mock_member = member(mock_guild)
+    mock_guild.channels = [channel(mock_guild) for _ in range(3)]
+    mock_role = role(mock_guild)
+    mock_role.is_default.return_value = True
+    server = uita.types.DiscordServer(str(mock_guild.id), mock_guild.name, {}, {}, None)
+    uita.state.server_add(server, bot)
+
+    with patch("uita.bot_events.uita.utils.verify_channel_visibility") as mock_visibility, \
+            patch("uita.bot_events._sync_channels") as mock_sync:
         mock_visibility.return_value = True
-        uita.state.server_set_role(str(mock_guild.id), str(mock_role.id))
-        assert uita.state.server_get_role(str(mock_guild.id)) == str(mock_role.id)
-        await uita.bot_events.on_guild_role_delete(mock_role)
-        assert uita.state.server_get_role(str(mock_guild.id)) is None
+        # Every update in a burst is applied together
+        for i in range(20):
+            updated_role = role(mock_guild)
+            updated_role.is_default.return_value = True
+            updated_role.permissions = discord.Permissions(i + 1)
+            await uita.bot_events.on_guild_role_update(mock_role, updated_role)
+            await uita.bot_events.on_member_join(mock_member)
+            await uita.bot_events.on_member_remove(mock_member)
+        assert mock_visibility.call_count == 0
+        await uita.bot_events.flush_updates()
+        assert mock_visibility.call_count == len(mock_guild.channels)
+        assert mock_sync.call_count == 1
+        assert uita.server.verify_active_servers.call_count == 1
+
+        # Updates are applied on their own shortly after
+        await uita.bot_events.on_guild_channel_delete(mock_guild.channels[0])
+        assert mock_sync.call_count == 1
+        await asyncio.sleep(uita.bot_events.UPDATE_DELAY * 2)
+        assert mock_sync.call_count == 2
 
 
 @pytest.mark.asyncio
@@ -138,7 +215,7 @@ async def test_on_member(bot, guild, member, role):
     assert str(mock_member.id) not in uita.state.servers[str(mock_guild.id)].users
 
     # on join with insufficient permissions
-    uita.state.server_set_role(str(mock_guild.id), str(mock_role.id))
+    await uita.state.server_set_role(str(mock_guild.id), str(mock_role.id))
     await uita.bot_events.on_member_join(mock_member)
     assert str(mock_member.id) not in uita.state.servers[str(mock_guild.id)].users
 
@@ -166,6 +243,57 @@ async def test_on_message(bot, member):
         assert mock_parse.call_count == 1
 
 
+@pytest.mark.asyncio
+async def test_recheck_members(bot, guild, member, role):
+    mock_guild = guild()
+    mock_member = member(mock_guild)
+    mock_guild.members = [mock_guild.me, mock_member]
+    admin_role = role(mock_guild)
+    admin_role.members = [mock_member]
+    updated_role = role(mock_guild)
+    updated_role.id = admin_role.id
+    updated_role.members = [mock_member]
+    updated_role.permissions = discord.Permissions(administrator=True)
+    server = uita.types.DiscordServer(str(mock_guild.id), mock_guild.name, {}, {}, None)
+    uita.state.server_add(server, bot)
+    await uita.state.server_set_role(str(mock_guild.id), "12345")
+
+    # Bursts of permission changes only re-check members once
+    with patch("uita.bot_events.update_members", side_effect=async_stub) as mock_update:
+        for _ in range(3):
+            await uita.bot_events.on_guild_role_update(admin_role, updated_role)
+            await uita.bot_events.on_guild_role_update(updated_role, admin_role)
+        await uita.bot_events.flush_updates()
+    assert mock_update.call_count == 1
+    assert list(mock_update.call_args[0][1]) == [mock_member]
+
+
+@pytest.mark.asyncio
+async def test_on_server_role(bot, guild, member, role):
+    mock_guild = guild()
+    mock_member = member(mock_guild)
+    mock_guild.members = [mock_guild.me, mock_member]
+    bot.get_guild.return_value = mock_guild
+    server_id = str(mock_guild.id)
+    server = uita.types.DiscordServer(server_id, mock_guild.name, {}, {}, None)
+    uita.state.server_add(server, bot)
+    uita.state.server_add_user(server_id, str(mock_member.id), "name")
+
+    # Roles set by another process are applied and members are re-checked against them
+    required_role = role(mock_guild)
+    uita.bot_events._on_server_role(server_id, str(required_role.id))
+    assert uita.state.server_get_role(server_id) == str(required_role.id)
+    await uita.bot_events.flush_updates()
+    assert str(mock_member.id) not in uita.state.servers[server_id].users
+    uita.server.verify_active_servers.assert_called_with(server_id)
+
+    mock_member.roles = [required_role]
+    uita.bot_events._on_server_role(server_id, None)
+    await uita.bot_events.flush_updates()
+    assert uita.state.server_get_role(server_id) is None
+    assert str(mock_member.id) in uita.state.servers[server_id].users
+
+
 @pytest.mark.asyncio
 async def test_on_guild(bot, guild, channel, member):
     mock_guild = guild()
@@ -179,9 +307,23 @@ async def test_on_guild(bot, guild, channel, member):
     assert str(mock_channel.id) in uita.state.servers[str(mock_guild.id)].channels
     assert str(mock_member.id) in uita.state.servers[str(mock_guild.id)].users
 
-    with patch("uita.bot_events._sync_channels") as mock_sync:
-        await uita.bot_events.on_guild_update(mock_guild, mock_guild)
-        assert mock_sync.call_count == 1
+    mock_guild.name = "New name"
+    await uita.bot_events.on_guild_update(mock_guild, mock_guild)
+    assert uita.state.servers[str(mock_guild.id)].name == "New name"
+
+    # Ownership transfers change who has administrator permissions
+    await uita.state.server_set_role(str(mock_guild.id), "12345")
+    new_owner = member(mock_guild)
+    new_owner.guild_permissions.administrator = True
+    mock_member.guild_permissions.administrator = False
+    updated_guild = Mock(id=mock_guild.id, owner_id=new_owner.id, owner=new_owner)
+    updated_guild.name = mock_guild.name
+    mock_guild.owner_id = mock_member.id
+    mock_guild.owner = mock_member
+    await uita.bot_events.on_guild_update(mock_guild, updated_guild)
+    await uita.bot_events.flush_updates()
+    assert str(new_owner.id) in uita.state.servers[str(mock_guild.id)].users
+    assert str(mock_member.id) not in uita.state.servers[str(mock_guild.id)].users
 
     await uita.bot_events.on_guild_remove(mock_guild)
     assert str(mock_guild.id) not in uita.state.servers
@@ -1,40 +1,245 @@
+import pytest
+from unittest.mock import Mock
+
+import asyncio
+import sqlite3
+import time
+
+import uita.auth
 import uita.database
+import uita.resp
+
+
+def encode_reply(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(encode_reply(item) for item in reply)
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+@pytest.fixture
+def redis_server(event_loop):
+    """Stand-in for a Redis server, implementing only the commands used by the bot."""
+    store = {}
+    expiry = {}
+    subscribers = {}
+
+    def get(key):
+        if expiry.get(key, float("inf")) <= time.time():
+            store.pop(key, None)
+        return store.get(key, {})
+
+    def run(writer, command, key, *args):
+        if command == b"INCR":
+            store[key] = store.get(key, 0) + 1
+            return store[key]
+        if command == b"HSET":
+            store.setdefault(key, {}).update(zip(args[::2], args[1::2]))
+            return len(args) // 2
+        if command == b"HMGET":
+            return [get(key).get(field) for field in args]
+        if command == b"HGETALL":
+            return [item for field in get(key).items() for item in field]
+        if command == b"HDEL":
+            return int(get(key).pop(args[0], None) is not None)
+        if command == b"DEL":
+            return int(store.pop(key, None) is not None)
+        if command == b"EXPIREAT":
+            expiry[key] = int(args[0])
+            return 1
+        if command == b"PUBLISH":
+            for subscriber in subscribers.get(key, []):
+                subscriber.write(encode_reply([b"message", key, args[0]]))
+            return len(subscribers.get(key, []))
+        if command == b"SUBSCRIBE":
+            subscribers.setdefault(key, []).append(writer)
+            return [b"subscribe", key, 1]
+        raise AssertionError(f"Unexpected command {command}")
 
+    async def handle(reader, writer):
+        try:
+            while True:
+                writer.write(encode_reply(run(writer, *await uita.resp._read_reply(reader))))
+        except asyncio.IncompleteReadError:
+            writer.close()
 
-def test_maintenance(database):
-    session = database.add_session("token", 0)
-    database.maintenance()
-    assert database.get_access_token(session) is None
+    server = event_loop.run_until_complete(
+        asyncio.start_server(handle, "127.0.0.1", 0, loop=event_loop)
+    )
+    port = server.sockets[0].getsockname()[1]
+    yield f"redis://127.0.0.1:{port}"
+    server.close()
+    event_loop.run_until_complete(server.wait_closed())
+
+
+@pytest.mark.asyncio
+async def test_maintenance(database):
+    session = await database.add_session("token", 0)
+    await database.maintenance()
+    assert await database.get_access_token(session) is None
     # Will fail if this call somehow takes more than 5 seconds
     # But if it does we should re-evaluate what's wrong with this test anyway
-    session = database.add_session("token", 5)
-    database.maintenance()
-    assert database.get_access_token(session) is not None
+    session = await database.add_session("token", 5)
+    await database.maintenance()
+    assert await database.get_access_token(session) is not None
+
+
+@pytest.mark.asyncio
+async def test_maintenance_batches(database):
+    sessions = [await database.add_session("token", 0) for _ in range(5)]
+    await database.maintenance(batch_size=2)
+    for session in sessions:
+        assert await database.get_access_token(session) is None
+
+
+@pytest.mark.asyncio
+async def test_migration(tmp_path, event_loop):
+    database_file = tmp_path / "uita.db"
+    # Sessions from before expiry times were stored
+    connection = sqlite3.connect(str(database_file))
+    connection.executescript(uita.database._INIT_DATABASE_QUERY)
+    connection.execute(
+        "INSERT INTO sessions(secret, token, created, expiry) VALUES"
+        "('old', 'old_token', datetime('now', '-1 hour'), 60),"
+        "('new', 'new_token', datetime('now'), 3600)"
+    )
+    connection.commit()
+    connection.close()
+
+    database = uita.database.Database(str(database_file), loop=event_loop)
+    await database.open()
+    await database.maintenance()
+    assert await database.get_access_token(uita.auth.Session(1, "old")) is None
+    assert await database.get_access_token(uita.auth.Session(2, "new")) == "new_token"
+    await database.close()
 
+    # Migrations are only run once
+    database = uita.database.Database(str(database_file), loop=event_loop)
+    await database.open()
+    assert await database.get_access_token(uita.auth.Session(2, "new")) == "new_token"
+    await database.close()
 
-def test_session(database):
+
+@pytest.mark.asyncio
+async def test_session(database):
     token = "test_token"
-    session = database.add_session(token, 0)
-    assert database.get_access_token(session) == token
-    database.delete_session(session)
-    assert database.get_access_token(session) is None
+    session = await database.add_session(token, 0)
+    assert await database.get_access_token(session) == token
+    await database.delete_session(session)
+    assert await database.get_access_token(session) is None
 
 
-def test_server_role(database):
+@pytest.mark.asyncio
+async def test_server_role(database):
     server_id = "12345"
     role_id = "67890"
     assert database.get_server_role(server_id) is None
-    database.set_server_role(server_id, role_id)
+    await database.set_server_role(server_id, role_id)
     assert database.get_server_role(server_id) == role_id
-    database.set_server_role(server_id, None)
+    await database.set_server_role(server_id, None)
     assert database.get_server_role(server_id) is None
 
 
-def test_persistence(tmp_path):
+@pytest.mark.asyncio
+async def test_persistence(tmp_path, event_loop):
     token = "test_token"
     database_file = tmp_path / "uita.db"
-    first_database = uita.database.Database(str(database_file))
-    session = first_database.add_session(token, 0)
+    first_database = uita.database.Database(str(database_file), loop=event_loop)
+    await first_database.open()
+    session = await first_database.add_session(token, 0)
+
+    second_database = uita.database.Database(str(database_file), loop=event_loop)
+    await second_database.open()
+    assert await second_database.get_access_token(session) == token
+    await first_database.close()
+    await second_database.close()
+
+
+@pytest.mark.asyncio
+async def test_batched_commits(tmp_path, event_loop):
+    database_file = tmp_path / "uita.db"
+    database = uita.database.Database(str(database_file), loop=event_loop, commit_interval=60)
+    await database.open()
+    # Writes wait for their commit, which groups together every write made in the meantime
+    writes = asyncio.gather(
+        *[database.set_server_role(str(server_id), "1") for server_id in range(10)],
+        loop=event_loop
+    )
+    await asyncio.sleep(0.05)
+    assert not writes.done()
+    await database.close()
+    assert writes.done()
+
+    database = uita.database.Database(str(database_file), loop=event_loop)
+    await database.open()
+    # Roles are all loaded up front
+    assert database.get_server_role("9") == "1"
+    await database.close()
+
+
+def test_storage_interface():
+    class IncompleteStorage(uita.database.Storage):
+        async def open(self, on_server_role):
+            pass
+
+    with pytest.raises(TypeError):
+        IncompleteStorage()
+
+
+@pytest.mark.asyncio
+async def test_redis_storage(redis_server, event_loop):
+    token = "test_token"
+    first_database = uita.database.Database(redis_server, loop=event_loop)
+    await first_database.open()
+    second_database = uita.database.Database(redis_server, loop=event_loop)
+    await second_database.open()
+
+    # Sessions are shared between processes
+    session = await first_database.add_session(token, 60)
+    assert await second_database.get_access_token(session) == token
+    assert await second_database.get_access_token(uita.auth.Session(session.handle, "bad")) is None
+    await second_database.delete_session(session)
+    assert await first_database.get_access_token(session) is None
+    # And expire on their own
+    session = await first_database.add_session(token, 0)
+    assert await second_database.get_access_token(session) is None
+
+    # Role changes are published to other processes
+    first_database.on_server_role = Mock()
+    second_database.on_server_role = Mock()
+    await first_database.set_server_role("12345", "67890")
+    await asyncio.sleep(0.05)
+    assert second_database.get_server_role("12345") == "67890"
+    second_database.on_server_role.assert_called_once_with("12345", "67890")
+    await second_database.set_server_role("12345", None)
+    await asyncio.sleep(0.05)
+    assert first_database.get_server_role("12345") is None
+    first_database.on_server_role.assert_called_once_with("12345", None)
+    # Changes aren't reported back to the process that made them
+    assert second_database.on_server_role.call_count == 1
+
+    # Lost connections are re-established, catching up on any missed role changes
+    storage = second_database._storage
+    storage._connection._writer.close()
+    storage._subscription._writer.close()
+    await first_database.set_server_role("12345", "13579")
+    await asyncio.sleep(0.1)
+    assert second_database.get_server_role("12345") == "13579"
+    await first_database.set_server_role("12345", None)
+    await asyncio.sleep(0.05)
+    assert second_database.get_server_role("12345") is None
+    session = await second_database.add_session(token, 60)
+    assert await first_database.get_access_token(session) == token
+
+    await first_database.set_server_role("1", "2")
+    await first_database.close()
+    await second_database.close()
 
-    second_database = uita.database.Database(str(database_file))
-    assert second_database.get_access_token(session) == token
+    # And are loaded when opened
+    database = uita.database.Database(redis_server, loop=event_loop)
+    await database.open()
+    assert database.get_server_role("1") == "2"
+    await database.close()
@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import Mock, patch
 
+import asyncio
 import json
 
 import uita.discord_api
@@ -16,11 +17,12 @@ async def test_auth(data_dir, config, event_loop):
 
         with pytest.raises(uita.exceptions.AuthenticationError):
             mock_post.return_value.status_code = 403
+            mock_post.return_value.headers = {}
             await uita.discord_api.auth(code, config, event_loop)
 
         def data_check(url, data, headers):
             assert data["code"] == code
-            response = Mock()
+            response = Mock(headers={})
             response.status_code = 200
             response.json.return_value = response_json
             return response
@@ -37,7 +39,7 @@ async def test_get(data_dir, event_loop):
     response_json = json.load(data_dir / "discord-api-user.json")
     with patch("uita.discord_api.requests.get") as mock_get:
         def data_check(url, headers):
-            response = Mock()
+            response = Mock(headers={})
             if headers["Authorization"] == f"Bearer {token}":
                 response.status_code = 200
             else:
@@ -53,6 +55,77 @@ async def test_get(data_dir, event_loop):
         assert get_response == response_json
 
 
+@pytest.mark.asyncio
+async def test_rate_limiter(event_loop):
+    limiter = uita.discord_api.RateLimiter(max_wait=0.5, max_retries=1)
+    sent = []
+
+    def responder(status_code, headers):
+        async def send():
+            sent.append(event_loop.time())
+            return Mock(status_code=status_code, headers=headers)
+        return send
+
+    bucket_headers = {
+        "X-RateLimit-Bucket": "abc",
+        "X-RateLimit-Limit": "2",
+        "X-RateLimit-Remaining": "0",
+        "X-RateLimit-Reset-After": "0.1"
+    }
+    # Requests wait for an exhausted bucket to reset
+    start = event_loop.time()
+    await limiter.request("GET /a", "token", responder(200, bucket_headers), event_loop)
+    await limiter.request("GET /a", "token", responder(200, bucket_headers), event_loop)
+    assert sent[1] - start >= 0.1
+    # Other tokens have their own limits
+    sent.clear()
+    start = event_loop.time()
+    await limiter.request("GET /a", "other", responder(200, {}), event_loop)
+    assert sent[0] - start < 0.1
+    # Rate limited requests are retried after the reset
+    sent.clear()
+    responses = [
+        responder(429, {"Retry-After": "0.1"}),
+        responder(200, {})
+    ]
+    response = await limiter.request(
+        "GET /b", None, lambda: responses.pop(0)(), event_loop
+    )
+    assert response.status_code == 200
+    assert sent[1] - sent[0] >= 0.1
+    # Up to a point
+    with pytest.raises(uita.exceptions.RateLimitError):
+        await limiter.request("GET /b", None, responder(429, {"Retry-After": "0"}), event_loop)
+    with pytest.raises(uita.exceptions.RateLimitError):
+        await limiter.request("GET /b", None, responder(429, {"Retry-After": "1"}), event_loop)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_unknown_bucket(event_loop):
+    limiter = uita.discord_api.RateLimiter()
+    in_flight = []
+    sent = []
+
+    async def send():
+        in_flight.append(None)
+        sent.append(len(in_flight))
+        await asyncio.sleep(0.01, loop=event_loop)
+        in_flight.pop()
+        return Mock(status_code=200, headers={
+            "X-RateLimit-Limit": "5",
+            "X-RateLimit-Remaining": "4",
+            "X-RateLimit-Reset-After": "1"
+        })
+
+    # Concurrent first requests wait for the bucket limits before being sent together
+    await asyncio.gather(
+        *[limiter.request("GET /a", "token", send, event_loop) for _ in range(3)],
+        loop=event_loop
+    )
+    assert sent[0] == 1
+    assert max(sent) == 2
+
+
 @pytest.mark.asyncio
 async def test_avatar_url(data_dir):
     user = json.load(data_dir / "discord-api-user.json")
@@ -1,5 +1,7 @@
 import pytest
 
+import msgpack
+
 import uita.message
 
 
@@ -34,3 +36,51 @@ def test_parse():
     parsed_message = uita.message.parse(message)
     assert isinstance(parsed_message, uita.message.AuthCodeMessage)
     assert parsed_message.code == code
+
+
+def test_parse_binary():
+    # Exceeds max length
+    with pytest.raises(uita.exceptions.MalformedMessage):
+        message = msgpack.packb({"header": "." * uita.message.MAX_CLIENT_MESSAGE_LENGTH})
+        uita.message.parse(message)
+    # Mangled MessagePack
+    with pytest.raises(uita.exceptions.MalformedMessage):
+        uita.message.parse(b"\xc1")
+    # Not an object
+    with pytest.raises(uita.exceptions.MalformedMessage):
+        uita.message.parse(msgpack.packb(["header", "auth.code"]))
+    # Missing required property
+    with pytest.raises(uita.exceptions.MalformedMessage):
+        uita.message.parse(msgpack.packb({"header": "auth.code"}))
+    # Numbers are validated the same way as JSON messages
+    with pytest.raises(uita.exceptions.MalformedMessage):
+        uita.message.parse(msgpack.packb({"header": "server.join", "server_id": ""}))
+    parsed_message = uita.message.parse(msgpack.packb({"header": "server.join", "server_id": 1}))
+    assert parsed_message.server_id == "1"
+    # Encoding round trips
+    message = uita.message.SearchQueryMessage("query")
+    assert uita.message.decode(bytes(message)) == uita.message.decode(str(message))
+    parsed_message = uita.message.parse(uita.message.encode(message, binary=True))
+    assert isinstance(parsed_message, uita.message.SearchQueryMessage)
+    assert parsed_message.query == "query"
+
+
+def test_snapshot_cache():
+    cache = uita.message.SnapshotCache()
+    builds = []
+
+    def build():
+        builds.append(None)
+        return uita.message.PlayStatusSendMessage(uita.audio.Status.PAUSED)
+
+    header = uita.message.PlayStatusSendMessage.header
+    data = cache.get(header, 0, False, build)
+    assert data == str(build())
+    builds.clear()
+    # Reused until the version changes
+    assert cache.get(header, 0, False, build) is data
+    assert len(builds) == 0
+    assert isinstance(cache.get(header, 0, True, build), bytes)
+    assert len(builds) == 1
+    cache.get(header, 1, False, build)
+    assert len(builds) == 2
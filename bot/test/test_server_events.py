@@ -1,13 +1,17 @@
 import pytest
 from unittest.mock import Mock, patch
 
+import asyncio
 import discord
+import hashlib
+import os
 import websockets
 
 import uita.message
 import uita.server_events
 import uita.ui_server
 import uita.types
+import uita.youtube_api
 
 
 async def async_stub(*args, **kwargs): ...
@@ -15,9 +19,18 @@ async def async_stub(*args, **kwargs): ...
 
 @pytest.fixture
 def event(request, config, event_loop):
-    with patch("uita.server"):
+    with patch("uita.server") as mock_server:
+        mock_server.router = None
         mock_event = Mock()
+        mock_server.set_active_server.side_effect = (
+            lambda socket, server_id: setattr(mock_event.user, "active_server_id", server_id)
+        )
         mock_event.socket.send.side_effect = async_stub
+        mock_event.send.side_effect = lambda message: mock_event.socket.send(str(message))
+        mock_event.send_data.side_effect = (
+            lambda data, snapshot_key=None: mock_event.socket.send(data)
+        )
+        mock_event.binary = False
         mock_event.config = config
         mock_event.loop = event_loop
         mock_event.user = uita.types.DiscordUser(
@@ -76,6 +89,15 @@ async def test_channel_list_get(event):
     await uita.server_events.channel_list_get(event)
     assert str(uita.message.ChannelListSendMessage(channels)) == event.socket.send.call_args[0][0]
 
+    # Channel changes are sent instead of the previously encoded list
+    channel = uita.types.DiscordChannel(
+        "2a2a2a2a2a", "New Channel", discord.ChannelType.voice, "1c1c1c1c1c", 1
+    )
+    uita.state.server_add_channel(event.active_server.id, channel)
+    await uita.server_events.channel_list_get(event)
+    message = uita.message.ChannelListSendMessage(channels + [channel])
+    assert str(message) == event.socket.send.call_args[0][0]
+
 
 @pytest.mark.asyncio
 async def test_file_upload_start(event, data_dir):
@@ -84,39 +106,168 @@ async def test_file_upload_start(event, data_dir):
 
     # Runs the client logic of a file upload
     async def send_file(socket, _):
-        start_message = uita.message.parse(await socket.recv())
-        # These assertions can't actually propogate because websockets suppresses them
-        assert isinstance(start_message, uita.message.FileUploadStartMessage)
-        assert start_message.size == len(file_data)
+        chunks = [file_data[i:i + 64] for i in range(0, len(file_data), 64)]
+        sent = 0
+        allowed = 0
+        while True:
+            message = uita.message.parse(await socket.recv())
+            if isinstance(message, uita.message.FileUploadCompleteMessage):
+                break
+            # These assertions can't actually propogate because websockets suppresses them
+            assert isinstance(message, uita.message.FileUploadAckMessage)
+            assert message.received <= sent
+            allowed = max(allowed, message.received + message.window)
+            # Send as many chunks as the window allows without waiting
+            while sent < min(allowed, len(chunks)):
+                await socket.send(chunks[sent])
+                sent += 1
+    server = await websockets.serve(
+        send_file, event.config.bot.domain, event.config.bot.port, loop=event.loop
+    )
+
+    # Receive the file
+    mock_enqueue = Mock()
+    mock_enqueue.side_effect = async_stub
+    uita.state.voice_connections[event.active_server.id].enqueue_file = mock_enqueue
+    sha256 = hashlib.sha256(file_data).hexdigest()
+    # Files that don't match their declared hash are discarded
+    async with websockets.connect(uita.utils.build_websocket_url(event.config)) as client_socket:
+        event.message = uita.message.FileUploadStartMessage(
+            len(file_data), hashlib.sha256(b"").hexdigest()
+        )
+        event.socket = client_socket
+        with pytest.raises(uita.exceptions.MalformedFile):
+            await uita.server_events.file_upload_start(event)
+    assert mock_enqueue.call_count == 0
+    async with websockets.connect(uita.utils.build_websocket_url(event.config)) as client_socket:
+        event.message = uita.message.FileUploadStartMessage(len(file_data), sha256)
+        event.socket = client_socket
+        await uita.server_events.file_upload_start(event)
+
+    # Check the uploaded file matches the source file and is named after its hash
+    uploaded_file = mock_enqueue.call_args[0][0]
+    assert os.path.basename(uploaded_file) == sha256
+    with open(uploaded_file, "rb") as f:
+        uploaded_file_data = f.read()
+    assert file_data == uploaded_file_data
+
+    # Uploading the same file again queues the cached copy without transferring it
+    event.socket = Mock()
+    event.socket.send.side_effect = async_stub
+    await uita.server_events.file_upload_start(event)
+    assert event.socket.recv.call_count == 0
+    assert isinstance(
+        uita.message.parse(event.socket.send.call_args[0][0]),
+        uita.message.FileUploadCompleteMessage
+    )
+    assert mock_enqueue.call_args[0][0] == uploaded_file
 
-        await socket.send(file_data)
+    # Clean up
+    os.remove(uploaded_file)
+    server.close()
+    await server.wait_closed()
 
-        end_message = uita.message.parse(await socket.recv())
-        assert isinstance(end_message, uita.message.FileUploadCompleteMessage)
+
+@pytest.mark.asyncio
+async def test_file_upload_resume(event, data_dir):
+    with open(data_dir / "test.flac", "rb") as f:
+        file_data = f.read()
+    sha256 = hashlib.sha256(file_data).hexdigest()
+    offsets = []
+
+    # Runs the client logic of a file upload, losing the connection partway through the first try
+    async def send_file(socket, _):
+        offset = 0
+        sent = 0
+        while True:
+            message = uita.message.parse(await socket.recv())
+            if isinstance(message, uita.message.FileUploadCompleteMessage):
+                break
+            if isinstance(message, uita.message.FileUploadResumeMessage):
+                offset = message.offset
+                continue
+            if message.received == 0:
+                offsets.append(offset)
+            chunks = [file_data[i:i + 64] for i in range(offset, len(file_data), 64)]
+            while sent < min(message.received + message.window, len(chunks)):
+                if len(offsets) == 1 and sent == 4:
+                    await socket.close()
+                    return
+                await socket.send(chunks[sent])
+                sent += 1
     server = await websockets.serve(
         send_file, event.config.bot.domain, event.config.bot.port, loop=event.loop
     )
 
-    # Receive the file
     mock_enqueue = Mock()
     mock_enqueue.side_effect = async_stub
     uita.state.voice_connections[event.active_server.id].enqueue_file = mock_enqueue
+    event.message = uita.message.FileUploadStartMessage(len(file_data), sha256)
+    async with websockets.connect(uita.utils.build_websocket_url(event.config)) as client_socket:
+        event.socket = client_socket
+        with pytest.raises(websockets.exceptions.ConnectionClosed):
+            await uita.server_events.file_upload_start(event)
+    assert mock_enqueue.call_count == 0
+
+    # Partial upload survives cache pruning until it expires
+    await uita.utils.prune_cache_dir()
     async with websockets.connect(uita.utils.build_websocket_url(event.config)) as client_socket:
-        event.message = uita.message.FileUploadStartMessage(len(file_data))
         event.socket = client_socket
         await uita.server_events.file_upload_start(event)
+    assert offsets == [0, 4 * 64]
 
-    # Check the uploaded file matches the source file
     uploaded_file = mock_enqueue.call_args[0][0]
     with open(uploaded_file, "rb") as f:
         uploaded_file_data = f.read()
     assert file_data == uploaded_file_data
 
     # Clean up
+    os.remove(uploaded_file)
     server.close()
     await server.wait_closed()
 
 
+@pytest.mark.asyncio
+async def test_search_query(event, event_loop):
+    searches = 0
+
+    async def search(query, *args, **kwargs):
+        nonlocal searches
+        searches += 1
+        return [{"id": "vid", "url": "http://example.com", "title": query, "live": False}]
+
+    with patch("uita.server_events._search_cache", new=uita.youtube_api.SearchCache()):
+        with patch("uita.youtube_api.search", side_effect=search):
+            with patch("uita.server_events.SEARCH_DEBOUNCE", new=0):
+                event.message = uita.message.SearchQueryMessage("search")
+                await uita.server_events.search_query(event)
+                message = uita.message.parse(event.socket.send.call_args[0][0])
+                assert isinstance(message, uita.message.SearchResultsMessage)
+                assert message.query == "search"
+                assert message.results[0]["title"] == "search"
+                # Repeated queries are served from cache
+                await uita.server_events.search_query(event)
+                assert searches == 1
+                # Newer queries supersede older ones still waiting to be sent
+                event.socket.send.reset_mock()
+                event.message = uita.message.SearchQueryMessage("older")
+                older = event_loop.create_task(uita.server_events.search_query(event))
+                await asyncio.sleep(0)
+                event.message = uita.message.SearchQueryMessage("newer")
+                await uita.server_events.search_query(event)
+                await asyncio.gather(older, return_exceptions=True)
+                assert older.cancelled()
+                assert event.socket.send.call_count == 1
+                message = uita.message.parse(event.socket.send.call_args[0][0])
+                assert message.query == "newer"
+                # Empty queries don't search
+                event.message = uita.message.SearchQueryMessage(" ")
+                await uita.server_events.search_query(event)
+                message = uita.message.parse(event.socket.send.call_args[0][0])
+                assert message.results == []
+                assert searches == 2
+
+
 @pytest.mark.asyncio
 async def test_server_join(event):
     event.message = uita.message.ServerJoinMessage(event.active_server.id)
@@ -151,7 +302,12 @@ async def test_play_queue_get(event):
 
     tracks = [uita.audio.Track("path", event.user, "title", 5, False, False)]
     queue_mock = Mock(return_value=tracks)
-    uita.state.voice_connections[event.active_server.id].queue = queue_mock
+    voice = uita.state.voice_connections[event.active_server.id]
+    voice.queue = queue_mock
+    # Encoded queue is reused until the queue changes
+    await uita.server_events.play_queue_get(event)
+    assert uita.message.parse(event.socket.send.call_args[0][0]).queue == []
+    voice._playlist.version += 1
     await uita.server_events.play_queue_get(event)
     assert str(uita.message.PlayQueueSendMessage(tracks)) == event.socket.send.call_args[0][0]
 
@@ -0,0 +1,114 @@
+import pytest
+from unittest.mock import patch
+
+import json
+import websockets
+
+import uita.config
+import uita.exceptions
+import uita.message
+import uita.shards
+import uita.ui_server
+
+
+def sharded_config(config, worker_id):
+    sharding = uita.config.ConfigBotSharding(
+        shard_count=4,
+        workers=["ws://localhost:23230", "ws://localhost:23232"],
+        worker_id=worker_id
+    )
+    port = 23230 if worker_id == 0 else 23232
+    return config._replace(bot=config.bot._replace(port=port, sharding=sharding))
+
+
+def test_router(config, event_loop):
+    router = uita.shards.Router(sharded_config(config, 1), event_loop)
+    assert router.shard_ids == [1, 3]
+    assert router.worker_url(str(1 << 22)) is None
+    assert router.worker_url(str(2 << 22)) == "ws://localhost:23230"
+
+    incomplete_config = config._replace(bot=config.bot._replace(
+        sharding=uita.config.ConfigBotSharding(workers=["ws://localhost:23230"])
+    ))
+    with pytest.raises(uita.exceptions.MalformedConfig):
+        uita.shards.Router(incomplete_config, event_loop)
+
+
+@pytest.mark.asyncio
+async def test_relay(config, event_loop):
+    session = uita.auth.Session(handle="123", secret="abc")
+    local_server_id = str(2 << 22)
+    remote_server_id = str(1 << 22)
+    local_server = uita.ui_server.Server()
+    remote_server = uita.ui_server.Server()
+
+    @local_server.on_message(uita.message.ServerListGetMessage, require_active_server=False)
+    async def local_list(event):
+        conn = local_server.connections[event.socket]
+        discord_servers = [uita.types.DiscordServer(local_server_id, "Local", {}, {}, None)]
+        discord_servers += await local_server.router.remote_servers(conn.session)
+        await event.socket.send(str(uita.message.ServerListSendMessage(discord_servers)))
+
+    @local_server.on_message(uita.message.ServerJoinMessage, require_active_server=False)
+    async def local_join(event):
+        await event.socket.send(f"joined {event.message.server_id} locally")
+
+    @remote_server.on_message(uita.message.ServerListGetMessage, require_active_server=False)
+    async def remote_list(event):
+        discord_servers = [uita.types.DiscordServer(remote_server_id, "Remote", {}, {}, None)]
+        await event.socket.send(str(uita.message.ServerListSendMessage(discord_servers)))
+
+    @remote_server.on_message(uita.message.ServerJoinMessage, require_active_server=False)
+    async def remote_join(event):
+        await event.socket.send(f"joined {event.message.server_id} remotely")
+
+    @remote_server.on_message(uita.message.HeartbeatMessage, require_active_server=False)
+    async def remote_heartbeat(event):
+        await event.socket.send("remote heartbeat")
+
+    @remote_server.on_message(
+        uita.message.FileUploadStartMessage, require_active_server=False, block=True
+    )
+    async def remote_upload(event):
+        data = b""
+        while len(data) < event.message.size:
+            data += await event.socket.recv()
+        await event.socket.send(f"uploaded {data.decode()} remotely")
+
+    with patch("uita.auth.verify_session") as mock_verify:
+        async def return_user(*args, **kwargs):
+            return uita.types.DiscordUser(
+                "1234567890", "User name", "http://example.com/image.png", None
+            )
+        mock_verify.side_effect = return_user
+        await local_server.start(config.bot.database, sharded_config(config, 0), loop=event_loop)
+        await remote_server.start(config.bot.database, sharded_config(config, 1), loop=event_loop)
+
+        async with websockets.connect("ws://localhost:23230", loop=event_loop) as socket:
+            await socket.send(str(uita.message.AuthSessionMessage(session.handle, session.secret)))
+            await socket.recv()
+
+            # Server lists are gathered from every process
+            await socket.send(str(uita.message.ServerListGetMessage()))
+            message = json.loads(await socket.recv())
+            assert [server["id"] for server in message["servers"]] == [
+                local_server_id, remote_server_id
+            ]
+
+            # Messages are relayed to the process running the active server
+            await socket.send(str(uita.message.ServerJoinMessage(remote_server_id)))
+            assert await socket.recv() == f"joined {remote_server_id} remotely"
+            await socket.send(str(uita.message.HeartbeatMessage()))
+            assert await socket.recv() == "remote heartbeat"
+            # File chunks are relayed without being parsed as messages
+            await socket.send(str(uita.message.FileUploadStartMessage(6, "0" * 64)))
+            await socket.send(b"abc")
+            await socket.send(b"def")
+            assert await socket.recv() == "uploaded abcdef remotely"
+
+            # Until joining a server run by this process
+            await socket.send(str(uita.message.ServerJoinMessage(local_server_id)))
+            assert await socket.recv() == f"joined {local_server_id} locally"
+
+        await local_server.stop()
+        await remote_server.stop()
@@ -7,6 +7,12 @@ import uita
 import uita.types
 
 
+def async_return(value):
+    async def function(*args, **kwargs):
+        return value
+    return function
+
+
 def test_initialize_from_bot(event_loop):
     with patch("uita.server") as mock_server, \
          patch("uita.utils.verify_channel_visibility", return_value=True), \
@@ -40,11 +46,42 @@ def test_initialize_from_bot(event_loop):
         assert "11111" in state.servers["99999"].users
 
 
-def test_channel(event_loop):
-    with patch("uita.server") as mock_server:
+def test_initialize_shard_from_bot(event_loop):
+    with patch("uita.server") as mock_server, \
+         patch("uita.utils.verify_user_permissions", return_value=True):
         mock_server.database.get_server_role.return_value = None
-        channel = uita.types.DiscordChannel("12345", "channel", discord.ChannelType.voice, "9", 1)
-        server = uita.types.DiscordServer("54321", "server", {}, {}, None)
+        # Server IDs that fall in shards 0 and 1
+        guilds = [
+            Mock(**{"id": shard_id << 22, "shard_id": shard_id, "channels": [], "icon": None})
+            for shard_id in (0, 1)
+        ]
+        for guild in guilds:
+            guild.members = [Mock(id=11111)]
+        mock_bot = Mock(guilds=guilds, loop=event_loop, shard_count=2)
+
+        state = uita.types.DiscordState()
+        state.initialize_from_bot(mock_bot)
+        other_shard_server = state.servers[str(1 << 22)]
+
+        # Left a server while shard 0 was disconnected
+        mock_bot.guilds = guilds[1:]
+        state.initialize_shard_from_bot(mock_bot, 0)
+        assert str(0 << 22) not in state.servers
+        assert state.servers[str(1 << 22)] is other_shard_server
+        assert state.user_get_servers("11111") == {str(1 << 22)}
+
+        # Members checked on demand are kept, but checked again next time
+        state.lazy_members = True
+        state.server_add_user(str(1 << 22), "22222", "user")
+        state.initialize_shard_from_bot(mock_bot, 1)
+        assert "22222" in state.servers[str(1 << 22)].users
+        assert state.user_get_servers("22222") == {str(1 << 22)}
+        assert (str(1 << 22), "22222") not in state._verified_users
+
+
+def test_channel(event_loop):
+    channel = uita.types.DiscordChannel("12345", "channel", discord.ChannelType.voice, "9", 1)
+    server = uita.types.DiscordServer("54321", "server", {}, {}, None)
 
     state = uita.types.DiscordState()
 
@@ -61,9 +98,7 @@ def test_channel(event_loop):
 
 
 def test_server(event_loop):
-    with patch("uita.server") as mock_server:
-        mock_server.database.get_server_role.return_value = None
-        server = uita.types.DiscordServer("12345", "server", {}, {}, None)
+    server = uita.types.DiscordServer("12345", "server", {}, {}, None)
 
     state = uita.types.DiscordState()
 
@@ -77,10 +112,8 @@ def test_server(event_loop):
 
 
 def test_user(event_loop):
-    with patch("uita.server") as mock_server:
-        mock_server.database.get_server_role.return_value = None
-        user = uita.types.DiscordUser("12345", "user", "http://example.com/image.png", None)
-        server = uita.types.DiscordServer("54321", "server", {}, {}, None)
+    user = uita.types.DiscordUser("12345", "user", "http://example.com/image.png", None)
+    server = uita.types.DiscordServer("54321", "server", {}, {}, None)
 
     state = uita.types.DiscordState()
 
@@ -91,16 +124,86 @@ def test_user(event_loop):
     state.server_add_user(server.id, user.id, user.name)
     assert user.id in state.servers[server.id].users
     assert state.servers[server.id].users[user.id] == user.name
+    assert state.user_get_servers(user.id) == {server.id}
 
     state.server_remove_user(server.id, user.id)
     assert user.id not in state.servers[server.id].users
+    assert state.user_get_servers(user.id) == set()
+
+    # Index follows servers being replaced and removed
+    state.server_add(
+        uita.types.DiscordServer(server.id, server.name, {}, {user.id: user.name}, None),
+        Mock(loop=event_loop)
+    )
+    assert state.user_get_servers(user.id) == {server.id}
+    state.server_remove(server.id)
+    assert state.user_get_servers(user.id) == set()
+
+
+def test_intern_user():
+    user = uita.types.DiscordUser("12345", "user", "http://example.com/image.png", "54321")
+    interned = uita.types.intern_user(user)
+    assert interned is not user
+    assert (interned.id, interned.name, interned.avatar) == (user.id, user.name, user.avatar)
+    assert interned.active_server_id is None
+    assert uita.types.intern_user(user) is interned
+    renamed = uita.types.DiscordUser(user.id, "renamed", user.avatar, None)
+    assert uita.types.intern_user(renamed) is not interned
+    with pytest.raises(AttributeError):
+        interned.nickname = "nickname"
 
 
-def test_role(event_loop):
+@pytest.mark.asyncio
+async def test_verify_user_lazy(event_loop):
+    server = uita.types.DiscordServer("54321", "server", {}, {}, None)
+    state = uita.types.DiscordState()
+    state.lazy_members = True
+    state.server_add(server, Mock(loop=event_loop))
+
+    member = Mock(id=12345)
+    member.name = "user"
+    guild = Mock()
+    guild.get_member.return_value = None
+    guild.fetch_member = Mock(side_effect=async_return(member))
+    bot = Mock(**{"get_guild.return_value": guild})
+
+    # Members are fetched on demand and remembered
+    with patch("uita.utils.verify_user_permissions", return_value=True):
+        assert await state.server_verify_user(server.id, "12345", bot)
+        assert await state.server_verify_user(server.id, "12345", bot)
+    assert guild.fetch_member.call_count == 1
+    assert state.servers[server.id].users["12345"] == "user"
+    assert state.user_get_servers("12345") == {server.id}
+
+    # Until asked to check again
+    with patch("uita.utils.verify_user_permissions", return_value=False):
+        assert not await state.server_verify_user(server.id, "12345", bot, refresh=True)
+    assert guild.fetch_member.call_count == 2
+    assert "12345" not in state.servers[server.id].users
+
+    # Non-members don't have access
+    async def not_found(*args):
+        raise discord.errors.NotFound(Mock(status=404), "Unknown Member")
+    guild.fetch_member.side_effect = not_found
+    assert not await state.server_verify_user(server.id, "67890", bot)
+    assert not await state.server_verify_user("99999", "12345", bot)
+
+    # Remembered results are forgotten when the server role changes, but not for other servers
+    other_server = uita.types.DiscordServer("98765", "other", {}, {}, None)
+    state.server_add(other_server, Mock(loop=event_loop))
+    assert not await state.server_verify_user(other_server.id, "67890", bot)
+    guild.fetch_member.side_effect = async_return(member)
+    with patch("uita.utils.verify_user_permissions", return_value=True):
+        state.server_update_role(server.id, None)
+        assert await state.server_verify_user(server.id, "67890", bot)
+        assert not await state.server_verify_user(other_server.id, "67890", bot)
+
+
+@pytest.mark.asyncio
+async def test_role(event_loop):
     with patch("uita.server") as mock_server:
         state = uita.types.DiscordState()
-        server = uita.types.DiscordServer("12345", "server", {}, {}, None)
-        server.role = "321"
+        server = uita.types.DiscordServer("12345", "server", {}, {}, None, "321")
 
         mock_server.database.get_server_role.return_value = "123"
         assert state.server_get_role(server.id) == "123"
@@ -108,5 +211,6 @@ def test_role(event_loop):
         state.server_add(server, Mock(loop=event_loop))
         assert state.server_get_role(server.id) == "321"
 
-        state.server_set_role(server.id, "999")
+        mock_server.database.set_server_role.side_effect = async_return(None)
+        await state.server_set_role(server.id, "999")
         assert state.server_get_role(server.id) == "999"
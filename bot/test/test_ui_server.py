@@ -1,11 +1,15 @@
 import pytest
 from unittest.mock import Mock, patch
 
+import asyncio
 import json
 import websockets
 
+import uita.audio
 import uita.message
+import uita.server_events
 import uita.ui_server
+import uita.youtube_api
 
 
 async def authenticate(socket, user=None, session=None):
@@ -73,23 +77,201 @@ async def test_auth(config, event_loop):
     await server.stop()
 
 
+@pytest.mark.asyncio
+async def test_binary_protocol(config, event_loop):
+    server = uita.ui_server.Server()
+    url = uita.utils.build_websocket_url(config)
+    user = uita.types.DiscordUser("1234567890", "User name", "http://example.com/image.png", None)
+    await server.start(config.bot.database, config, loop=event_loop)
+
+    @server.on_message(uita.message.ServerListGetMessage, require_active_server=False)
+    async def test_message(event):
+        await event.send(uita.message.ServerListSendMessage([]))
+
+    async with websockets.connect(
+        url, subprotocols=[uita.message.MSGPACK_SUBPROTOCOL], loop=event_loop
+    ) as socket:
+        assert socket.subprotocol == uita.message.MSGPACK_SUBPROTOCOL
+        with patch("uita.auth.verify_session") as mock_verify:
+            async def return_user(*args, **kwargs):
+                return user
+            mock_verify.side_effect = return_user
+            await socket.send(bytes(uita.message.AuthSessionMessage("123", "abc")))
+            message = uita.message.decode(await socket.recv())
+            assert message["header"] == uita.message.AuthSucceedMessage.header
+
+        # Clients can still send JSON, but are always replied to in binary
+        await socket.send(str(uita.message.ServerListGetMessage()))
+        data = await socket.recv()
+        assert isinstance(data, bytes)
+        assert uita.message.decode(data) == {"header": "server.list.send", "servers": []}
+
+    await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_auth_retry(config, event_loop):
+    server = uita.ui_server.Server()
+    url = uita.utils.build_websocket_url(config)
+    await server.start(config.bot.database, config, loop=event_loop)
+    server.admission = uita.ui_server.AdmissionControl(max_queued=0, loop=event_loop)
+
+    async with websockets.connect(url, loop=event_loop) as socket:
+        _, _, message = await authenticate(socket)
+
+    assert message["header"] == uita.message.AuthRetryMessage.header
+    assert message["retry_after"] > 0
+
+    await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_auth_idle(config, event_loop):
+    server = uita.ui_server.Server()
+    url = uita.utils.build_websocket_url(config)
+    await server.start(config.bot.database, config, loop=event_loop)
+    server.admission = uita.ui_server.AdmissionControl(
+        max_concurrent=1, max_queued=1, loop=event_loop
+    )
+
+    # Sockets that haven't sent authentication yet don't hold up others
+    async with websockets.connect(url, loop=event_loop):
+        await asyncio.sleep(0.01, loop=event_loop)
+        async with websockets.connect(url, loop=event_loop) as socket:
+            _, _, message = await asyncio.wait_for(authenticate(socket), 1, loop=event_loop)
+
+    assert message["header"] == uita.message.AuthSucceedMessage.header
+
+    await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_admission_control(event_loop):
+    admission = uita.ui_server.AdmissionControl(
+        rate=100, burst=2, max_concurrent=2, max_queued=2, loop=event_loop
+    )
+    admitted = []
+
+    async def admit(n):
+        await admission.acquire()
+        admitted.append(n)
+
+    # Bursts are admitted immediately, up to the concurrency limit
+    tasks = [event_loop.create_task(admit(n)) for n in range(4)]
+    await asyncio.sleep(0)
+    assert admitted == [0, 1]
+    # Excess connections are turned away
+    with pytest.raises(uita.exceptions.ClientError):
+        await admission.acquire()
+    # Waiting connections are admitted in order as capacity frees up
+    admission.release()
+    admission.release()
+    await asyncio.sleep(0.05)
+    assert admitted == [0, 1, 2, 3]
+    await asyncio.gather(*tasks)
+    # Cancelled connections give up their place in line
+    waiting = event_loop.create_task(admission.acquire())
+    await asyncio.sleep(0)
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    admission.release()
+    admission.release()
+    await asyncio.sleep(0.05)
+    assert admission._active == 0
+
+
 @pytest.mark.asyncio
 async def test_on_message(connection, event_loop):
     socket, user, server = connection
 
     @server.on_message(uita.message.ServerListGetMessage, require_active_server=False)
     async def test_message(event):
+        await asyncio.sleep(0.01, loop=event_loop)
         await event.socket.send("good")
 
+    @server.on_message(uita.message.ServerJoinMessage, require_active_server=False)
+    async def test_ordered_message(event):
+        await event.socket.send("ordered")
+
+    await socket.send(str(uita.message.ServerListGetMessage()))
+    assert await socket.recv() == "good"
+
+    # Events from a connection are run in the order their messages arrived
     await socket.send(str(uita.message.ServerListGetMessage()))
+    await socket.send(str(uita.message.HeartbeatMessage()))
+    await socket.send(str(uita.message.ServerJoinMessage("123")))
     assert await socket.recv() == "good"
+    assert await socket.recv() == "ordered"
+
+
+@pytest.mark.asyncio
+async def test_queued_server_join(connection, event_loop):
+    socket, user, server = connection
+    with patch("uita.server", new=server):
+        discord_server = uita.types.DiscordServer("1234567890", "Server Name", {}, {}, None)
+    uita.state.server_add(discord_server, Mock(loop=event_loop))
+
+    @server.on_message(uita.message.ServerListGetMessage, require_active_server=False)
+    async def test_slow_message(event):
+        await asyncio.sleep(0.05, loop=event_loop)
+
+    @server.on_message(uita.message.ServerJoinMessage, require_active_server=False)
+    async def test_join_message(event):
+        server.set_active_server(event.socket, event.message.server_id)
+
+    @server.on_message(uita.message.PlayQueueGetMessage)
+    async def test_get_message(event):
+        await event.socket.send(event.active_server.id)
+
+    # Events queued behind a server join see the server that was joined
+    await socket.send(str(uita.message.ServerListGetMessage()))
+    await socket.send(str(uita.message.ServerJoinMessage(discord_server.id)))
+    await socket.send(str(uita.message.PlayQueueGetMessage()))
+    assert await socket.recv() == discord_server.id
+
+
+@pytest.mark.asyncio
+async def test_concurrent_message(connection, event_loop):
+    socket, user, server = connection
+    search_query = server.on_message(
+        uita.message.SearchQueryMessage, require_active_server=False, concurrent=True
+    )
+    search_query(uita.server_events.search_query)
+    unblock = asyncio.Event(loop=event_loop)
+
+    @server.on_message(uita.message.ServerJoinMessage, require_active_server=False)
+    async def test_ordered_message(event):
+        await event.socket.send("ordered")
+
+    async def search(query, *args, **kwargs):
+        if query == "older":
+            await unblock.wait()
+        return []
+
+    with patch("uita.youtube_api.search", side_effect=search), \
+            patch("uita.server_events._search_cache", new=uita.youtube_api.SearchCache()), \
+            patch("uita.server_events.SEARCH_DEBOUNCE", new=0):
+        # Concurrent events don't hold up later ones, and newer searches supersede older ones
+        await socket.send(str(uita.message.SearchQueryMessage("older")))
+        await socket.send(str(uita.message.SearchQueryMessage("newer")))
+        await socket.send(str(uita.message.ServerJoinMessage("123")))
+        received = [await socket.recv(), await socket.recv()]
+        assert "ordered" in received
+        received.remove("ordered")
+        message = uita.message.parse(received[0])
+        assert isinstance(message, uita.message.SearchResultsMessage)
+        assert message.query == "newer"
+        unblock.set()
+        await asyncio.sleep(0.01, loop=event_loop)
+        assert len(uita.server_events._search_tasks) == 0
 
 
 @pytest.mark.asyncio
 async def test_send_all(connection):
     socket, user, server = connection
 
-    user.active_server_id = "123"
+    server.set_active_server(next(iter(server.connections)), "123")
+    assert user.active_server_id == "123"
 
     server.send_all(uita.message.ServerKickMessage(), "ABC")
     server.send_all(uita.message.HeartbeatMessage(), "123")
@@ -98,6 +280,128 @@ async def test_send_all(connection):
     assert isinstance(message, uita.message.HeartbeatMessage)
 
 
+@pytest.mark.asyncio
+async def test_outbox(event_loop):
+    sent = []
+    unblock = asyncio.Event(loop=event_loop)
+
+    async def send(data):
+        await unblock.wait()
+        sent.append(data)
+
+    async def close(**kwargs): ...
+
+    socket = Mock()
+    socket.send.side_effect = send
+    socket.close.side_effect = close
+    outbox = uita.ui_server.Outbox(socket, event_loop, max_size=3)
+
+    # Snapshots waiting to be sent are replaced by newer ones
+    outbox.put("first")
+    await asyncio.sleep(0.01)
+    outbox.put("queue 1", "play.queue.send")
+    outbox.put("kick")
+    outbox.put("queue 2", "play.queue.send")
+    unblock.set()
+    await asyncio.sleep(0.01)
+    assert sent == ["first", "kick", "queue 2"]
+
+    # Connections that fall too far behind are closed
+    unblock.clear()
+    for i in range(5):
+        outbox.put(str(i))
+    await asyncio.sleep(0.01)
+    assert socket.close.call_count == 1
+    unblock.set()
+    await asyncio.sleep(0.01)
+    assert sent == ["first", "kick", "queue 2"]
+
+
+@pytest.mark.asyncio
+async def test_event_send(config, event_loop):
+    sent = []
+    unblock = asyncio.Event(loop=event_loop)
+
+    async def send(data):
+        await unblock.wait()
+        sent.append(data)
+
+    socket = Mock(subprotocol=None)
+    socket.send.side_effect = send
+    outbox = uita.ui_server.Outbox(socket, event_loop)
+    event = uita.ui_server.Event(
+        uita.message.PlayStatusGetMessage(), None, socket, outbox, config, event_loop, None
+    )
+
+    # Replies are queued behind messages already waiting, replacing outdated snapshots
+    outbox.put("first")
+    await asyncio.sleep(0.01)
+    outbox.put("old status", uita.message.PlayStatusSendMessage.header)
+    await event.send(uita.message.PlayStatusSendMessage(uita.audio.Status.PAUSED))
+    unblock.set()
+    await asyncio.sleep(0.01)
+    assert sent == [
+        "first", str(uita.message.PlayStatusSendMessage(uita.audio.Status.PAUSED))
+    ]
+    outbox.close()
+
+
+@pytest.mark.asyncio
+async def test_pipeline(event_loop):
+    ran = []
+    unblock = asyncio.Event(loop=event_loop)
+
+    async def run(event):
+        await unblock.wait()
+        ran.append(event)
+
+    pipeline = uita.ui_server.Pipeline(event_loop, max_size=2)
+
+    # Events run one at a time in order, and can be waited on until they finish
+    pipeline.put(run, "first")
+    pipeline.put(run, "second")
+    assert pipeline.full
+    join = event_loop.create_task(pipeline.join())
+    await asyncio.sleep(0.01)
+    assert not join.done()
+    unblock.set()
+    await join
+    assert ran == ["first", "second"]
+    assert not pipeline.full
+    await pipeline.join()
+
+    # Failing events don't stop later ones from running
+    async def fail(event):
+        raise ValueError(event)
+    pipeline.put(fail, "failed")
+    pipeline.put(run, "third")
+    await pipeline.join()
+    assert ran == ["first", "second", "third"]
+
+    # Closed pipelines finish queued events, but don't accept any more
+    unblock.clear()
+    pipeline.put(run, "fourth")
+    pipeline.put(run, "fifth")
+    await asyncio.sleep(0.01)
+    pipeline.close()
+    pipeline.put(run, "sixth")
+    unblock.set()
+    await pipeline.join()
+    assert ran == ["first", "second", "third", "fourth", "fifth"]
+
+    # Cancelled pipelines discard queued events, releasing anything waiting on them
+    pipeline = uita.ui_server.Pipeline(event_loop)
+    unblock.clear()
+    pipeline.put(run, "seventh")
+    join = event_loop.create_task(pipeline.join())
+    await asyncio.sleep(0.01)
+    pipeline.cancel()
+    await asyncio.wait_for(join, 1, loop=event_loop)
+    unblock.set()
+    await asyncio.sleep(0.01)
+    assert ran == ["first", "second", "third", "fourth", "fifth"]
+
+
 @pytest.mark.asyncio
 async def test_verify_active_servers(connection, event_loop):
     socket, user, server = connection
@@ -105,23 +409,47 @@ async def test_verify_active_servers(connection, event_loop):
     with patch("uita.server", new=server):
         discord_server = uita.types.DiscordServer("1234567890", "Server Name", {}, {}, None)
     uita.state.server_add(discord_server, Mock(loop=event_loop))
+    server_socket = next(iter(server.connections))
 
     # Use a server ID that doesn't exist
-    user.active_server_id = "fakeid"
+    server.set_active_server(server_socket, "fakeid")
     await server.verify_active_servers()
     assert user.active_server_id is None
     assert isinstance(uita.message.parse(await socket.recv()), uita.message.ServerKickMessage)
 
     # Use a server that exists but does not have the user as a member
-    user.active_server_id = discord_server.id
-    await server.verify_active_servers()
+    server.set_active_server(server_socket, discord_server.id)
+    # Only the given server is checked
+    await server.verify_active_servers("fakeid")
+    assert user.active_server_id == discord_server.id
+    await server.verify_active_servers(discord_server.id)
     assert user.active_server_id is None
     assert isinstance(uita.message.parse(await socket.recv()), uita.message.ServerKickMessage)
+    assert discord_server.id not in server._server_connections
 
     # Use a server that has the user as a member
-    user.active_server_id = discord_server.id
+    server.set_active_server(server_socket, discord_server.id)
     uita.state.server_add_user(discord_server.id, user.id, user.name)
     await server.verify_active_servers()
     server.send_all(uita.message.HeartbeatMessage(), discord_server.id)
     assert user.active_server_id == discord_server.id
     assert isinstance(uita.message.parse(await socket.recv()), uita.message.HeartbeatMessage)
+
+
+@pytest.mark.asyncio
+async def test_verify_active_users(connection, event_loop):
+    socket, user, server = connection
+
+    with patch("uita.server", new=server):
+        discord_server = uita.types.DiscordServer("1234567890", "Server Name", {}, {}, None)
+    uita.state.server_add(discord_server, Mock(loop=event_loop))
+    uita.state.server_add_user(discord_server.id, user.id, user.name)
+    server.set_active_server(next(iter(server.connections)), discord_server.id)
+
+    # Users that are no longer members are found when checked on demand
+    with patch("uita.state.lazy_members", new=True), patch("uita.bot") as mock_bot:
+        mock_bot.get_guild.return_value = None
+        await server.verify_active_users()
+    assert user.active_server_id is None
+    assert user.id not in discord_server.users
+    assert isinstance(uita.message.parse(await socket.recv()), uita.message.ServerKickMessage)
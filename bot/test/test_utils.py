@@ -1,7 +1,9 @@
 import pytest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
+import asyncio
 import discord
+import os
 from pathlib import Path
 
 import uita.utils
@@ -22,6 +24,81 @@ async def test_dir_size(tmp_path):
     assert await uita.utils.dir_size(tmp_path) == 100
 
 
+@pytest.mark.asyncio
+async def test_single_flight(event_loop):
+    flights = uita.utils.SingleFlight()
+    calls, cancels = 0, 0
+    release = asyncio.Event(loop=event_loop)
+
+    async def work():
+        nonlocal calls, cancels
+        calls += 1
+        try:
+            await release.wait()
+        except asyncio.CancelledError:
+            cancels += 1
+            raise
+        return calls
+
+    async def settle():
+        for _ in range(5):
+            await asyncio.sleep(0, loop=event_loop)
+
+    # Identical keys share a single call
+    first = event_loop.create_task(flights.run("key", work, loop=event_loop))
+    second = event_loop.create_task(flights.run("key", work, loop=event_loop))
+    other = event_loop.create_task(flights.run("other", work, loop=event_loop))
+    await settle()
+    assert calls == 2
+
+    # Cancelling one caller leaves the shared call running for the others
+    first.cancel()
+    await settle()
+    assert "key" in flights
+    release.set()
+    assert await second == await other
+    assert first.cancelled()
+    assert cancels == 0
+    assert "key" not in flights
+
+    # Cancelling every caller cancels the shared call
+    release.clear()
+    abandoned = event_loop.create_task(flights.run("key", work, loop=event_loop))
+    await settle()
+    abandoned.cancel()
+    await settle()
+    assert "key" not in flights
+    assert calls == 3
+    assert cancels == 1
+
+
+def test_ttl_cache():
+    with patch("time.monotonic", return_value=0):
+        cache = uita.utils.TTLCache(2, 10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        # Least recently used entry is evicted first
+        cache.set("c", 3)
+        assert "b" not in cache
+        assert "a" in cache
+        assert len(cache) == 2
+        cache.set("d", 4, ttl=20)
+    # Entries expire after their time to live
+    with patch("time.monotonic", return_value=15):
+        assert cache.get("c") is None
+        assert cache.get("d") == 4
+        assert cache.pop("d") == 4
+        assert cache.pop("d") is None
+        assert len(cache) == 0
+        # Entries can be cleared selectively
+        cache.set(("a", 1), 1)
+        cache.set(("b", 1), 2)
+        cache.clear(lambda key: key[0] == "a")
+        assert ("a", 1) not in cache
+        assert cache.get(("b", 1)) == 2
+
+
 @pytest.mark.asyncio
 async def test_cache():
     cache_dir = Path(uita.utils.cache_dir())
@@ -43,6 +120,40 @@ async def test_cache():
     assert safe1_file.exists()
     assert safe2_file.exists()
 
+    # Least recently modified files are pruned first until the directory fits
+    old_file = cache_dir / "d"
+    new_file = cache_dir / "e"
+    old_file.write_bytes(b"0" * 10)
+    new_file.write_bytes(b"0" * 10)
+    os.utime(old_file, (0, 0))
+    assert await uita.utils.prune_cache_dir(max_size=10) == 10
+    assert not old_file.exists()
+    assert new_file.exists()
+
+    # Files with expired leases are pruned regardless of cache size
+    leased_file = cache_dir / "f"
+    leased_file.touch()
+    uita.utils.prune_cache_lease(str(leased_file), 60)
+    await uita.utils.prune_cache_dir(max_size=100)
+    assert leased_file.exists()
+    uita.utils.prune_cache_lease(str(leased_file), 0)
+    await uita.utils.prune_cache_dir(max_size=100)
+    assert not leased_file.exists()
+
+    # Files removed while pruning are skipped
+    vanishing_file = cache_dir / "g"
+    vanishing_file.touch()
+    uita.utils.prune_cache_lease(str(vanishing_file), 0)
+    real_stat = os.stat
+
+    def vanishing_stat(path, *args, **kwargs):
+        if path == str(vanishing_file) and vanishing_file.exists():
+            vanishing_file.unlink()
+        return real_stat(path, *args, **kwargs)
+    with patch("uita.utils.os.stat", side_effect=vanishing_stat), \
+            patch("uita.utils.os.remove", side_effect=FileNotFoundError):
+        await uita.utils.prune_cache_dir()
+
 
 def test_url_builders(config):
     assert uita.utils.build_client_url(config) == "http://localhost:23231"
@@ -101,3 +212,8 @@ def test_ffmpeg_version():
     # that fail to be parsed or are not found.
     version = uita.utils.ffmpeg_version()
     assert version is not None
+
+
+def test_shard_id():
+    assert uita.utils.shard_id(str(3 << 22), 2) == 1
+    assert uita.utils.shard_id(str((4 << 22) + 12345), 4) == 0
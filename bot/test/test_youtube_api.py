@@ -1,9 +1,12 @@
 import pytest
 from unittest.mock import Mock, patch
 
+import asyncio
 import json
 import re
+import time
 
+import uita.utils
 import uita.youtube_api
 
 
@@ -36,6 +39,127 @@ async def test_search(data_dir, event_loop):
         assert results[4]["uploader"] == "Uploader 5"
 
 
+def test_search_cache():
+    cache = uita.youtube_api.SearchCache()
+    cache.set("Choco", [
+        {"title": "Chocobanana"},
+        {"title": "Chocolate"},
+        {"title": "Chocobanana Remix"}
+    ])
+    # Matching is case and whitespace insensitive
+    assert len(cache.get(" choco  ", results=3)) == 3
+    # Refined queries are answered from the shorter cached query
+    assert cache.get("chocoban", results=2) == [
+        {"title": "Chocobanana"},
+        {"title": "Chocobanana Remix"}
+    ]
+    assert cache.get("choco remix", results=1) == [{"title": "Chocobanana Remix"}]
+    # Unless too few results remain
+    assert cache.get("chocoban", results=3) is None
+    assert cache.get("banana") is None
+
+
+@pytest.mark.asyncio
+async def test_playlist(event_loop):
+    pages = {
+        "": {"nextPageToken": "page2", "items": [
+            {"contentDetails": {"videoId": "vid1"}, "status": {"privacyStatus": "public"}},
+            {"contentDetails": {"videoId": "vid2"}, "status": {"privacyStatus": "private"}}
+        ]},
+        "page2": {"items": [
+            {"contentDetails": {"videoId": "vid3"}, "status": {"privacyStatus": "unlisted"}}
+        ]}
+    }
+    with patch("requests.get") as mock_get:
+        def find_page(url, headers):
+            assert "playlistId=PL1" in url
+            token = re.search("pageToken=([^&]*)", url).group(1)
+            mock_response = Mock(status_code=200)
+            mock_response.json.return_value = pages[token]
+            return mock_response
+        mock_get.side_effect = find_page
+
+        results = []
+        async for video_ids in uita.youtube_api.playlist("PL1", "real-key", loop=event_loop):
+            # Pages are only requested as they are consumed
+            assert mock_get.call_count == len(results) + 1
+            results.append(video_ids)
+        assert results == [["vid1"], ["vid3"]]
+
+
+@pytest.mark.asyncio
+async def test_scrape_coalesced(event_loop):
+    with patch("youtube_dl.YoutubeDL") as mock_ytdl:
+        with patch("uita.youtube_api._scrape_cache", new=uita.utils.TTLCache(10, 60)):
+            mock_ytdl.return_value.extract_info.return_value = {"id": "dQw4w9WgXcQ"}
+
+            urls = [
+                "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+                "https://youtu.be/dQw4w9WgXcQ",
+                "https://youtube.com/watch?v=dQw4w9WgXcQ&t=30"
+            ]
+            results = await asyncio.gather(
+                *[uita.youtube_api.scrape(url, loop=event_loop) for url in urls],
+                loop=event_loop
+            )
+            assert mock_ytdl.return_value.extract_info.call_count == 1
+            assert all(result["id"] == "dQw4w9WgXcQ" for result in results)
+
+            # Finished requests are briefly cached
+            await uita.youtube_api.scrape(urls[0], loop=event_loop)
+            assert mock_ytdl.return_value.extract_info.call_count == 1
+            with patch("time.monotonic", return_value=time.monotonic() + 120):
+                await uita.youtube_api.scrape(urls[0], loop=event_loop)
+            assert mock_ytdl.return_value.extract_info.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_prefetch(event_loop):
+    with patch("youtube_dl.YoutubeDL") as mock_ytdl:
+        with patch("uita.youtube_api._scrape_cache", new=uita.utils.TTLCache(10, 60)):
+            mock_ytdl.return_value.extract_info.side_effect = lambda url, **kwargs: {"id": url}
+            urls = [uita.youtube_api.build_url(video_id) for video_id in ["vid1", "vid2"]]
+
+            await uita.youtube_api.prefetch(urls, loop=event_loop)
+            assert mock_ytdl.return_value.extract_info.call_count == 2
+            result = await uita.youtube_api.scrape(urls[1], loop=event_loop)
+            assert result["id"] == urls[1]
+            assert mock_ytdl.return_value.extract_info.call_count == 2
+
+            # Cancelling a prefetch leaves scrapes that joined it running
+            urls = [uita.youtube_api.build_url(video_id) for video_id in ["vid3", "vid4"]]
+            prefetching = event_loop.create_task(uita.youtube_api.prefetch(urls, loop=event_loop))
+            await asyncio.sleep(0)
+            scraping = event_loop.create_task(uita.youtube_api.scrape(urls[0], loop=event_loop))
+            await asyncio.sleep(0)
+            prefetching.cancel()
+            result = await scraping
+            assert result["id"] == urls[0]
+            assert mock_ytdl.return_value.extract_info.call_count == 3
+
+
+def test_parse_ids():
+    assert uita.youtube_api.parse_video_id("https://youtube.com/watch?v=vid1vid1vid") == (
+        "vid1vid1vid"
+    )
+    assert uita.youtube_api.parse_video_id("https://m.youtube.com/watch?v=vid1vid1vid&t=5") == (
+        "vid1vid1vid"
+    )
+    assert uita.youtube_api.parse_video_id("https://youtu.be/vid1vid1vid") == "vid1vid1vid"
+    assert uita.youtube_api.parse_video_id("https://www.youtube.com/embed/vid1vid1vid") == (
+        "vid1vid1vid"
+    )
+    assert uita.youtube_api.parse_video_id("https://youtube.com/playlist?list=PL1") is None
+    assert uita.youtube_api.parse_video_id("https://example.com/watch?v=vid1vid1vid") is None
+
+    assert uita.youtube_api.parse_playlist_id("https://youtube.com/playlist?list=PL1") == "PL1"
+    assert uita.youtube_api.parse_playlist_id(
+        "https://www.youtube.com/watch?v=vid1vid1vid&list=PL1"
+    ) == "PL1"
+    assert uita.youtube_api.parse_playlist_id("https://youtube.com/watch?v=vid1vid1vid") is None
+    assert uita.youtube_api.parse_playlist_id("https://example.com/playlist?list=PL1") is None
+
+
 def test_parse_time():
     assert uita.youtube_api.parse_time("PT5S") == 5
     assert uita.youtube_api.parse_time("PT1M0S") == 60
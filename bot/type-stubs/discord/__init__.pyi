@@ -36,10 +36,12 @@ class Client:
         self,
         *,
         loop: Optional[asyncio.AbstractEventLoop] = ...,
-        intents: Optional["Intents"] = ...
+        intents: Optional["Intents"] = ...,
+        chunk_guilds_at_startup: bool = ...
     ) -> None: ...
     def event(self, coro: Callable[..., Awaitable[None]]) -> Callable[..., Awaitable[None]]: ...
     def get_guild(self, id: int) -> "Optional[Guild]": ...
+    def is_ready(self) -> bool: ...
 
     async def change_presence(
         self,
@@ -72,9 +74,14 @@ class Client:
 
     guilds: List["Guild"]
     loop: asyncio.AbstractEventLoop
+    shard_count: Optional[int]
     user: "User"
 
 
+class AutoShardedClient(Client):
+    shard_ids: Optional[List[int]]
+
+
 class Colour:
     ...
 
@@ -111,15 +118,21 @@ class Game:
 class Guild:
     def get_channel(self, id: int) -> Optional[abc.GuildChannel]: ...
     def get_member(self, id: int) -> "Optional[Member]": ...
+    async def chunk(self, *, cache: bool = ...) -> List["Member"]: ...
+    async def fetch_member(self, member_id: int) -> "Member": ...
     async def leave(self) -> None: ...
 
     channels: List[abc.GuildChannel]
+    chunked: bool
     id: int
     me: "Member"
     members: List["Member"]
     name: str
     icon: Optional[str]
+    owner: Optional["Member"]
+    owner_id: int
     roles: List["Role"]
+    shard_id: int
     system_channel: Optional["TextChannel"]
 
 
@@ -183,10 +196,15 @@ class PCMVolumeTransformer(AudioSource):
     def __init__(self, original: AudioSource, volume: float = ...) -> None: ...
 
 
+class PermissionOverwrite:
+    def is_empty(self) -> bool: ...
+
+
 class Permissions:
     administrator: bool
     connect: bool
     read_messages: bool
+    value: int
 
 
 class Reaction:
@@ -195,8 +213,11 @@ class Reaction:
 
 
 class Role:
+    def is_default(self) -> bool: ...
+
     guild: Guild
     id: int
+    members: List[Member]
     name: str
     permissions: Permissions
 
@@ -1,5 +1,7 @@
-from discord import Embed, File, Guild, Member, Message, Permissions, ChannelType
-from typing import List, Optional
+from discord import (
+    Embed, File, Guild, Member, Message, PermissionOverwrite, Permissions, ChannelType, Role
+)
+from typing import List, Optional, Union
 
 
 class Messageable:
@@ -18,6 +20,7 @@ class Messageable:
 
 class GuildChannel(Messageable):
     def permissions_for(self, member: Member) -> Permissions: ...
+    def overwrites_for(self, obj: Union[Role, Member]) -> PermissionOverwrite: ...
     category_id: int
     guild: Guild
     id: int
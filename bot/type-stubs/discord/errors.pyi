@@ -4,3 +4,7 @@ class HTTPException(Exception):
 
 class Forbidden(HTTPException):
     ...
+
+
+class NotFound(HTTPException):
+    ...
@@ -0,0 +1,7 @@
+from typing import Any
+
+
+def packb(o: Any, use_bin_type: bool = ...) -> bytes: ...
+
+
+def unpackb(packed: bytes, raw: bool = ...) -> Any: ...
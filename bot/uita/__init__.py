@@ -6,14 +6,14 @@ __copyright__ = "2018, Dominic Bowden"
 __license__ = "ISC"
 __url__ = "https://github.com/tedle/uitabot"
 
-from discord import Client, Intents
+from discord import AutoShardedClient, Intents
 from uita.ui_server import Server
 from uita.types import DiscordState
 import asyncio
 
 # Use a bunch of globals because of decorator class methods
 loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
-bot: Client = Client(
+bot: AutoShardedClient = AutoShardedClient(
     loop=loop,
     intents=Intents(
         guilds=True,          # List which guilds bot is in
@@ -21,7 +21,9 @@ bot: Client = Client(
         voice_states=True,    # Auto-pause when voice channel is empty
         guild_messages=True,  # Chat commands
         guild_reactions=True  # Chat command UI
-    )
+    ),
+    # Members are loaded by uita.bot_events, unless they are to be fetched as needed
+    chunk_guilds_at_startup=False
 )
 server: Server = Server()
 state: DiscordState = DiscordState()
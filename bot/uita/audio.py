@@ -12,14 +12,21 @@ import subprocess
 import threading
 import time
 import uuid
-from typing import cast, Any, Awaitable, Callable, Deque, List, Optional
+from typing import cast, Any, Awaitable, Callable, Deque, List, Optional, Tuple
 
 import uita.exceptions
+import uita.utils
 import uita.youtube_api
 
 import logging
 log = logging.getLogger(__name__)
 
+# Title and duration of probed files indexed by file name and size. Uploads are named after the
+# hash of their contents, so results can be reused whenever the same file is queued again
+_probe_cache: "uita.utils.TTLCache[Tuple[str, int], Tuple[str, float]]" = uita.utils.TTLCache(
+    maxsize=1000, ttl=24 * 60 * 60
+)
+
 
 class Track():
     """Container for audio resource metadata.
@@ -45,6 +52,8 @@ class Track():
         offset (float): Offset in seconds to start track from.
 
     """
+    __slots__ = ("id", "path", "user", "title", "duration", "live", "local", "url", "offset")
+
     def __init__(
         self,
         path: str,
@@ -87,6 +96,8 @@ class Queue():
     Attributes:
         loop (asyncio.AbstractEventLoop): Event loop for audio tasks to run in.
         status (uita.audio.Status): Current playback status (playing, paused, etc).
+        version (int): Incremented whenever the queue or playback status changes. Offsets of
+            playing tracks change without it.
 
     """
     QueueCallbackType = Callable[
@@ -110,6 +121,7 @@ class Queue():
 
         self.loop = loop or asyncio.get_event_loop()
         self.status = Status.PAUSED
+        self.version = 0
         self._now_playing: Optional[Track] = None
         self._queue: Deque[Track] = collections.deque()
         self._queue_lock = asyncio.Lock(loop=self.loop)
@@ -176,6 +188,7 @@ class Queue():
                     self._play_start_time = None
                 self._queue.appendleft(self._now_playing)
                 self._now_playing = None
+                self.version += 1
             self._play_task.cancel()
             await self._play_task
         self._end_stream()
@@ -198,6 +211,27 @@ class Queue():
             raise uita.exceptions.ClientError(
                 uita.message.ErrorFileInvalidMessage("Invalid audio format")
             )
+        key = (os.path.basename(filename), os.path.getsize(filename))
+        probe = _probe_cache.get(key)
+        if probe is None:
+            probe = await self._probe_file(filename)
+            _probe_cache.set(key, probe)
+        title, duration = probe
+        log.info(f"[{user.name}:{user.id}] Enqueue [Local]{title}, {duration}s")
+        # This check cannot have any awaits between it and the following queue.append()s
+        if self.queue_full():
+            raise uita.exceptions.ClientError(uita.message.ErrorQueueFullMessage())
+        self._queue.append(Track(
+            filename,
+            uita.types.intern_user(user),
+            title,
+            duration,
+            live=False,
+            local=True
+        ))
+        await self._notify_queue_change(user)
+
+    async def _probe_file(self, filename: str) -> Tuple[str, float]:
         completed_probe_process = await self.loop.run_in_executor(
             None,
             lambda: subprocess.run([
@@ -228,31 +262,37 @@ class Queue():
                 tags.get("artist", "Unknown artist"),
                 tags.get("title", "Unknown title")
             )
-        log.info(f"[{user.name}:{user.id}] Enqueue [Local]{title}, {probe['format']['duration']}s")
-        # This check cannot have any awaits between it and the following queue.append()s
-        if self.queue_full():
-            raise uita.exceptions.ClientError(uita.message.ErrorQueueFullMessage())
-        self._queue.append(Track(
-            filename,
-            user,
-            title,
-            float(probe["format"]["duration"]),
-            live=False,
-            local=True
-        ))
-        await self._notify_queue_change(user)
+        return title, float(probe["format"]["duration"])
 
-    async def enqueue_url(self, url: str, user: "uita.types.DiscordUser") -> None:
+    async def enqueue_url(
+        self,
+        url: str,
+        user: "uita.types.DiscordUser",
+        api_key: Optional[str] = None,
+        referrer: Optional[str] = None
+    ) -> None:
         """Queues a URL to be played by the running playlist task.
 
         Args:
             url: URL for audio resource to be played.
             user: User that requested track.
+            api_key: API key for Youtube requests. When given, playlists are read a page at a
+                time and start playing before they have finished loading. Defaults to ``None``
+                which loads the entire playlist using youtube-dl first.
+            referrer: Referrer for HTTP requests, in case API restrictions are in place.
 
         Raises:
             uita.exceptions.ClientError: If called with an unusable audio path.
 
         """
+        playlist_id = uita.youtube_api.parse_playlist_id(url)
+        if (
+            api_key is not None
+            and playlist_id is not None
+            and uita.youtube_api.parse_video_id(url) is None
+        ):
+            await self._enqueue_playlist(playlist_id, user, api_key, referrer)
+            return
         info = await uita.youtube_api.scrape(url, loop=self.loop)
         # This check cannot have any awaits between it and the following queue.append()s
         if self.queue_full():
@@ -262,7 +302,8 @@ class Queue():
                      f"{info['acodec']}@{info['abr']}abr, {info['duration']}s")
             self._queue.append(Track(
                 info["url"],
-                user,
+                # Shared between every track the user queues, playlists can add hundreds
+                uita.types.intern_user(user),
                 info["title"],
                 float(info["duration"]),
                 info["is_live"] or False,  # is_live is either True or None?? Thanks ytdl
@@ -278,6 +319,22 @@ class Queue():
         else:
             raise uita.exceptions.ClientError(uita.message.ErrorUrlInvalidMessage())
 
+    async def _enqueue_playlist(
+        self,
+        playlist_id: str,
+        user: "uita.types.DiscordUser",
+        api_key: str,
+        referrer: Optional[str]
+    ) -> None:
+        pages = uita.youtube_api.playlist(playlist_id, api_key, referrer, loop=self.loop)
+        try:
+            async for video_ids in pages:
+                for video_id in video_ids:
+                    await self.enqueue_url(uita.youtube_api.build_url(video_id), user)
+        finally:
+            # Stop paging immediately if the queue fills up or a video can't be played
+            await pages.aclose()
+
     async def move(self, track_id: str, position: int) -> None:
         """Moves a track to a new position in the playback queue.
 
@@ -337,6 +394,7 @@ class Queue():
 
     def _change_status(self, status: Status) -> None:
         self.status = status
+        self.version += 1
         self._on_status_change(self.status)
 
     async def _play_loop(self, voice: discord.VoiceClient) -> None:
@@ -378,6 +436,7 @@ class Queue():
 
     async def _notify_queue_change(self, user: Optional["uita.types.DiscordUser"] = None) -> None:
         self._queue_update_flag.set()
+        self.version += 1
         await self._on_queue_change(self.queue(), user)
 
     def _end_stream(self) -> None:
@@ -1,11 +1,17 @@
 """Authenticates Discord users."""
 
 import asyncio
-from typing import NamedTuple, Optional
+import hmac
+import time
+from typing import NamedTuple, Optional, Set, Tuple
 
 import uita.discord_api
 import uita.exceptions
 import uita.types
+import uita.utils
+
+import logging
+log = logging.getLogger(__name__)
 
 
 class Session(NamedTuple):
@@ -24,11 +30,107 @@ class Session(NamedTuple):
     secret: str
 
 
+class SessionCache():
+    """Remembers recently verified sessions so that returning users can be authenticated locally.
+
+    Args:
+        ttl: Time in seconds that a verified session is trusted without contacting Discord.
+        refresh: Time in seconds after which a cached session is re-verified in the background.
+        maxsize: Maximum number of sessions to remember.
+
+    Attributes:
+        refresh (float): Time in seconds after which a cached session is re-verified in the
+            background.
+
+    """
+    def __init__(self, ttl: float = 3600, refresh: float = 300, maxsize: int = 10000) -> None:
+        self.refresh = refresh
+        # Maps session handles to session secret, user and time of verification
+        self._sessions: uita.utils.TTLCache[str, Tuple[str, uita.types.DiscordUser, float]] = (
+            uita.utils.TTLCache(maxsize, ttl)
+        )
+        self._refreshing: Set[str] = set()
+
+    def get(self, session: Session) -> Optional[uita.types.DiscordUser]:
+        """Retrieves the user of a verified session.
+
+        Args:
+            session: Session to look up.
+
+        Returns:
+            A new user object for the session owner, or ``None`` if the session is unknown.
+
+        """
+        entry = self._sessions.get(str(session.handle))
+        if entry is None or not hmac.compare_digest(entry[0], session.secret):
+            return None
+        user = entry[1]
+        # Users are per connection, so hand out copies that can be modified freely
+        return uita.types.DiscordUser(user.id, user.name, user.avatar, None)
+
+    def add(self, session: Session, user: uita.types.DiscordUser) -> None:
+        """Stores a freshly verified session.
+
+        Args:
+            session: Verified session.
+            user: Owner of session.
+
+        """
+        handle = str(session.handle)
+        self._sessions.set(handle, (session.secret, user, time.monotonic()))
+        self._refreshing.discard(handle)
+
+    def remove(self, session: Session) -> None:
+        """Forgets a session, such as after it has expired or been revoked.
+
+        Args:
+            session: Session to forget.
+
+        """
+        handle = str(session.handle)
+        self._sessions.pop(handle)
+        self._refreshing.discard(handle)
+
+    def claim_refresh(self, session: Session) -> bool:
+        """Checks whether a cached session is due to be verified again.
+
+        Only the first caller is told to refresh, until :meth:`add`, :meth:`remove` or
+        :meth:`release_refresh` is called for the session.
+
+        Args:
+            session: Cached session.
+
+        Returns:
+            ``True`` if the caller should re-verify the session, ``False`` otherwise.
+
+        """
+        handle = str(session.handle)
+        entry = self._sessions.get(handle)
+        if (
+            entry is None
+            or handle in self._refreshing
+            or time.monotonic() - entry[2] < self.refresh
+        ):
+            return False
+        self._refreshing.add(handle)
+        return True
+
+    def release_refresh(self, session: Session) -> None:
+        """Allows a session to be refreshed again after a refresh failed to complete.
+
+        Args:
+            session: Cached session.
+
+        """
+        self._refreshing.discard(str(session.handle))
+
+
 async def verify_session(
     session: Session,
     database: "uita.database.Database",
     config: uita.config.Config,
-    loop: Optional[asyncio.AbstractEventLoop] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None,
+    cache: Optional[SessionCache] = None
 ) -> uita.types.DiscordUser:
     """Authenticates a user session against sessions database and Discord API.
 
@@ -37,6 +139,8 @@ async def verify_session(
         database: Database containing valid sessions.
         config: Configuration options containing API keys.
         loop: Event loop to attach blocking request threads to.
+        cache: Cache of verified sessions. When given, recently verified sessions are
+            authenticated without contacting Discord and are re-verified in the background.
 
     Returns:
         User object of authenticated user.
@@ -46,7 +150,39 @@ async def verify_session(
 
     """
     loop = loop or asyncio.get_event_loop()
-    token = database.get_access_token(session)
+    if cache is None:
+        return await _verify_session(session, database, loop)
+    user = cache.get(session)
+    if user is None:
+        user = await _verify_session(session, database, loop)
+        cache.add(session, user)
+        return user
+    if cache.claim_refresh(session):
+        loop.create_task(_refresh_session(session, database, loop, cache))
+    return user
+
+
+async def _refresh_session(
+    session: Session,
+    database: "uita.database.Database",
+    loop: asyncio.AbstractEventLoop,
+    cache: SessionCache
+) -> None:
+    try:
+        cache.add(session, await _verify_session(session, database, loop))
+    except uita.exceptions.AuthenticationError:
+        cache.remove(session)
+    except Exception:
+        log.warning("Failed to refresh session", exc_info=True)
+        cache.release_refresh(session)
+
+
+async def _verify_session(
+    session: Session,
+    database: "uita.database.Database",
+    loop: asyncio.AbstractEventLoop
+) -> uita.types.DiscordUser:
+    token = await database.get_access_token(session)
     if token is not None:
         try:
             user = await uita.discord_api.get("/users/@me", token, loop)
@@ -57,7 +193,7 @@ async def verify_session(
                 active_server_id=None
             )
         except uita.exceptions.AuthenticationError:
-            database.delete_session(session)
+            await database.delete_session(session)
     raise uita.exceptions.AuthenticationError("Session authentication failed")
 
 
@@ -86,7 +222,7 @@ async def verify_code(
     """
     loop = loop or asyncio.get_event_loop()
     api_data = await uita.discord_api.auth(code, config, loop)
-    return database.add_session(
+    return await database.add_session(
         api_data["access_token"],
         api_data["expires_in"]
     )
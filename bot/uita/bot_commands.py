@@ -207,86 +207,98 @@ async def search(message: discord.Message, params: str) -> None:
             description=description,
             color=_EMBED_COLOUR
         )
-        # Display the results to the user
-        await response.edit(
-            content=f"{_EMOJI['wait']} Choose your future song",
-            embed=embed_results
-        )
+        # Resolve the results in the background so the chosen one can be enqueued immediately
+        prefetching = uita.bot.loop.create_task(uita.youtube_api.prefetch(
+            [result["url"] for result in results[:results_found]],
+            loop=uita.bot.loop
+        ))
+        try:
+            # Display the results to the user
+            await response.edit(
+                content=f"{_EMOJI['wait']} Choose your future song",
+                embed=embed_results
+            )
 
-        # Build a responsive UI out of emoji reactions
-        async def add_reactions() -> None:
-            for i in range(results_found):
-                emoji = _EMOJI["numbers"][i+1]
-                await response.add_reaction(emoji)
-        # Run the task separately so if a reaction is clicked while the loop is running we will
-        # still respond to it
-        uita.bot.loop.create_task(add_reactions())
-
-        # Wait for the user to make a choice
-        def reaction_predicate(reaction: discord.Reaction, user: discord.Member) -> bool:
-            valid_emoji = [_EMOJI["numbers"][i+1] for i in range(results_found)]
-            return (
-                reaction.message.id == response.id
-                and user.id == message.author.id
-                and reaction.emoji in valid_emoji
+            # Build a responsive UI out of emoji reactions
+            async def add_reactions() -> None:
+                for i in range(results_found):
+                    emoji = _EMOJI["numbers"][i+1]
+                    await response.add_reaction(emoji)
+            # Run the task separately so if a reaction is clicked while the loop is running we
+            # will still respond to it
+            uita.bot.loop.create_task(add_reactions())
+
+            # Wait for the user to make a choice
+            def reaction_predicate(reaction: discord.Reaction, user: discord.Member) -> bool:
+                valid_emoji = [_EMOJI["numbers"][i+1] for i in range(results_found)]
+                return (
+                    reaction.message.id == response.id
+                    and user.id == message.author.id
+                    and reaction.emoji in valid_emoji
+                )
+            try:
+                reaction, _ = await uita.bot.wait_for(
+                    "reaction_add",
+                    timeout=30.0,
+                    check=reaction_predicate
+                )
+            except asyncio.TimeoutError:
+                await response.delete()
+                return
+            # Translate the raw emoji code back into a choice index
+            choice = reaction.emoji
+            choice_index = None
+            for index, value in _EMOJI["numbers"].items():
+                if choice == value:
+                    choice_index = index - 1
+            if choice_index is None or choice_index < 0 or choice_index > results_found:
+                await response.edit(
+                    content=f"{_EMOJI['error']} There were unicode problems, sorry!"
+                )
+                return
+            # We finally have a song to queue!
+            song = results[choice_index]
+            # Load it up...
+            voice = uita.state.voice_connections[str(message.guild.id)]
+            user = uita.types.DiscordUser(
+                str(message.author.id),
+                message.author.name,
+                str(message.author.avatar_url),
+                str(message.guild.id)
             )
-        try:
-            reaction, _ = await uita.bot.wait_for(
-                "reaction_add",
-                timeout=30.0,
-                check=reaction_predicate
+            # Stop resolving the other results, the choice joins any request already in progress
+            prefetching.cancel()
+            await voice.enqueue_url(song["url"], user)
+            # Build an embedded (nice looking) message that describes the song
+            song_info = discord.Embed(
+                color=_EMBED_COLOUR
             )
-        except asyncio.TimeoutError:
-            await response.delete()
-            return
-        # Translate the raw emoji code back into a choice index
-        choice = reaction.emoji
-        choice_index = None
-        for index, value in _EMOJI["numbers"].items():
-            if choice == value:
-                choice_index = index - 1
-        if choice_index is None or choice_index < 0 or choice_index > results_found:
-            await response.edit(content=f"{_EMOJI['error']} There were unicode problems, sorry!")
-            return
-        # We finally have a song to queue!
-        song = results[choice_index]
-        # Load it up...
-        voice = uita.state.voice_connections[str(message.guild.id)]
-        user = uita.types.DiscordUser(
-            str(message.author.id),
-            message.author.name,
-            str(message.author.avatar_url),
-            str(message.guild.id)
-        )
-        await voice.enqueue_url(song["url"], user)
-        # Build an embedded (nice looking) message that describes the song
-        song_info = discord.Embed(
-            color=_EMBED_COLOUR
-        )
-        song_info.set_author(
-                name=song["title"],
-                url=song["url"]
-        )
-        song_info.set_thumbnail(url=song["thumbnail"])
-        song_info.add_field(
-            name="Uploader",
-            value=song["uploader"],
-            inline=True
-        )
-        song_info.add_field(
-            name="Duration",
-            value="Live" if song["live"] else "{:0>2}:{:0>2}:{:0>2}".format(
-                int(song["duration"] / (60 * 60)),
-                int((song["duration"] / 60) % 60),
-                int(song["duration"] % 60)
-            ),
-            inline=True
-        )
-        # Finally display the enqueued song to the user
-        await response.edit(
-            content=f"{_EMOJI['ok']} Enqueued",
-            embed=song_info
-        )
+            song_info.set_author(
+                    name=song["title"],
+                    url=song["url"]
+            )
+            song_info.set_thumbnail(url=song["thumbnail"])
+            song_info.add_field(
+                name="Uploader",
+                value=song["uploader"],
+                inline=True
+            )
+            song_info.add_field(
+                name="Duration",
+                value="Live" if song["live"] else "{:0>2}:{:0>2}:{:0>2}".format(
+                    int(song["duration"] / (60 * 60)),
+                    int((song["duration"] / 60) % 60),
+                    int(song["duration"] % 60)
+                ),
+                inline=True
+            )
+            # Finally display the enqueued song to the user
+            await response.edit(
+                content=f"{_EMOJI['ok']} Enqueued",
+                embed=song_info
+            )
+        finally:
+            prefetching.cancel()
     except uita.exceptions.ClientError as error:
         if error.message.header == uita.message.ErrorQueueFullMessage.header:
             await response.edit(content=f"{_EMOJI['error']} Queue is full, sorry!")
@@ -377,6 +389,6 @@ async def set_role(message: discord.Message, params: str) -> None:
             return
         role = str(role_search.id)
 
-    uita.state.server_set_role(str(message.guild.id), role)
-    await uita.bot_events.on_guild_update(message.guild, message.guild)
+    await uita.state.server_set_role(str(message.guild.id), role)
+    await uita.bot_events.update_members(message.guild, message.guild.members)
     await message.channel.send(f"{_EMOJI['ok']} Updated role required for using bot commands")
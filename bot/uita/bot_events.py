@@ -1,7 +1,8 @@
 """Event triggers for Discord client to synchronize API state with uitabot."""
 import asyncio
 import discord
-from typing import Any, Awaitable, Callable
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+from typing_extensions import Final
 
 import uita.bot_commands
 import uita.types
@@ -11,20 +12,127 @@ import uita
 import logging
 log = logging.getLogger(__name__)
 
+UPDATE_DELAY: Final = 0.25
+"""Seconds that guild changes are collected for before clients are updated, so that bursts of
+events such as mass permission edits only cause one update."""
+
+
+class _PendingUpdates():
+    def __init__(self) -> None:
+        # Guilds to re-check every channel of, and guilds to send new channel lists for
+        self.recheck_channels: Dict[str, discord.Guild] = {}
+        self.sync_channels: Dict[str, discord.Guild] = {}
+        # Guilds to re-check members of, with the members by ID or None for every member
+        self.recheck_members: Dict[
+            str, Tuple[discord.Guild, Optional[Dict[int, discord.Member]]]
+        ] = {}
+        # Servers to check the users of, where None means every server
+        self.verify_servers: Set[Optional[str]] = set()
+        self.flush_task: Optional[asyncio.Task[None]] = None
+
+
+_pending = _PendingUpdates()
+
 
 def bot_ready(function: Callable[..., Awaitable[None]]) -> Callable[..., Awaitable[None]]:
     """Decorator that awaits execution of a function until Discord client is ready."""
     async def wrapper(*args: Any, **kwargs: Any) -> None:
         await uita.bot.wait_until_ready()
+        # Anything that happens while members are loading is included when state is initialized
+        if not uita.state.initialized:
+            return
         await function(*args, **kwargs)
     wrapper.__name__ = function.__name__
     return wrapper
 
 
+async def _load_members(guilds: Iterable[discord.Guild]) -> None:
+    # Members are fetched as needed instead when loaded lazily
+    if uita.state.lazy_members:
+        return
+    await asyncio.gather(
+        *[guild.chunk() for guild in guilds if not guild.chunked],
+        loop=uita.bot.loop
+    )
+
+
+def _schedule_flush() -> None:
+    if _pending.flush_task is None:
+        _pending.flush_task = uita.bot.loop.create_task(_flush_later())
+
+
+async def _flush_later() -> None:
+    await asyncio.sleep(UPDATE_DELAY, loop=uita.bot.loop)
+    _pending.flush_task = None
+    await _flush()
+
+
+async def flush_updates() -> None:
+    """Immediately applies guild changes that are waiting to be sent to clients."""
+    if _pending.flush_task is not None:
+        _pending.flush_task.cancel()
+        _pending.flush_task = None
+    await _flush()
+
+
+async def _flush() -> None:
+    recheck_channels, _pending.recheck_channels = _pending.recheck_channels, {}
+    sync_channels, _pending.sync_channels = _pending.sync_channels, {}
+    recheck_members, _pending.recheck_members = _pending.recheck_members, {}
+    for guild_id, (guild, members) in recheck_members.items():
+        if guild_id in uita.state.servers:
+            await update_members(guild, guild.members if members is None else members.values())
+    verify_servers, _pending.verify_servers = _pending.verify_servers, set()
+    for guild_id, guild in recheck_channels.items():
+        # Guild may have been left since
+        if guild_id in uita.state.servers and _check_channels(guild, guild.channels):
+            sync_channels[guild_id] = guild
+    for guild_id, guild in sync_channels.items():
+        if guild_id in uita.state.servers:
+            _sync_channels(guild)
+    # Kick any displaced users
+    if None in verify_servers:
+        await uita.server.verify_active_servers()
+    else:
+        for server_id in verify_servers:
+            await uita.server.verify_active_servers(server_id)
+
+
+def _queue_recheck_channels(guild: discord.Guild) -> None:
+    _pending.recheck_channels[str(guild.id)] = guild
+    _schedule_flush()
+
+
+def _queue_sync_channels(guild: discord.Guild) -> None:
+    _pending.sync_channels[str(guild.id)] = guild
+    _schedule_flush()
+
+
+def _queue_recheck_members(
+    guild: discord.Guild,
+    members: Optional[Iterable[discord.Member]] = None
+) -> None:
+    guild_id = str(guild.id)
+    pending = _pending.recheck_members.get(guild_id, (guild, {}))[1]
+    if members is None:
+        pending = None
+    elif pending is not None:
+        pending.update((member.id, member) for member in members)
+    _pending.recheck_members[guild_id] = (guild, pending)
+    _schedule_flush()
+
+
+def _queue_verify_servers(guild: Optional[discord.Guild] = None) -> None:
+    _pending.verify_servers.add(str(guild.id) if guild is not None else None)
+    _schedule_flush()
+
+
 @uita.bot.event
 async def on_ready() -> None:
     log.info("Bot connected to Discord")
+    await _load_members(uita.bot.guilds)
     uita.state.initialize_from_bot(uita.bot)
+    uita.server.database.on_server_role = _on_server_role
     await uita.bot_commands.set_prefix(".")
 
     if uita.server.config.bot.trial_mode.enabled:
@@ -36,6 +144,24 @@ async def on_ready() -> None:
         await asyncio.gather(*tasks, loop=uita.bot.loop)
 
 
+@uita.bot.event
+async def on_shard_ready(shard_id: int) -> None:
+    # Only resync after reconnecting, the first time is handled by on_ready for every shard
+    if uita.bot.is_ready():
+        log.info(f"Bot reconnected to Discord shard {shard_id}")
+        await _load_members(guild for guild in uita.bot.guilds if guild.shard_id == shard_id)
+        uita.state.initialize_shard_from_bot(uita.bot, shard_id)
+        _queue_verify_servers()
+
+
+def _on_server_role(server_id: str, role_id: Optional[str]) -> None:
+    # Role was changed by another process sharing the database
+    uita.state.server_update_role(server_id, role_id)
+    guild = uita.bot.get_guild(int(server_id))
+    if guild is not None and server_id in uita.state.servers:
+        _queue_recheck_members(guild)
+
+
 def _sync_channels(guild: discord.Guild) -> None:
     voice_channels = [
         channel for channel in uita.state.servers[str(guild.id)].channels.values()
@@ -48,6 +174,66 @@ def _verify_member(member: discord.Member) -> bool:
     return uita.utils.verify_user_permissions(member, role)
 
 
+def update_channels(guild: discord.Guild, channels: Iterable[discord.abc.GuildChannel]) -> None:
+    """Re-checks the visibility of some server channels after a permission change.
+
+    Connected clients are only sent a new channel list if any visibility changed, once the
+    current burst of guild changes is over.
+
+    Args:
+        guild: discord.py server that channels belong to.
+        channels: discord.py channels to re-check.
+
+    """
+    if _check_channels(guild, channels):
+        _queue_sync_channels(guild)
+
+
+def _check_channels(guild: discord.Guild, channels: Iterable[discord.abc.GuildChannel]) -> bool:
+    server = uita.state.servers[str(guild.id)]
+    changed = False
+    for channel in channels:
+        visible = uita.utils.verify_channel_visibility(channel, guild.me)
+        if visible and str(channel.id) not in server.channels:
+            discord_channel = uita.types.DiscordChannel(
+                str(channel.id), channel.name, channel.type, str(channel.category_id),
+                channel.position
+            )
+            uita.state.server_add_channel(server.id, discord_channel)
+            changed = True
+        elif not visible and str(channel.id) in server.channels:
+            uita.state.server_remove_channel(server.id, str(channel.id))
+            changed = True
+    return changed
+
+
+async def update_members(guild: discord.Guild, members: Iterable[discord.Member]) -> None:
+    """Re-checks the bot command access of some server members after a permission change.
+
+    Args:
+        guild: discord.py server that members belong to.
+        members: discord.py members to re-check.
+
+    """
+    server = uita.state.servers[str(guild.id)]
+    removed = False
+    checked = set()
+    for member in members:
+        checked.add(str(member.id))
+        if uita.utils.verify_user_permissions(member, server.role):
+            uita.state.server_add_user(server.id, str(member.id), member.name)
+        elif str(member.id) in server.users:
+            uita.state.server_remove_user(server.id, str(member.id))
+            removed = True
+    # Users checked on demand may not be cached by the bot, so fetch them again
+    if uita.state.lazy_members:
+        for user_id in [user_id for user_id in server.users if user_id not in checked]:
+            if not await uita.state.server_verify_user(server.id, user_id, uita.bot, True):
+                removed = True
+    if removed:
+        _queue_verify_servers(guild)
+
+
 @uita.bot.event
 @bot_ready
 async def on_guild_channel_create(channel: discord.abc.GuildChannel) -> None:
@@ -57,14 +243,14 @@ async def on_guild_channel_create(channel: discord.abc.GuildChannel) -> None:
         str(channel.id), channel.name, channel.type, str(channel.category_id), channel.position
     )
     uita.state.server_add_channel(str(channel.guild.id), discord_channel)
-    _sync_channels(channel.guild)
+    _queue_sync_channels(channel.guild)
 
 
 @uita.bot.event
 @bot_ready
 async def on_guild_channel_delete(channel: discord.abc.GuildChannel) -> None:
     uita.state.server_remove_channel(str(channel.guild.id), str(channel.id))
-    _sync_channels(channel.guild)
+    _queue_sync_channels(channel.guild)
 
 
 @uita.bot.event
@@ -81,25 +267,40 @@ async def on_guild_channel_update(
         await on_guild_channel_delete(after)
 
 
-@uita.bot.event
-@bot_ready
-async def on_guild_role_create(role: discord.Role) -> None:
-    await on_guild_role_update(role, role)
-
-
 @uita.bot.event
 @bot_ready
 async def on_guild_role_delete(role: discord.Role) -> None:
-    if str(role.id) == uita.state.server_get_role(str(role.guild.id)):
-        uita.state.server_set_role(str(role.guild.id), None)
-    await on_guild_role_update(role, role)
+    guild = role.guild
+    # Deleted roles are already gone from member role lists, but are still listed by ID
+    holders = role.members
+    if guild.me in holders:
+        # Channels are only affected through the bot's own permissions
+        if role.permissions.value != 0:
+            _queue_recheck_channels(guild)
+        else:
+            update_channels(guild, [
+                channel for channel in guild.channels
+                if not channel.overwrites_for(role).is_empty()
+            ])
+    if str(role.id) == uita.state.server_get_role(str(guild.id)):
+        await uita.state.server_set_role(str(guild.id), None)
+        _queue_recheck_members(guild)
+    elif role.permissions.administrator:
+        _queue_recheck_members(guild, holders)
 
 
 @uita.bot.event
 @bot_ready
 async def on_guild_role_update(before: discord.Role, after: discord.Role) -> None:
-    # Potentially different channel permissions with changed roles
-    await on_guild_update(after.guild, after.guild)
+    guild = after.guild
+    if before.permissions == after.permissions:
+        return
+    # Base role permissions apply to every channel, but only matter if the bot has the role
+    if after.is_default() or after in guild.me.roles:
+        _queue_recheck_channels(guild)
+    # Administrators can always use bot commands
+    if before.permissions.administrator != after.permissions.administrator:
+        _queue_recheck_members(guild, after.members)
 
 
 @uita.bot.event
@@ -113,16 +314,15 @@ async def on_member_join(member: discord.Member) -> None:
 @bot_ready
 async def on_member_remove(member: discord.Member) -> None:
     uita.state.server_remove_user(str(member.guild.id), str(member.id))
-    # Kick any displaced users
-    await uita.server.verify_active_servers()
+    _queue_verify_servers(member.guild)
 
 
 @uita.bot.event
 @bot_ready
 async def on_member_update(before: discord.Member, after: discord.Member) -> None:
     # Potentially different channel permissions with different roles
-    if after == after.guild.me:
-        await on_guild_update(after.guild, after.guild)
+    if after == after.guild.me and before.roles != after.roles:
+        _queue_recheck_channels(after.guild)
 
     verify_before = _verify_member(before)
     verify_after = _verify_member(after)
@@ -146,6 +346,7 @@ async def on_message(message: discord.Message) -> None:
 @uita.bot.event
 @bot_ready
 async def on_guild_join(guild: discord.Guild) -> None:
+    await _load_members([guild])
     channels = {
         str(channel.id): uita.types.DiscordChannel(
             str(channel.id), channel.name, channel.type, str(channel.category_id), channel.position
@@ -153,17 +354,19 @@ async def on_guild_join(guild: discord.Guild) -> None:
         for channel in guild.channels
         if uita.utils.verify_channel_visibility(channel, guild.me)
     }
+    role = uita.state.server_get_role(str(guild.id))
     users = {
         str(user.id): user.name
         for user in guild.members
-        if _verify_member(user)
-    }
+        if uita.utils.verify_user_permissions(user, role)
+    } if not uita.state.lazy_members else {}
     discord_server = uita.types.DiscordServer(
         str(guild.id),
         guild.name,
         channels,
         users,
-        guild.icon
+        guild.icon,
+        role
     )
     uita.state.server_add(discord_server, uita.bot)
     log.info(f"Joined {discord_server.name}")
@@ -192,39 +395,21 @@ async def on_guild_join(guild: discord.Guild) -> None:
 async def on_guild_remove(guild: discord.Guild) -> None:
     log.info(f"Leaving {guild.name}")
     uita.state.server_remove(str(guild.id))
-    # Kick any displaced users
-    await uita.server.verify_active_servers()
+    _queue_verify_servers(guild)
 
 
 @uita.bot.event
 @bot_ready
 async def on_guild_update(before: discord.Guild, after: discord.Guild) -> None:
-    # This is also called by other events that might affect channel visibility or user access
-    # Not efficient, kind of a scorched earth update, but have no large servers to test perf with
-    channels = {
-        str(channel.id): uita.types.DiscordChannel(
-            str(channel.id), channel.name, channel.type, str(channel.category_id), channel.position
+    # Channel visibility and user access are updated by the role and member events
+    server = uita.state.servers[str(after.id)]
+    server.name = after.name
+    server.icon = after.icon
+    # Except for owners, who have administrator permissions without any role
+    if before.owner_id != after.owner_id:
+        _queue_recheck_members(
+            after, [owner for owner in (before.owner, after.owner) if owner is not None]
         )
-        for channel in after.channels
-        if uita.utils.verify_channel_visibility(channel, after.me)
-    }
-    users = {
-        str(user.id): user.name
-        for user in after.members
-        if _verify_member(user)
-    }
-    discord_server = uita.types.DiscordServer(
-        str(after.id),
-        after.name,
-        channels,
-        users,
-        after.icon
-    )
-    uita.state.server_add(discord_server, uita.bot)
-    # In case any channel visibilities changed
-    _sync_channels(after)
-    # Kick any displaced users
-    await uita.server.verify_active_servers()
 
 
 @uita.bot.event
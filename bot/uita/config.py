@@ -27,12 +27,20 @@ class ConfigBotTrialMode(NamedTuple):
     server_whitelist: List[str]
 
 
+class ConfigBotSharding(NamedTuple):
+    shard_count: Optional[int] = None
+    workers: List[str] = []
+    worker_id: int = 0
+
+
 class ConfigBot(NamedTuple):
     domain: str
     port: int
     database: str
     verbose_logging: bool
     trial_mode: ConfigBotTrialMode
+    sharding: ConfigBotSharding = ConfigBotSharding()
+    lazy_members: bool = False
 
 
 class ConfigClient(NamedTuple):
@@ -67,6 +75,7 @@ _ConfigType = Union[
     ConfigYoutube,
     ConfigBot,
     ConfigBotTrialMode,
+    ConfigBotSharding,
     ConfigClient,
     ConfigSSL,
     ConfigFile
@@ -78,6 +87,7 @@ _CONFIGNAMES: Final[Dict[str, Type[_ConfigType]]] = {
     "config.youtube": ConfigYoutube,
     "config.bot": ConfigBot,
     "config.bot.trial_mode": ConfigBotTrialMode,
+    "config.bot.sharding": ConfigBotSharding,
     "config.client": ConfigClient,
     "config.ssl": ConfigSSL,
     "config.file": ConfigFile
@@ -1,39 +1,88 @@
 """Manages database connections and queries."""
 
-import sqlite3
-import os
+import abc
+import asyncio
 import binascii
+import concurrent.futures
 import hmac
-from typing import cast, Optional
+import json
+import os
+import sqlite3
+import time
+import urllib.parse
+from typing import cast, Callable, Dict, Optional, Set, Tuple, TypeVar
 from typing_extensions import Final
 
 import uita.auth
+import uita.exceptions
+import uita.resp
+
+import logging
+log = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
 
 
 class Database():
-    """Holds a single database connection and generates queries.
+    """Stores user sessions and server settings.
+
+    Data is kept by a storage backend chosen from the URI scheme. ``redis://`` URIs use a
+    networked key-value server so that several bot processes can share sessions and settings,
+    anything else is treated as an SQLite database. Server roles are loaded into memory when
+    opened and written through on change, so they can be read without querying.
 
     Args:
-        uri: URI pointing to database resource. Can either be a filename or ``:memory:``.
+        uri: URI pointing to database resource. Can either be a filename, ``:memory:`` or a
+            ``redis://[:password@]host[:port][/db]`` URI.
+        loop: Event loop to resolve queries in, defaults to ``asyncio.get_event_loop()``.
+        commit_interval: Time in seconds that SQLite writes are grouped together for before
+            committing.
 
-    """
-    def __init__(self, uri: str) -> None:
-        self._connection = sqlite3.connect(uri)
-        c = self._connection.cursor()
-        c.executescript(_INIT_DATABASE_QUERY)
-        self._connection.commit()
+    Attributes:
+        on_server_role (Optional[Callable[[str, Optional[str]], None]]): Called with server and
+            role ID when a server role is changed by another process.
 
-    def maintenance(self) -> None:
+    """
+    def __init__(
+        self,
+        uri: str,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        commit_interval: float = 0.05
+    ) -> None:
+        self.loop = loop or asyncio.get_event_loop()
+        self._storage: Storage
+        if urllib.parse.urlparse(uri).scheme == "redis":
+            self._storage = RedisStorage(uri, self.loop)
+        else:
+            self._storage = SqliteStorage(uri, self.loop, commit_interval)
+        self._server_roles: Dict[str, Optional[str]] = {}
+        self.on_server_role: Optional[Callable[[str, Optional[str]], None]] = None
+
+    async def open(self) -> None:
+        """Connects to the database. Must be called before any other method."""
+        await self._storage.open(self._on_server_role)
+        # Load every server role in one go rather than querying them one at a time
+        self._server_roles = await self._storage.get_server_roles()
+
+    async def close(self) -> None:
+        """Finishes any pending writes and closes the database connection."""
+        await self._storage.close()
+
+    async def maintenance(self, batch_size: int = 500) -> None:
         """Performs database maintenance.
 
-        Currently only deletes expired sessions.
+        Currently only deletes expired sessions. These are deleted in batches so that other
+        queries can run in between.
+
+        Args:
+            batch_size: Maximum number of sessions to delete at once.
 
         """
-        c = self._connection.cursor()
-        c.execute(_PRUNE_OLD_SESSIONS_QUERY)
-        self._connection.commit()
+        now = int(time.time())
+        while await self._storage.prune_sessions(now, batch_size) >= batch_size:
+            pass
 
-    def add_session(self, token: str, expiry: int) -> uita.auth.Session:
+    async def add_session(self, token: str, expiry: int) -> uita.auth.Session:
         """Creates and inserts a new user session into database.
 
         Args:
@@ -44,14 +93,13 @@ class Database():
             Session object for authenticating user.
 
         """
-        c = self._connection.cursor()
         # Generate cryptographically secure 64 char long hex string for session secret
         secret = binascii.hexlify(os.urandom(32)).decode()
-        c.execute(_ADD_SESSION_QUERY, (secret, token, expiry))
-        self._connection.commit()
-        return uita.auth.Session(handle=c.lastrowid, secret=secret)
+        expires_at = int(time.time()) + expiry
+        handle = await self._storage.add_session(secret, token, expiry, expires_at)
+        return uita.auth.Session(handle=handle, secret=secret)
 
-    def delete_session(self, session: uita.auth.Session) -> None:
+    async def delete_session(self, session: uita.auth.Session) -> None:
         """Deletes a given session from the database.
 
         Useful for session expiry, user logout, etc.
@@ -60,11 +108,9 @@ class Database():
             session: Session object to be deleted.
 
         """
-        c = self._connection.cursor()
-        c.execute(_DELETE_SESSION_QUERY, (session.handle,))
-        self._connection.commit()
+        await self._storage.delete_session(str(session.handle))
 
-    def get_access_token(self, session: uita.auth.Session) -> Optional[str]:
+    async def get_access_token(self, session: uita.auth.Session) -> Optional[str]:
         """Verifies whether a given session is valid and returns an access token if so.
 
         Args:
@@ -74,16 +120,14 @@ class Database():
             Access token if session is valid, ``None`` otherwise.
 
         """
-        c = self._connection.cursor()
-        c.execute(_GET_SESSION_QUERY, (session.handle,))
-        db_session = c.fetchone()
+        db_session = await self._storage.get_session(str(session.handle))
         if db_session is None:
             return None
         if hmac.compare_digest(db_session[0], session.secret):
-            return cast(str, db_session[1])
+            return db_session[1]
         return None
 
-    def set_server_role(self, server_id: str, role_id: Optional[str]) -> None:
+    async def set_server_role(self, server_id: str, role_id: Optional[str]) -> None:
         """Configures the required role setting for a server.
 
         Args:
@@ -91,9 +135,8 @@ class Database():
             role_id: Role ID for required role to use bot commands. ``None`` for free access.
 
         """
-        c = self._connection.cursor()
-        c.execute(_SET_SERVER_ROLE_QUERY, (server_id, role_id))
-        self._connection.commit()
+        self._server_roles[server_id] = role_id
+        await self._storage.set_server_role(server_id, role_id)
 
     def get_server_role(self, server_id: str) -> Optional[str]:
         """Retrieves the required role setting for a server.
@@ -105,13 +148,357 @@ class Database():
             Role ID if server has configured this setting, ``None`` otherwise.
 
         """
-        c = self._connection.cursor()
-        c.execute(_GET_SERVER_ROLE_QUERY, (server_id,))
-        role = c.fetchone()
-        if role is None:
-            return None
-        return cast(str, role[0])
+        return self._server_roles.get(server_id)
+
+    def _on_server_role(self, server_id: str, role_id: Optional[str]) -> None:
+        # Changes made by this process are already applied
+        if self._server_roles.get(server_id) == role_id:
+            return
+        self._server_roles[server_id] = role_id
+        if self.on_server_role is not None:
+            self.on_server_role(server_id, role_id)
+
+
+class Storage(abc.ABC):
+    """Storage backend interface used by :class:`~uita.database.Database`.
+
+    Session handles are unique strings of digits, as expected by
+    :class:`~uita.message.AuthSessionMessage`.
+
+    """
+    @abc.abstractmethod
+    async def open(self, on_server_role: Callable[[str, Optional[str]], None]) -> None:
+        """Connects to storage.
+
+        Args:
+            on_server_role: Called when a server role is changed by another process.
+
+        """
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        """Finishes any pending writes and disconnects from storage."""
+
+    @abc.abstractmethod
+    async def prune_sessions(self, now: int, limit: int) -> int:
+        """Deletes expired sessions.
+
+        Args:
+            now: Current UNIX time.
+            limit: Maximum number of sessions to delete.
+
+        Returns:
+            Number of sessions deleted.
+
+        """
+
+    @abc.abstractmethod
+    async def add_session(self, secret: str, token: str, expiry: int, expires_at: int) -> str:
+        """Stores a new session.
+
+        Args:
+            secret: Session secret.
+            token: User authentication token.
+            expiry: Time from creation of token that it is valid for in seconds.
+            expires_at: UNIX time that session expires at.
+
+        Returns:
+            Handle of new session.
+
+        """
 
+    @abc.abstractmethod
+    async def delete_session(self, handle: str) -> None:
+        """Deletes a session.
+
+        Args:
+            handle: Handle of session to delete.
+
+        """
+
+    @abc.abstractmethod
+    async def get_session(self, handle: str) -> Optional[Tuple[str, str]]:
+        """Retrieves a session.
+
+        Args:
+            handle: Handle of session to retrieve.
+
+        Returns:
+            Session secret and token, or ``None`` if session does not exist.
+
+        """
+
+    @abc.abstractmethod
+    async def set_server_role(self, server_id: str, role_id: Optional[str]) -> None:
+        """Stores the required role setting for a server.
+
+        Args:
+            server_id: Server ID to change setting for.
+            role_id: Role ID for required role to use bot commands. ``None`` for free access.
+
+        """
+
+    @abc.abstractmethod
+    async def get_server_roles(self) -> Dict[str, Optional[str]]:
+        """Retrieves the required role setting for every server.
+
+        Returns:
+            Role IDs indexed by server ID.
+
+        """
+
+
+class SqliteStorage(Storage):
+    """Stores data in an SQLite database.
+
+    Queries run in order on a dedicated thread so that they never block the event loop. Writes
+    are grouped together and committed on a short interval, with each write resolving once it
+    has been committed.
+
+    Args:
+        uri: Database filename or ``:memory:``.
+        loop: Event loop to resolve queries in.
+        commit_interval: Time in seconds that writes are grouped together for before committing.
+
+    """
+    def __init__(
+        self,
+        uri: str,
+        loop: asyncio.AbstractEventLoop,
+        commit_interval: float = 0.05
+    ) -> None:
+        self.uri = uri
+        self.loop = loop
+        self.commit_interval = commit_interval
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending_commit: Optional[asyncio.Future[None]] = None
+        self._commit_handle: Optional[asyncio.TimerHandle] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    async def open(self, on_server_role: Callable[[str, Optional[str]], None]) -> None:
+        # Only this process writes to the database, so there are no outside role changes
+        self._connection = await self._read(self._connect)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.uri)
+        # Readers don't wait on writers, and with WAL a commit doesn't need to fsync the database
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(_INIT_DATABASE_QUERY)
+        # Bring older databases up to date, recording progress in the schema version
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(_MIGRATIONS[version:], start=version + 1):
+            connection.executescript(f"BEGIN;{migration}\nPRAGMA user_version={number};COMMIT;")
+        return connection
+
+    async def close(self) -> None:
+        if self._pending_commit is not None:
+            assert self._commit_handle is not None
+            self._commit_handle.cancel()
+            await self._commit(self._pending_commit)
+        await self._read(self._db().close)
+        self._executor.shutdown(wait=False)
+
+    async def prune_sessions(self, now: int, limit: int) -> int:
+        def prune() -> int:
+            return cast(int, self._db().execute(_PRUNE_OLD_SESSIONS_QUERY, (now, limit)).rowcount)
+        return await self._write(prune)
+
+    async def add_session(self, secret: str, token: str, expiry: int, expires_at: int) -> str:
+        return await self._write(lambda: str(
+            self._db().execute(_ADD_SESSION_QUERY, (secret, token, expiry, expires_at)).lastrowid
+        ))
+
+    async def delete_session(self, handle: str) -> None:
+        await self._write(lambda: self._db().execute(_DELETE_SESSION_QUERY, (handle,)))
+
+    async def get_session(self, handle: str) -> Optional[Tuple[str, str]]:
+        def get() -> Optional[Tuple[str, str]]:
+            return cast(
+                Optional[Tuple[str, str]],
+                self._db().execute(_GET_SESSION_QUERY, (handle,)).fetchone()
+            )
+        return await self._read(get)
+
+    async def set_server_role(self, server_id: str, role_id: Optional[str]) -> None:
+        await self._write(
+            lambda: self._db().execute(_SET_SERVER_ROLE_QUERY, (server_id, role_id))
+        )
+
+    async def get_server_roles(self) -> Dict[str, Optional[str]]:
+        def get() -> Dict[str, Optional[str]]:
+            return dict(self._db().execute(_GET_SERVER_ROLES_QUERY).fetchall())
+        return await self._read(get)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            raise uita.exceptions.ServerError("Database used before being opened")
+        return self._connection
+
+    async def _read(self, query: Callable[[], _T]) -> _T:
+        return await self.loop.run_in_executor(self._executor, query)
+
+    async def _write(self, query: Callable[[], _T]) -> _T:
+        result = await self.loop.run_in_executor(self._executor, query)
+        # Group with any other writes waiting to be committed
+        pending_commit = self._pending_commit or self._schedule_commit()
+        await asyncio.shield(pending_commit, loop=self.loop)
+        return result
+
+    def _schedule_commit(self) -> "asyncio.Future[None]":
+        pending_commit: asyncio.Future[None] = self.loop.create_future()
+        self._pending_commit = pending_commit
+        self._commit_handle = self.loop.call_later(
+            self.commit_interval,
+            lambda: self.loop.create_task(self._commit(pending_commit))
+        )
+        return pending_commit
+
+    async def _commit(self, pending_commit: "asyncio.Future[None]") -> None:
+        self._pending_commit = None
+        self._commit_handle = None
+        # Runs after every write that was queued before it, since the executor has one thread
+        try:
+            await self._read(self._db().commit)
+        except Exception as error:
+            pending_commit.set_exception(error)
+        else:
+            pending_commit.set_result(None)
+
+
+class RedisStorage(Storage):
+    """Stores data on a server speaking the Redis protocol, shared between processes.
+
+    Sessions are stored as hashes that the server expires by itself. Server role changes are
+    published to other processes so their in-memory copies stay up to date. Lost connections
+    are re-established in the background, with commands failing until then.
+
+    Args:
+        uri: Server location in the form ``redis://[:password@]host[:port][/db]``.
+        loop: Event loop to run connections in.
+
+    """
+    def __init__(self, uri: str, loop: asyncio.AbstractEventLoop) -> None:
+        self.uri = uri
+        self.loop = loop
+        self._connection: Optional[uita.resp.Connection] = None
+        self._subscription: Optional[uita.resp.Connection] = None
+        self._reconnect_task: Optional[asyncio.Task[None]] = None
+        self._on_server_role: Callable[[str, Optional[str]], None] = lambda *args: None
+        # Every server known to have a role, so that roles removed while disconnected are seen
+        self._role_servers: Set[str] = set()
+
+    async def open(self, on_server_role: Callable[[str, Optional[str]], None]) -> None:
+        self._on_server_role = on_server_role
+        await self._connect()
+        self._reconnect_task = self.loop.create_task(self._stay_connected())
+
+    async def close(self) -> None:
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        for connection in (self._connection, self._subscription):
+            if connection is not None:
+                connection.close()
+
+    async def _connect(self) -> None:
+        for connection in (self._connection, self._subscription):
+            if connection is not None:
+                connection.close()
+        self._connection = await uita.resp.connect(self.uri, self.loop)
+        self._subscription = await uita.resp.connect(self.uri, self.loop)
+
+        def on_message(data: bytes) -> None:
+            server_id, role_id = json.loads(data)
+            self._role_servers.add(server_id)
+            self._on_server_role(server_id, role_id)
+        await self._subscription.subscribe(_REDIS_SERVER_ROLES_CHANNEL, on_message)
+
+    async def _stay_connected(self) -> None:
+        while True:
+            assert self._connection is not None and self._subscription is not None
+            await asyncio.wait(
+                [self._connection.wait_closed(), self._subscription.wait_closed()],
+                loop=self.loop,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            log.error("Lost connection to Redis server, reconnecting")
+            delay = _REDIS_RECONNECT_DELAY
+            while True:
+                try:
+                    await self._connect()
+                    roles = await self.get_server_roles()
+                    break
+                except (OSError, uita.resp.ReplyError) as error:
+                    log.error(f"Redis reconnect failed, retrying in {delay}s: {error}")
+                    await asyncio.sleep(delay, loop=self.loop)
+                    delay = min(delay * 2, _REDIS_RECONNECT_MAX_DELAY)
+            # Role changes published while disconnected were missed
+            for server_id in set(self._role_servers):
+                self._on_server_role(server_id, roles.get(server_id))
+            log.info("Reconnected to Redis server")
+
+    async def prune_sessions(self, now: int, limit: int) -> int:
+        # Expired sessions are deleted by the server
+        return 0
+
+    async def add_session(self, secret: str, token: str, expiry: int, expires_at: int) -> str:
+        handle = str(await self._db().command("INCR", _REDIS_SESSION_HANDLE_KEY))
+        key = _REDIS_SESSION_KEY + handle
+        # Pipelined, so these are sent together without waiting on each other
+        await asyncio.gather(
+            self._db().command("HSET", key, "secret", secret, "token", token),
+            self._db().command("EXPIREAT", key, expires_at),
+            loop=self.loop
+        )
+        return handle
+
+    async def delete_session(self, handle: str) -> None:
+        await self._db().command("DEL", _REDIS_SESSION_KEY + handle)
+
+    async def get_session(self, handle: str) -> Optional[Tuple[str, str]]:
+        reply = await self._db().command("HMGET", _REDIS_SESSION_KEY + handle, "secret", "token")
+        assert isinstance(reply, list)
+        secret, token = reply
+        if secret is None or token is None:
+            return None
+        return secret.decode(), token.decode()
+
+    async def set_server_role(self, server_id: str, role_id: Optional[str]) -> None:
+        self._role_servers.add(server_id)
+        if role_id is None:
+            update = self._db().command("HDEL", _REDIS_SERVER_ROLES_KEY, server_id)
+        else:
+            update = self._db().command("HSET", _REDIS_SERVER_ROLES_KEY, server_id, role_id)
+        await asyncio.gather(
+            update,
+            self._db().command(
+                "PUBLISH", _REDIS_SERVER_ROLES_CHANNEL, json.dumps([server_id, role_id])
+            ),
+            loop=self.loop
+        )
+
+    async def get_server_roles(self) -> Dict[str, Optional[str]]:
+        reply = await self._db().command("HGETALL", _REDIS_SERVER_ROLES_KEY)
+        assert isinstance(reply, list)
+        roles: Dict[str, Optional[str]] = {
+            server_id.decode(): role_id.decode()
+            for server_id, role_id in zip(reply[::2], reply[1::2])
+        }
+        self._role_servers.update(roles)
+        return roles
+
+    def _db(self) -> uita.resp.Connection:
+        if self._connection is None:
+            raise uita.exceptions.ServerError("Database used before being opened")
+        return self._connection
+
+
+_REDIS_SESSION_HANDLE_KEY: Final = "uita:session_handle"
+_REDIS_SESSION_KEY: Final = "uita:session:"
+_REDIS_SERVER_ROLES_KEY: Final = "uita:server_roles"
+_REDIS_SERVER_ROLES_CHANNEL: Final = "uita:server_roles"
+_REDIS_RECONNECT_DELAY: Final = 1.0
+_REDIS_RECONNECT_MAX_DELAY: Final = 60.0
 
 _INIT_DATABASE_QUERY: Final = """
 CREATE TABLE IF NOT EXISTS sessions (
@@ -126,19 +513,31 @@ CREATE TABLE IF NOT EXISTS server_roles (
     role_id TEXT
 );"""
 
+# Each migration upgrades the schema by one version, starting from the initial schema
+_MIGRATIONS: Final = [
+    # Version 1: Absolute session expiry times, indexed for pruning
+    """
+ALTER TABLE sessions ADD COLUMN expires_at INTEGER;
+UPDATE sessions SET expires_at=CAST(strftime('%s', created) AS INTEGER) + expiry;
+CREATE INDEX sessions_expires_at ON sessions(expires_at);"""
+]
+
 _ADD_SESSION_QUERY: Final = """
 INSERT OR REPLACE INTO sessions(
     secret,
     token,
-    expiry
+    expiry,
+    expires_at
 )
-VALUES(?, ?, ?)"""
+VALUES(?, ?, ?, ?)"""
 
 _DELETE_SESSION_QUERY: Final = """
 DELETE FROM sessions WHERE handle=?"""
 
 _PRUNE_OLD_SESSIONS_QUERY: Final = """
-DELETE FROM sessions WHERE ((strftime('%s', created) + expiry) - strftime('%s', 'now'))<=0"""
+DELETE FROM sessions WHERE handle IN (
+    SELECT handle FROM sessions WHERE expires_at<=? LIMIT ?
+)"""
 
 _GET_SESSION_QUERY: Final = """
 SELECT secret, token FROM sessions WHERE handle=?"""
@@ -150,5 +549,5 @@ INSERT OR REPLACE INTO server_roles(
 )
 VALUES(?, ?)"""
 
-_GET_SERVER_ROLE_QUERY: Final = """
-SELECT role_id FROM server_roles WHERE server_id=?"""
+_GET_SERVER_ROLES_QUERY: Final = """
+SELECT server_id, role_id FROM server_roles"""
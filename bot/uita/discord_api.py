@@ -2,7 +2,7 @@
 import asyncio
 import re
 import requests
-from typing import cast, Any, Dict, Optional
+from typing import cast, Any, Awaitable, Callable, Dict, Optional, Tuple
 from typing_extensions import Final
 
 import uita
@@ -22,6 +22,149 @@ CDN_URL: Final = "https://cdn.discordapp.com"
 VALID_CODE_REGEX: Final = re.compile("^([a-zA-Z0-9]+)$")
 
 
+class _Bucket():
+    """Remaining requests in a rate limit bucket, and when it resets."""
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Limits are unknown until the first response, so only allow one request until then
+        self.known = False
+        self.limit = 1
+        self.remaining = 1
+        self.reset_at = 0.0
+        self.lock = asyncio.Lock(loop=loop)
+
+
+class RateLimiter():
+    """Keeps Discord API requests within the rate limits reported by Discord.
+
+    Rate limits are tracked per bucket using the ``X-RateLimit-*`` response headers. Requests to
+    an exhausted bucket wait in order for it to reset, and requests that are rate limited anyway
+    are retried once the ``Retry-After`` time has passed.
+
+    Args:
+        max_wait: Maximum time in seconds a request will wait for a rate limit to reset.
+        max_retries: Maximum number of times a rate limited request is retried.
+
+    Attributes:
+        max_wait (float): Maximum time in seconds a request will wait for a rate limit to reset.
+        max_retries (int): Maximum number of times a rate limited request is retried.
+
+    """
+    def __init__(self, max_wait: float = 30, max_retries: int = 3) -> None:
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        # Routes that share a limit are grouped into buckets by Discord
+        self._routes: Dict[str, str] = {}
+        # Limits apply separately to each token
+        self._buckets: uita.utils.TTLCache[Tuple[str, Optional[str]], _Bucket] = (
+            uita.utils.TTLCache(10000, 600)
+        )
+        self._global_reset_at = 0.0
+
+    async def request(
+        self,
+        route: str,
+        token: Optional[str],
+        send: Callable[[], Awaitable[requests.Response]],
+        loop: asyncio.AbstractEventLoop
+    ) -> requests.Response:
+        """Sends a request once its rate limit allows it.
+
+        Args:
+            route: Method and end point of request, used to group requests into buckets.
+            token: Authorization token of request, ``None`` if it is unauthenticated.
+            send: Callback that sends the request.
+            loop: Event loop to wait on.
+
+        Returns:
+            Response to the request. Never a 429 response.
+
+        Raises:
+            uita.exceptions.RateLimitError: If the request is still rate limited after waiting
+                ``max_wait`` seconds or retrying ``max_retries`` times.
+
+        """
+        for _ in range(self.max_retries + 1):
+            bucket = self._bucket(route, token, loop)
+            # Waiting requests queue up in order behind the lock
+            await bucket.lock.acquire()
+            locked = True
+            try:
+                await self._reserve(bucket, loop)
+                # Requests to a new bucket are sent one at a time until its limits are known
+                if bucket.known:
+                    bucket.lock.release()
+                    locked = False
+                response = await send()
+                self._update(route, token, bucket, response, loop)
+            finally:
+                if locked:
+                    bucket.lock.release()
+            if response.status_code != 429:
+                return response
+        raise uita.exceptions.RateLimitError(f"Rate limited too many times on {route}")
+
+    def _bucket(
+        self,
+        route: str,
+        token: Optional[str],
+        loop: asyncio.AbstractEventLoop
+    ) -> _Bucket:
+        key = (self._routes.get(route, route), token)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket(loop)
+        # Refresh expiry for buckets in use
+        self._buckets.set(key, bucket)
+        return bucket
+
+    async def _reserve(self, bucket: _Bucket, loop: asyncio.AbstractEventLoop) -> None:
+        while True:
+            now = loop.time()
+            if bucket.reset_at <= now:
+                bucket.remaining = bucket.limit
+            reset_at = max(self._global_reset_at, bucket.reset_at if bucket.remaining <= 0 else 0)
+            if reset_at <= now:
+                break
+            if reset_at - now > self.max_wait:
+                raise uita.exceptions.RateLimitError("Rate limit resets too far in the future")
+            await asyncio.sleep(reset_at - now, loop=loop)
+        bucket.remaining -= 1
+
+    def _update(
+        self,
+        route: str,
+        token: Optional[str],
+        bucket: _Bucket,
+        response: requests.Response,
+        loop: asyncio.AbstractEventLoop
+    ) -> None:
+        now = loop.time()
+        headers = response.headers
+        bucket.known = True
+        bucket_hash = headers.get("X-RateLimit-Bucket")
+        if bucket_hash is not None and self._routes.get(route) != bucket_hash:
+            # Carry over what has been learned so far to the newly discovered bucket
+            self._routes[route] = bucket_hash
+            key = (bucket_hash, token)
+            if key not in self._buckets:
+                self._buckets.set(key, bucket)
+        if "X-RateLimit-Limit" in headers:
+            bucket.limit = int(headers["X-RateLimit-Limit"])
+        if "X-RateLimit-Remaining" in headers and "X-RateLimit-Reset-After" in headers:
+            bucket.remaining = int(headers["X-RateLimit-Remaining"])
+            bucket.reset_at = now + float(headers["X-RateLimit-Reset-After"])
+        if response.status_code == 429:
+            retry_at = now + float(headers.get("Retry-After", 1))
+            if headers.get("X-RateLimit-Global") == "true":
+                self._global_reset_at = retry_at
+            else:
+                bucket.remaining = 0
+                bucket.reset_at = max(bucket.reset_at, retry_at)
+
+
+_rate_limiter = RateLimiter()
+
+
 async def auth(
     code: str,
     config: uita.config.Config,
@@ -39,6 +182,7 @@ async def auth(
 
     Raises:
         uita.exceptions.AuthenticationError: If code is invalid.
+        uita.exceptions.RateLimitError: If rate limited for too long.
 
     """
     loop = loop or asyncio.get_event_loop()
@@ -53,13 +197,19 @@ async def auth(
         "redirect_uri": uita.utils.build_client_url(config)
     }
     # requests is not asynchronous, so run in another thread and await it
-    response = await loop.run_in_executor(
+    async_loop = loop
+    response = await _rate_limiter.request(
+        "POST /oauth2/token",
         None,
-        lambda: requests.post(
-            AUTH_URL,
-            data=data,
-            headers=BASE_HEADERS
-        )
+        lambda: async_loop.run_in_executor(
+            None,
+            lambda: requests.post(
+                AUTH_URL,
+                data=data,
+                headers=BASE_HEADERS
+            )
+        ),
+        loop
     )
     if response.status_code != 200:
         raise uita.exceptions.AuthenticationError("Passed an incorrect auth code")
@@ -70,7 +220,7 @@ async def get(
     end_point: str,
     token: str,
     loop: Optional[asyncio.AbstractEventLoop] = None
-) -> Dict[str, Any]:
+) -> Any:
     """Retrieves an object from the Discord API with an authorization token.
 
     Args:
@@ -83,22 +233,29 @@ async def get(
 
     Raises:
         uita.exceptions.AuthenticationError: If request is invalid.
+        uita.exceptions.RateLimitError: If rate limited for too long.
 
     """
     loop = loop or asyncio.get_event_loop()
     headers = BASE_HEADERS.copy()
     headers["Authorization"] = f"Bearer {token}"
     # requests is not asynchronous, so run in another thread and await it
-    response = await loop.run_in_executor(
-        None,
-        lambda: requests.get(
-            BASE_URL + end_point,
-            headers=headers
-        )
+    async_loop = loop
+    response = await _rate_limiter.request(
+        f"GET {end_point}",
+        token,
+        lambda: async_loop.run_in_executor(
+            None,
+            lambda: requests.get(
+                BASE_URL + end_point,
+                headers=headers
+            )
+        ),
+        loop
     )
     if response.status_code != 200:
         raise uita.exceptions.AuthenticationError("Made an invalid Discord API request")
-    return cast(Dict[str, Any], response.json())
+    return response.json()
 
 
 def avatar_url(user: Dict[str, Any]) -> str:
@@ -54,6 +54,11 @@ class NoActiveServer(Exception):
     pass
 
 
+class RateLimitError(Exception):
+    """Occurs when a Discord API request cannot be completed in time due to rate limiting."""
+    pass
+
+
 class ServerError(Exception):
     """Occurs when a :class:`~uita.ui_server.Server` is configured or used incorrectly."""
     pass
@@ -1,7 +1,9 @@
 """Builds and parses messages for websocket API."""
 import json
 import math
-from typing import Dict, List, Optional, Tuple, Type
+import msgpack
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
 from typing_extensions import Final
 
 import uita.exceptions
@@ -13,15 +15,22 @@ class AbstractMessage():
 
     Attributes:
         header (str): Header defining message type
+        snapshot (bool): Whether message contains a complete state that makes any older message
+            of the same type obsolete.
 
     """
     header: str = ""
+    snapshot: bool = False
 
     def __str__(self) -> str:
         """Serializes self to JSON encoded message object for network transfer"""
         # Appends header to self.__dict__ serialization because it is a class level attribute
         return json.dumps(dict({"header": self.header}, **self.__dict__))
 
+    def __bytes__(self) -> bytes:
+        """Serializes self to MessagePack encoded message object for network transfer"""
+        return msgpack.packb(dict({"header": self.header}, **self.__dict__), use_bin_type=True)
+
 
 class AuthCodeMessage(AbstractMessage):
     """Sent by client when authenticating by token request code.
@@ -45,6 +54,23 @@ class AuthFailMessage(AbstractMessage):
     """"""
 
 
+class AuthRetryMessage(AbstractMessage):
+    """Sent by server when it is too busy to authenticate a connection.
+
+    Args:
+        retry_after: Time in seconds to wait before reconnecting.
+
+    Attributes:
+        retry_after (float): Time in seconds to wait before reconnecting.
+
+    """
+    header = "auth.retry"
+    """"""
+
+    def __init__(self, retry_after: float) -> None:
+        self.retry_after = float(retry_after)
+
+
 class AuthSessionMessage(AbstractMessage):
     """Sent by client when authenticating by session.
 
@@ -115,6 +141,8 @@ class ChannelActiveSendMessage(AbstractMessage):
     """
     header = "channel.active.send"
     """"""
+    snapshot = True
+    """"""
 
     def __init__(self, channel: Optional[uita.types.DiscordChannel]) -> None:
         self.channel = {
@@ -169,6 +197,8 @@ class ChannelListSendMessage(AbstractMessage):
     """
     header = "channel.list.send"
     """"""
+    snapshot = True
+    """"""
 
     def __init__(self, channels: List[uita.types.DiscordChannel]) -> None:
         self.channels = [{
@@ -212,18 +242,70 @@ class ErrorUrlInvalidMessage(AbstractMessage):
 class FileUploadStartMessage(AbstractMessage):
     """Sent by client initiating a file upload procedure.
 
+    If a file with the same hash is already cached, the server queues it and sends
+    :class:`~uita.message.FileUploadCompleteMessage` without waiting for any file data.
+
     Args:
         size: File size in bytes.
+        sha256: Hex encoded SHA-256 hash of file contents.
 
     Attributes:
         size (int): File size in bytes.
+        sha256 (str): Hex encoded SHA-256 hash of file contents.
 
     """
     header = "file.upload.start"
     """"""
 
-    def __init__(self, size: int) -> None:
+    def __init__(self, size: int, sha256: str) -> None:
         self.size = int(size)
+        self.sha256 = str(sha256).lower()
+        if re.fullmatch("[0-9a-f]{64}", self.sha256) is None:
+            raise uita.exceptions.MalformedMessage("File hash is not a hex encoded SHA-256 hash")
+
+
+class FileUploadAckMessage(AbstractMessage):
+    """Sent by server acknowledging file chunks, allowing more to be sent.
+
+    Clients can send chunks up to ``received + window`` without waiting for another
+    acknowledgement.
+
+    Args:
+        received: Number of file chunks received so far.
+        window: Number of file chunks that can be in flight past those received.
+
+    Attributes:
+        received (int): Number of file chunks received so far.
+        window (int): Number of file chunks that can be in flight past those received.
+
+    """
+    header = "file.upload.ack"
+    """"""
+
+    def __init__(self, received: int, window: int) -> None:
+        self.received = int(received)
+        self.window = int(window)
+
+
+class FileUploadResumeMessage(AbstractMessage):
+    """Sent by server continuing a file upload that was interrupted by a lost connection.
+
+    Sent in reply to :class:`~uita.message.FileUploadStartMessage` when part of the file has
+    already been received, before the first :class:`~uita.message.FileUploadAckMessage`. File
+    chunks are then sent starting from ``offset``.
+
+    Args:
+        offset: Number of bytes already received.
+
+    Attributes:
+        offset (int): Number of bytes already received.
+
+    """
+    header = "file.upload.resume"
+    """"""
+
+    def __init__(self, offset: int) -> None:
+        self.offset = int(offset)
 
 
 class FileUploadCompleteMessage(AbstractMessage):
@@ -299,6 +381,8 @@ class PlayQueueSendMessage(AbstractMessage):
     """
     header = "play.queue.send"
     """"""
+    snapshot = True
+    """"""
 
     def __init__(self, queue: List[uita.audio.Track]) -> None:
         self.queue = [{
@@ -330,6 +414,8 @@ class PlayStatusSendMessage(AbstractMessage):
     """
     header = "play.status.send"
     """"""
+    snapshot = True
+    """"""
 
     def __init__(self, status: uita.audio.Status) -> None:
         self.status = status
@@ -354,6 +440,53 @@ class PlayURLMessage(AbstractMessage):
             raise uita.exceptions.MalformedMessage("Play URL exceeds max length")
 
 
+class SearchQueryMessage(AbstractMessage):
+    """Sent by client as a user types a search query.
+
+    Args:
+        query: Search query.
+
+    Attributes:
+        query (str): Search query.
+
+    """
+    header = "search.query"
+    """"""
+
+    def __init__(self, query: str) -> None:
+        self.query = str(query)
+        if len(self.query) > MAX_SEARCH_LENGTH:
+            raise uita.exceptions.MalformedMessage("Search query exceeds max length")
+
+
+class SearchResultsMessage(AbstractMessage):
+    """Sent by server containing the results of a search query.
+
+    Args:
+        query: Search query that results are for.
+        results: List of search results.
+
+    Attributes:
+        query (str): Search query that results are for.
+        results (List[Dict[str, Any]]): List of search results.
+
+    """
+    header = "search.results"
+    """"""
+
+    def __init__(self, query: str, results: List[Dict[str, Any]]) -> None:
+        self.query = query
+        self.results = [{
+            "id": result["id"],
+            "url": result["url"],
+            "title": result["title"],
+            "uploader": result.get("uploader"),
+            "thumbnail": result.get("thumbnail"),
+            "duration": result.get("duration"),
+            "live": result["live"]
+        } for result in results]
+
+
 class ServerJoinMessage(AbstractMessage):
     """Sent by client containing a server ID to join.
 
@@ -412,6 +545,7 @@ class ServerListSendMessage(AbstractMessage):
 VALID_MESSAGES: Final[Dict[str, Tuple[Type[AbstractMessage], List[str]]]] = {
     AuthCodeMessage.header: (AuthCodeMessage, ["code"]),
     AuthFailMessage.header: (AuthFailMessage, []),
+    AuthRetryMessage.header: (AuthRetryMessage, ["retry_after"]),
     AuthSessionMessage.header: (AuthSessionMessage, ["handle", "secret"]),
     AuthSucceedMessage.header: (AuthSucceedMessage, ["user", "session"]),
     ChannelActiveGetMessage.header: (ChannelActiveGetMessage, []),
@@ -423,7 +557,9 @@ VALID_MESSAGES: Final[Dict[str, Tuple[Type[AbstractMessage], List[str]]]] = {
     ErrorFileInvalidMessage.header: (ErrorFileInvalidMessage, ["error"]),
     ErrorQueueFullMessage.header: (ErrorQueueFullMessage, []),
     ErrorUrlInvalidMessage.header: (ErrorUrlInvalidMessage, []),
-    FileUploadStartMessage.header: (FileUploadStartMessage, ["size"]),
+    FileUploadAckMessage.header: (FileUploadAckMessage, ["received", "window"]),
+    FileUploadStartMessage.header: (FileUploadStartMessage, ["size", "sha256"]),
+    FileUploadResumeMessage.header: (FileUploadResumeMessage, ["offset"]),
     FileUploadCompleteMessage.header: (FileUploadCompleteMessage, []),
     HeartbeatMessage.header: (HeartbeatMessage, []),
     PlayQueueGetMessage.header: (PlayQueueGetMessage, []),
@@ -433,26 +569,113 @@ VALID_MESSAGES: Final[Dict[str, Tuple[Type[AbstractMessage], List[str]]]] = {
     PlayStatusGetMessage.header: (PlayStatusGetMessage, []),
     PlayStatusSendMessage.header: (PlayStatusSendMessage, ["status"]),
     PlayURLMessage.header: (PlayURLMessage, ["url"]),
+    SearchQueryMessage.header: (SearchQueryMessage, ["query"]),
+    SearchResultsMessage.header: (SearchResultsMessage, ["query", "results"]),
     ServerJoinMessage.header: (ServerJoinMessage, ["server_id"]),
     ServerKickMessage.header: (ServerKickMessage, []),
     ServerListGetMessage.header: (ServerListGetMessage, []),
     ServerListSendMessage.header: (ServerListSendMessage, ["servers"])
 }
 
+
+class SnapshotCache():
+    """Encoded snapshot messages, reused until the state they were built from changes.
+
+    Entries are stamped with the version of the state they were built from, and rebuilt once a
+    different version is requested.
+
+    """
+    def __init__(self) -> None:
+        self._entries: Dict[Tuple[str, bool], Tuple[int, Union[str, bytes]]] = {}
+
+    def get(
+        self,
+        header: str,
+        version: int,
+        binary: bool,
+        build: Callable[[], AbstractMessage]
+    ) -> Union[str, bytes]:
+        """Gets an encoded snapshot message, building it if the cached one is out of date.
+
+        Args:
+            header: Header of snapshot message.
+            version: Version of the state that snapshot contains.
+            binary: Get MessagePack encoding instead of JSON.
+            build: Builds snapshot message from current state.
+
+        Returns:
+            Encoded snapshot message.
+
+        """
+        entry = self._entries.get((header, binary))
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        data = encode(build(), binary)
+        self._entries[(header, binary)] = (version, data)
+        return data
+
+
+MSGPACK_SUBPROTOCOL: Final = "uita.msgpack"
+"""Websocket subprotocol for connections that exchange MessagePack encoded messages in binary
+frames. Connections without it exchange JSON encoded messages in text frames."""
+
 # Mild length sanitization on any input that is used for indexing
 MAX_CLIENT_MESSAGE_LENGTH: Final = 5000
 MAX_DIGITS_64BIT: Final = math.ceil(64 * math.log10(2))  # 64 * log 2 = log (2^64)
 MAX_HEADER_LENGTH: Final = 50
+MAX_SEARCH_LENGTH: Final = 200
 MAX_SESSION_LENGTH: Final = 64
 MAX_TRACK_ID_LENGTH: Final = 32
 MAX_URL_LENGTH: Final = 2000
 
 
-def parse(message: str) -> AbstractMessage:
-    """Parse and validate raw message strings.
+def encode(message: AbstractMessage, binary: bool = False) -> Union[str, bytes]:
+    """Serializes a message for network transfer.
+
+    Args:
+        message: Message to serialize.
+        binary: Encode with MessagePack instead of JSON, default ``False``.
+
+    Returns:
+        MessagePack encoded message if ``binary`` is set, otherwise JSON encoded message.
+
+    """
+    return bytes(message) if binary else str(message)
+
+
+def decode(message: Union[str, bytes]) -> Any:
+    """Decodes a raw message without validating it, for messages sent by trusted servers.
+
+    Args:
+        message: JSON encoded message string, or MessagePack encoded message bytes.
+
+    Returns:
+        Decoded message object.
+
+    """
+    if isinstance(message, bytes):
+        return msgpack.unpackb(message, raw=False)
+    return json.loads(message)
+
+
+def _stringify_numbers(value: Any) -> Any:
+    """Converts numbers to strings the way JSON messages are parsed."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, list):
+        return [_stringify_numbers(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _stringify_numbers(v) for k, v in value.items()}
+    return value
+
+
+def parse(message: Union[str, bytes]) -> AbstractMessage:
+    """Parse and validate raw messages.
 
     Args:
-        message: JSON encoded message to be parsed.
+        message: JSON encoded message string, or MessagePack encoded message bytes.
 
     Returns:
         A subclass of :class:`~uita.message.AbstractMessage` containing a header and associated
@@ -463,10 +686,18 @@ def parse(message: str) -> AbstractMessage:
     """
     if len(message) > MAX_CLIENT_MESSAGE_LENGTH:
         raise uita.exceptions.MalformedMessage("Message exceeded maximum length")
-    try:
-        msg = json.loads(message, parse_int=str, parse_float=str)
-    except (json.JSONDecodeError, TypeError):
-        raise uita.exceptions.MalformedMessage("Expected JSON encoded object")
+    if isinstance(message, bytes):
+        try:
+            msg = _stringify_numbers(msgpack.unpackb(message, raw=False))
+        except (ValueError, TypeError):
+            raise uita.exceptions.MalformedMessage("Expected MessagePack encoded object")
+        if not isinstance(msg, dict):
+            raise uita.exceptions.MalformedMessage("Expected MessagePack encoded object")
+    else:
+        try:
+            msg = json.loads(message, parse_int=str, parse_float=str)
+        except (json.JSONDecodeError, TypeError):
+            raise uita.exceptions.MalformedMessage("Expected JSON encoded object")
 
     # Ensure message header exists and is properly formatted
     if "header" not in msg or not isinstance(msg["header"], str) or not len(msg["header"]):
@@ -0,0 +1,187 @@
+"""Minimal asynchronous client for key-value servers speaking the Redis protocol (RESP)."""
+import asyncio
+import collections
+import urllib.parse
+from typing import Any, Callable, Deque, List, Optional, Union
+
+import logging
+log = logging.getLogger(__name__)
+
+Reply = Union[None, int, bytes, str, List[Any]]
+
+
+class ReplyError(Exception):
+    """Occurs when the server replies to a command with an error."""
+    pass
+
+
+class Connection():
+    """Single connection to a RESP server.
+
+    Commands are pipelined, so any number can be in flight at once with replies matched to
+    commands in the order they were sent.
+
+    Args:
+        reader: Stream connected to server.
+        writer: Stream connected to server.
+        loop: Event loop to run reply handling in.
+
+    """
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        loop: asyncio.AbstractEventLoop
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._loop = loop
+        self._waiting: Deque[asyncio.Future[Reply]] = collections.deque()
+        self._on_push: Optional[Callable[[List[Any]], None]] = None
+        self._reply_task = loop.create_task(self._read_replies())
+
+    async def command(self, *args: Union[str, int, bytes]) -> Reply:
+        """Sends a command and waits for its reply.
+
+        Args:
+            args: Command name followed by its arguments.
+
+        Returns:
+            Reply to command. Bulk strings are returned as ``bytes``.
+
+        Raises:
+            uita.resp.ReplyError: If the server replies with an error.
+            ConnectionError: If the connection is lost.
+
+        """
+        if self.closed:
+            raise ConnectionError("RESP connection closed")
+        reply: asyncio.Future[Reply] = self._loop.create_future()
+        self._waiting.append(reply)
+        self._writer.write(encode(*args))
+        return await reply
+
+    async def subscribe(self, channel: str, callback: Callable[[bytes], None]) -> None:
+        """Subscribes to a channel. The connection can only be used for subscriptions after this.
+
+        Args:
+            channel: Channel to subscribe to.
+            callback: Called with each message published to the channel.
+
+        """
+        def on_push(reply: List[Any]) -> None:
+            if len(reply) == 3 and reply[0] == b"message":
+                callback(reply[2])
+        self._on_push = on_push
+        await self.command("SUBSCRIBE", channel)
+
+    @property
+    def closed(self) -> bool:
+        """Whether the connection has been closed or lost."""
+        return self._reply_task.done()
+
+    def close(self) -> None:
+        """Closes connection."""
+        self._writer.close()
+        self._reply_task.cancel()
+
+    async def wait_closed(self) -> None:
+        """Waits until the connection has been closed or lost."""
+        await asyncio.wait([self._reply_task], loop=self._loop)
+
+    async def _read_replies(self) -> None:
+        try:
+            while True:
+                try:
+                    reply = await _read_reply(self._reader)
+                except ReplyError as reply_error:
+                    error = reply_error
+                    self._resolve(lambda waiter: waiter.set_exception(error))
+                    continue
+                # Subscribed connections receive published messages in between replies
+                if (
+                    self._on_push is not None
+                    and isinstance(reply, list)
+                    and reply[:1] == [b"message"]
+                ):
+                    self._on_push(reply)
+                else:
+                    self._resolve(lambda waiter: waiter.set_result(reply))
+        except (asyncio.IncompleteReadError, ConnectionError) as error:
+            log.warning(f"RESP connection lost: {error}")
+        finally:
+            while self._waiting:
+                waiter = self._waiting.popleft()
+                if not waiter.done():
+                    waiter.set_exception(ConnectionError("RESP connection closed"))
+
+    def _resolve(self, resolve: Callable[["asyncio.Future[Reply]"], None]) -> None:
+        waiter = self._waiting.popleft()
+        # Replies still have to be consumed for commands that were cancelled
+        if not waiter.done():
+            resolve(waiter)
+
+
+async def connect(uri: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> Connection:
+    """Opens a connection to a RESP server.
+
+    Args:
+        uri: Server location in the form ``redis://[:password@]host[:port][/db]``.
+        loop: Event loop to run connection in, defaults to ``asyncio.get_event_loop()``.
+
+    Returns:
+        Open connection, authenticated and with database selected.
+
+    """
+    loop = loop or asyncio.get_event_loop()
+    url = urllib.parse.urlparse(uri)
+    reader, writer = await asyncio.open_connection(
+        url.hostname or "localhost", url.port or 6379, loop=loop
+    )
+    connection = Connection(reader, writer, loop)
+    if url.password:
+        await connection.command("AUTH", urllib.parse.unquote(url.password))
+    database = url.path.strip("/")
+    if database:
+        await connection.command("SELECT", database)
+    return connection
+
+
+def encode(*args: Union[str, int, bytes]) -> bytes:
+    """Encodes a command as a RESP array of bulk strings.
+
+    Args:
+        args: Command name followed by its arguments.
+
+    Returns:
+        Encoded command.
+
+    """
+    data = b"*%d\r\n" % len(args)
+    for arg in args:
+        if isinstance(arg, int):
+            arg = str(arg)
+        if isinstance(arg, str):
+            arg = arg.encode()
+        data += b"$%d\r\n%s\r\n" % (len(arg), arg)
+    return data
+
+
+async def _read_reply(reader: asyncio.StreamReader) -> Reply:
+    line = await reader.readuntil(b"\r\n")
+    kind, value = line[:1], line[1:-2]
+    if kind == b"+":
+        return value.decode()
+    if kind == b"-":
+        raise ReplyError(value.decode())
+    if kind == b":":
+        return int(value)
+    if kind == b"$":
+        if int(value) < 0:
+            return None
+        return (await reader.readexactly(int(value) + 2))[:-2]
+    if kind == b"*":
+        if int(value) < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(int(value))]
+    raise ConnectionError(f"Unknown RESP reply type {kind!r}")
@@ -1,14 +1,64 @@
 """Event triggers for web client to."""
 import asyncio
+import hashlib
 import os
 import uuid
+import weakref
+from typing import Dict, List, Tuple
 
 import uita
+import uita.discord_api
+import uita.exceptions
 import uita.message
+import uita.shards
 import uita.types
 import uita.utils
+import uita.youtube_api
 from uita.ui_server import Event
 
+import logging
+log = logging.getLogger(__name__)
+
+# Time in seconds to wait for a user to stop typing before sending a search request
+SEARCH_DEBOUNCE = 0.3
+# Number of file chunks that a client can send before waiting for them to be acknowledged
+FILE_UPLOAD_WINDOW = 8
+# Size of write buffer used for file uploads, in bytes
+FILE_UPLOAD_BUFFER = 1024 * 1024
+# Time in seconds to wait for the next file chunk before giving up on a connection
+FILE_UPLOAD_TIMEOUT = 30
+# Time in seconds that interrupted file uploads are kept for clients to resume
+FILE_UPLOAD_RESUME_TIMEOUT = 10 * 60
+
+
+class _PartialUpload():
+    def __init__(self, path: str, size: int, loop: asyncio.AbstractEventLoop) -> None:
+        self.path = path
+        self.size = size
+        # Bytes written so far, which are always hashed and flushed together
+        self.received = 0
+        self.sha256 = hashlib.sha256()
+        # Held by the connection currently writing to the upload
+        self.lock = asyncio.Lock(loop=loop)
+
+
+_search_cache = uita.youtube_api.SearchCache()
+# IDs of every server each user is a member of, used to check access with lazily loaded members
+_user_server_ids: "uita.utils.TTLCache[str, List[str]]" = uita.utils.TTLCache(
+    maxsize=1000, ttl=60
+)
+# Bytes still to be written by each file upload in progress, indexed by file path. Counted as
+# used cache space so that simultaneous uploads can't overfill the cache together
+_upload_remaining: Dict[str, int] = {}
+# Uploads that can be resumed by reconnecting clients, indexed by user ID and file hash
+_partial_uploads: "uita.utils.TTLCache[Tuple[str, str], _PartialUpload]" = uita.utils.TTLCache(
+    maxsize=1000, ttl=FILE_UPLOAD_RESUME_TIMEOUT
+)
+# Most recent search task for each connection, superseded when a new query arrives
+_search_tasks: "weakref.WeakKeyDictionary[object, asyncio.Task[None]]" = (
+    weakref.WeakKeyDictionary()
+)
+
 
 @uita.server.on_message(uita.message.ChannelActiveGetMessage)
 async def channel_active_get(event: Event[uita.message.ChannelActiveGetMessage]) -> None:
@@ -17,7 +67,7 @@ async def channel_active_get(event: Event[uita.message.ChannelActiveGetMessage])
     # @on_message(require_active_server=True)
     assert event.active_server is not None
     voice = uita.state.voice_connections[event.active_server.id]
-    await event.socket.send(str(uita.message.ChannelActiveSendMessage(voice.active_channel)))
+    await event.send(uita.message.ChannelActiveSendMessage(voice.active_channel))
 
 
 @uita.server.on_message(uita.message.ChannelJoinMessage)
@@ -40,10 +90,10 @@ async def channel_leave(event: Event[uita.message.ChannelLeaveMessage]) -> None:
 async def channel_list_get(event: Event[uita.message.ChannelListGetMessage]) -> None:
     """Provide a list of available voice channels to client."""
     assert event.active_server is not None
-    discord_channels = [
-        channel for channel in event.active_server.channels.values()
-    ]
-    await event.socket.send(str(uita.message.ChannelListSendMessage(discord_channels)))
+    await event.send_data(
+        event.active_server.encoded_channels(event.binary),
+        uita.message.ChannelListSendMessage.header
+    )
 
 
 @uita.server.on_message(uita.message.FileUploadStartMessage, block=True)
@@ -56,74 +106,233 @@ async def file_upload_start(event: Event[uita.message.FileUploadStartMessage]) -
         raise uita.exceptions.ClientError(uita.message.ErrorQueueFullMessage())
     # Sanitization
     file_size = event.message.size
-    file_path = os.path.join(uita.utils.cache_dir(), uuid.uuid4().hex)
     if file_size > event.config.file.upload_max_size:
         raise uita.exceptions.ClientError(
             uita.message.ErrorFileInvalidMessage("Uploaded file exceeds maximum size")
         )
-    dir_size = await uita.utils.dir_size(uita.utils.cache_dir(), loop=event.loop)
-    if dir_size + file_size > event.config.file.cache_max_size:
-        raise uita.exceptions.ClientError(
-            uita.message.ErrorFileInvalidMessage("Playback cache has exceeded capacity")
-        )
-    # Loop socket reads until file is complete
+    # Uploads are stored under the hash of their contents, so files that are already cached can
+    # be queued again without being transferred
+    file_path = os.path.join(uita.utils.cache_dir(), event.message.sha256)
     with uita.utils.prune_cache_guard(file_path):
-        with open(file_path, "wb") as f:
-            # Pre-allocate full filesize so other upload tasks get valid dir_size results
-            f.seek(file_size-1)
-            f.write(b"\0")
-            f.flush()
-            os.fsync(f.fileno())
-            f.seek(0)
-            # Data receiving loop
-            bytes_read = 0
-            while bytes_read < file_size:
-                # Return the original message to signal next file slice
-                await event.socket.send(str(event.message))
-                data = await asyncio.wait_for(event.socket.recv(), 30, loop=event.loop)
-                if isinstance(data, str):
-                    raise uita.exceptions.MalformedFile("Non-binary data transferred unexpectedly")
-                f.write(data)
-                bytes_read += len(data)
-        # Double check client isn't trying to pull a fast one on us
-        if bytes_read > event.config.file.upload_max_size:
-            os.remove(file_path)
-            raise uita.exceptions.MalformedFile("Uploaded file exceeds maximum size")
+        if os.path.isfile(file_path) and os.path.getsize(file_path) == file_size:
+            # Mark as recently used so that it outlasts older files when the cache is pruned
+            os.utime(file_path)
+        else:
+            await _receive_file(event, file_path)
         # Enqueue uploaded file
         try:
             await voice.enqueue_file(file_path, event.user)
-        except Exception:
-            os.remove(file_path)
+        except uita.exceptions.ClientError as error:
+            # Other servers may have the same file queued, unless it isn't playable at all
+            if isinstance(error.message, uita.message.ErrorFileInvalidMessage):
+                os.remove(file_path)
             raise
         # Signal the successful file upload
-        await event.socket.send(str(uita.message.FileUploadCompleteMessage()))
+        await event.send(uita.message.FileUploadCompleteMessage())
+
+
+async def _receive_file(event: Event[uita.message.FileUploadStartMessage], file_path: str) -> None:
+    file_size = event.message.size
+    # Uploads interrupted by a lost connection are resumed when the client tries again
+    key = (event.user.id, event.message.sha256)
+    upload = _partial_uploads.get(key)
+    if upload is None or upload.size != file_size:
+        upload = _PartialUpload(
+            os.path.join(uita.utils.cache_dir(), uuid.uuid4().hex), file_size, event.loop
+        )
+        _partial_uploads.set(key, upload)
+    # Connections that dropped without closing hold onto their upload until their reads time out
+    try:
+        await asyncio.wait_for(upload.lock.acquire(), FILE_UPLOAD_TIMEOUT, loop=event.loop)
+    except asyncio.TimeoutError:
+        raise uita.exceptions.ClientError(
+            uita.message.ErrorFileInvalidMessage("File is already being uploaded")
+        )
+    try:
+        if upload.received > 0 and not os.path.isfile(upload.path):
+            # Partial file was pruned from the cache, so start over
+            upload.received = 0
+            upload.sha256 = hashlib.sha256()
+        await _reserve_cache_space(event, file_size - upload.received)
+        # Loop socket reads until file is complete
+        with uita.utils.prune_cache_guard(upload.path):
+            _upload_remaining[upload.path] = file_size - upload.received
+            try:
+                with open(upload.path, "ab", buffering=FILE_UPLOAD_BUFFER) as f:
+                    f.truncate(upload.received)
+                    if upload.received > 0:
+                        await event.send(uita.message.FileUploadResumeMessage(upload.received))
+                    # Client streams chunks without waiting as long as they fit in the window,
+                    # which moves forward each time half of it has been received
+                    await event.send(uita.message.FileUploadAckMessage(0, FILE_UPLOAD_WINDOW))
+                    chunks_read = 0
+                    while upload.received < file_size:
+                        data = await asyncio.wait_for(
+                            event.socket.recv(), FILE_UPLOAD_TIMEOUT, loop=event.loop
+                        )
+                        if isinstance(data, str):
+                            raise uita.exceptions.MalformedFile(
+                                "Non-binary data transferred unexpectedly"
+                            )
+                        f.write(data)
+                        upload.sha256.update(data)
+                        upload.received += len(data)
+                        chunks_read += 1
+                        _upload_remaining[upload.path] = max(file_size - upload.received, 0)
+                        if chunks_read % max(FILE_UPLOAD_WINDOW // 2, 1) == 0:
+                            await event.send(
+                                uita.message.FileUploadAckMessage(chunks_read, FILE_UPLOAD_WINDOW)
+                            )
+                # Double check client isn't trying to pull a fast one on us
+                if upload.received > file_size:
+                    raise uita.exceptions.MalformedFile("Uploaded file exceeds declared size")
+                if upload.sha256.hexdigest() != event.message.sha256:
+                    raise uita.exceptions.MalformedFile(
+                        "Uploaded file does not match declared hash"
+                    )
+            except uita.exceptions.MalformedFile:
+                _partial_uploads.pop(key)
+                os.remove(upload.path)
+                raise
+            except Exception:
+                # Keep what was received for the client to resume after reconnecting, leaving
+                # the cache pruning task to remove it if they never do
+                _partial_uploads.set(key, upload)
+                uita.utils.prune_cache_lease(upload.path, FILE_UPLOAD_RESUME_TIMEOUT)
+                raise
+            finally:
+                del _upload_remaining[upload.path]
+            _partial_uploads.pop(key)
+            os.replace(upload.path, file_path)
+    finally:
+        upload.lock.release()
+
+
+async def _reserve_cache_space(
+    event: Event[uita.message.FileUploadStartMessage],
+    size: int
+) -> None:
+    # Check for cache space, making room by removing uploads that are no longer queued
+    reserved = sum(_upload_remaining.values()) + size
+    cache_max_size = event.config.file.cache_max_size
+    dir_size = await uita.utils.dir_size(uita.utils.cache_dir(), loop=event.loop)
+    if dir_size + reserved > cache_max_size:
+        dir_size = await uita.utils.prune_cache_dir(
+            whitelist=uita.state.queued_files(),
+            max_size=cache_max_size - reserved,
+            loop=event.loop
+        )
+    if dir_size + reserved > cache_max_size:
+        raise uita.exceptions.ClientError(
+            uita.message.ErrorFileInvalidMessage("Playback cache has exceeded capacity")
+        )
+
+
+@uita.server.on_message(
+    uita.message.SearchQueryMessage, require_active_server=False, concurrent=True
+)
+async def search_query(event: Event[uita.message.SearchQueryMessage]) -> None:
+    """Searches YouTube for a query as the user types it."""
+    # Only the latest query matters, anything older is abandoned
+    previous = _search_tasks.get(event.socket)
+    if previous is not None:
+        previous.cancel()
+    # Searched in a task of its own so that newer queries can cancel it
+    search = event.loop.create_task(_search(event))
+    _search_tasks[event.socket] = search
+    try:
+        await search
+    finally:
+        if _search_tasks.get(event.socket) is search:
+            del _search_tasks[event.socket]
+
+
+async def _search(event: Event[uita.message.SearchQueryMessage]) -> None:
+    query = event.message.query
+    results = _search_cache.get(query) if query.strip() else []
+    if results is None:
+        await asyncio.sleep(SEARCH_DEBOUNCE, loop=event.loop)
+        try:
+            results = await uita.youtube_api.search(
+                query,
+                api_key=event.config.youtube.api_key,
+                referrer=uita.utils.build_client_url(event.config),
+                loop=event.loop
+            )
+        except uita.exceptions.ClientError:
+            results = []
+        else:
+            _search_cache.set(query, results)
+    await event.send(uita.message.SearchResultsMessage(query, results))
 
 
 @uita.server.on_message(uita.message.ServerJoinMessage, require_active_server=False)
 async def server_join(event: Event[uita.message.ServerJoinMessage]) -> None:
     """Connect a user to the web client interface for a given Discord server."""
     # Check that user has access to this server
-    if (
-        event.message.server_id in uita.state.servers and
-        event.user.id in uita.state.servers[event.message.server_id].users
-    ):
-        event.user.active_server_id = event.message.server_id
+    if await uita.state.server_verify_user(event.message.server_id, event.user.id, uita.bot):
+        uita.server.set_active_server(event.socket, event.message.server_id)
     else:
-        event.user.active_server_id = None
-        await event.socket.send(str(uita.message.ServerKickMessage()))
+        uita.server.set_active_server(event.socket, None)
+        await event.send(uita.message.ServerKickMessage())
 
 
-@uita.server.on_message(uita.message.ServerListGetMessage, require_active_server=False)
+@uita.server.on_message(
+    uita.message.ServerListGetMessage, require_active_server=False, concurrent=True
+)
 async def server_list_get(event: Event[uita.message.ServerListGetMessage]) -> None:
     """Provide a list of all servers that the user and uitabot share membership in."""
+    if uita.state.lazy_members:
+        await _verify_user_servers(event)
     discord_servers = [
         uita.types.DiscordServer(
-            discord_server.id, discord_server.name, {}, {}, discord_server.icon
+            discord_server.id,
+            discord_server.name,
+            {},
+            {},
+            discord_server.icon,
+            discord_server.role
+        )
+        for discord_server in (
+            uita.state.servers[server_id]
+            for server_id in uita.state.user_get_servers(event.user.id)
         )
-        for key, discord_server in uita.state.servers.items()
-        if event.user.id in discord_server.users
     ]
-    await event.socket.send(str(uita.message.ServerListSendMessage(discord_servers)))
+    # Include servers run by other processes, unless this request was relayed from one of them
+    conn = uita.server.connections.get(event.socket)
+    if (
+        uita.server.router is not None
+        and event.socket.path != uita.shards.LOCAL_PATH
+        and conn is not None
+        and conn.session is not None
+    ):
+        discord_servers += await uita.server.router.remote_servers(conn.session)
+    await event.send(uita.message.ServerListSendMessage(discord_servers))
+
+
+async def _verify_user_servers(event: Event[uita.message.ServerListGetMessage]) -> None:
+    """Checks which servers a user can access, since only users checked before are known."""
+    server_ids = _user_server_ids.get(event.user.id)
+    if server_ids is None:
+        conn = uita.server.connections.get(event.socket)
+        if conn is None or conn.session is None:
+            return
+        token = await uita.server.database.get_access_token(conn.session)
+        if token is None:
+            return
+        try:
+            guilds = await uita.discord_api.get("/users/@me/guilds", token, event.loop)
+        except (uita.exceptions.AuthenticationError, uita.exceptions.RateLimitError) as error:
+            # Sessions from before the guilds scope was requested can't list servers
+            log.debug(f"Failed to list servers for {event.user.id}: {error}")
+            return
+        server_ids = [guild["id"] for guild in guilds]
+        _user_server_ids.set(event.user.id, server_ids)
+    await asyncio.gather(*[
+        uita.state.server_verify_user(server_id, event.user.id, uita.bot)
+        for server_id in server_ids
+        if server_id in uita.state.servers
+    ], loop=event.loop)
 
 
 @uita.server.on_message(uita.message.PlayQueueGetMessage)
@@ -131,7 +340,9 @@ async def play_queue_get(event: Event[uita.message.PlayQueueGetMessage]) -> None
     """Requests the queued playlist for the active server."""
     assert event.active_server is not None
     voice = uita.state.voice_connections[event.active_server.id]
-    await event.socket.send(str(uita.message.PlayQueueSendMessage(voice.queue())))
+    await event.send_data(
+        voice.encoded_queue(event.binary), uita.message.PlayQueueSendMessage.header
+    )
 
 
 @uita.server.on_message(uita.message.PlayQueueMoveMessage)
@@ -155,10 +366,12 @@ async def play_status_get(event: Event[uita.message.PlayStatusGetMessage]) -> No
     """Requests the current playback status from the active server."""
     assert event.active_server is not None
     voice = uita.state.voice_connections[event.active_server.id]
-    await event.socket.send(str(uita.message.PlayStatusSendMessage(voice.status())))
+    await event.send_data(
+        voice.encoded_status(event.binary), uita.message.PlayStatusSendMessage.header
+    )
 
 
-@uita.server.on_message(uita.message.PlayURLMessage)
+@uita.server.on_message(uita.message.PlayURLMessage, concurrent=True)
 async def play_url(event: Event[uita.message.PlayURLMessage]) -> None:
     """Queues the audio from a given URL."""
     assert event.active_server is not None
@@ -0,0 +1,229 @@
+"""Routes UI frontend connections between bot processes running different Discord shards."""
+import asyncio
+import websockets
+from typing import List, Optional, Union
+from typing_extensions import Final
+
+import uita.auth
+import uita.config
+import uita.exceptions
+import uita.message
+import uita.types
+import uita.utils
+
+import logging
+log = logging.getLogger(__name__)
+
+LOCAL_PATH: Final = "/local"
+"""Websocket path for connections that should only be served by the process they connect to.
+Used by other processes when routing, so that messages aren't routed more than once."""
+
+
+class Relay():
+    """Forwards messages between a UI frontend connection and the process running its server.
+
+    Args:
+        socket: Websocket connected to user.
+        outbox: Messages waiting to be sent to user, which forwarded messages are queued in.
+        upstream: Authenticated websocket connected to process running the user's active server.
+        loop: Event loop to forward messages in.
+
+    """
+    def __init__(
+        self,
+        socket: websockets.WebSocketServerProtocol,
+        outbox: "uita.ui_server.Outbox",
+        upstream: websockets.WebSocketClientProtocol,
+        loop: asyncio.AbstractEventLoop
+    ) -> None:
+        self.socket = socket
+        self.outbox = outbox
+        self.upstream = upstream
+        self._forward_task = loop.create_task(self._forward())
+
+    async def send(self, data: Union[str, bytes]) -> None:
+        """Forwards a message from the user.
+
+        Args:
+            data: Raw message sent by user.
+
+        """
+        await self.upstream.send(data)
+
+    async def close(self) -> None:
+        """Stops forwarding messages and disconnects from the other process."""
+        self._forward_task.cancel()
+        await self.upstream.close()
+
+    async def _forward(self) -> None:
+        try:
+            while True:
+                self.outbox.put(await self.upstream.recv())
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        # If the other process went away, send user back to server select screen
+        self.outbox.put(uita.message.encode(
+            uita.message.ServerKickMessage(),
+            self.socket.subprotocol == uita.message.MSGPACK_SUBPROTOCOL
+        ))
+
+
+class Router():
+    """Decides which bot process serves each Discord server, relaying connections between them.
+
+    Every process runs the shards where ``shard_id % len(workers) == worker_id``. Users can
+    connect to any process, and messages for servers run by another process are relayed to it
+    using the user's session, which requires every process to share a database. Relays use the
+    same subprotocol as the user's connection, so messages are forwarded without re-encoding.
+
+    Args:
+        config: Configuration options containing sharding settings.
+        loop: Event loop to run relays in, defaults to ``asyncio.get_event_loop()``.
+
+    Attributes:
+        shard_count (int): Total number of shards across every process.
+        workers (List[str]): Websocket URLs of every process, indexed by worker ID.
+        worker_id (int): ID of this process.
+
+    Raises:
+        uita.exceptions.MalformedConfig: If the sharding settings are incomplete.
+
+    """
+    def __init__(
+        self,
+        config: uita.config.Config,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> None:
+        sharding = config.bot.sharding
+        if sharding.shard_count is None or not 0 <= sharding.worker_id < len(sharding.workers):
+            raise uita.exceptions.MalformedConfig
+        self.shard_count: int = sharding.shard_count
+        self.workers = sharding.workers
+        self.worker_id = sharding.worker_id
+        self.loop = loop or asyncio.get_event_loop()
+        self._origin = websockets.Origin(uita.utils.build_client_url(config))
+
+    @property
+    def shard_ids(self) -> List[int]:
+        """IDs of shards run by this process."""
+        return list(range(self.worker_id, self.shard_count, len(self.workers)))
+
+    def worker_url(self, server_id: str) -> Optional[str]:
+        """Finds the process running a Discord server.
+
+        Args:
+            server_id: Discord server ID.
+
+        Returns:
+            Websocket URL of process running server, ``None`` if it is this process.
+
+        """
+        worker_id = uita.utils.shard_id(server_id, self.shard_count) % len(self.workers)
+        if worker_id == self.worker_id:
+            return None
+        return self.workers[worker_id]
+
+    async def relay(
+        self,
+        socket: websockets.WebSocketServerProtocol,
+        outbox: "uita.ui_server.Outbox",
+        session: uita.auth.Session,
+        server_id: str
+    ) -> Optional[Relay]:
+        """Opens a relay to the process running a Discord server.
+
+        Args:
+            socket: Websocket connected to user.
+            outbox: Messages waiting to be sent to user.
+            session: Session that user authenticated with.
+            server_id: Discord server ID that user is joining.
+
+        Returns:
+            Open relay, ``None`` if server is run by this process.
+
+        Raises:
+            uita.exceptions.AuthenticationError: If the other process could not be reached or
+                refused the user's session.
+
+        """
+        url = self.worker_url(server_id)
+        if url is None:
+            return None
+        upstream = await self._connect(url, session, socket.subprotocol)
+        return Relay(socket, outbox, upstream, self.loop)
+
+    async def remote_servers(self, session: uita.auth.Session) -> List[uita.types.DiscordServer]:
+        """Lists the servers that a user can access in every other process.
+
+        Processes that can't be reached are skipped.
+
+        Args:
+            session: Session that user authenticated with.
+
+        Returns:
+            List of servers containing only their ID, name and icon.
+
+        """
+        async def get_servers(url: str) -> List[uita.types.DiscordServer]:
+            try:
+                upstream = await self._connect(url, session)
+                try:
+                    await upstream.send(str(uita.message.ServerListGetMessage()))
+                    while True:
+                        reply = uita.message.decode(
+                            await asyncio.wait_for(upstream.recv(), timeout=5, loop=self.loop)
+                        )
+                        if reply["header"] == uita.message.ServerListSendMessage.header:
+                            break
+                finally:
+                    await upstream.close()
+            except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+                log.warning(f"Failed to list servers from {url}")
+                return []
+            except uita.exceptions.AuthenticationError as error:
+                log.warning(f"Failed to list servers from {url}: {error}")
+                return []
+            return [
+                uita.types.DiscordServer(server["id"], server["name"], {}, {}, server["icon"])
+                for server in reply["servers"]
+            ]
+        server_lists = await asyncio.gather(*[
+            get_servers(url)
+            for worker_id, url in enumerate(self.workers)
+            if worker_id != self.worker_id
+        ], loop=self.loop)
+        return [server for server_list in server_lists for server in server_list]
+
+    async def _connect(
+        self,
+        url: str,
+        session: uita.auth.Session,
+        subprotocol: Optional[str] = None
+    ) -> websockets.WebSocketClientProtocol:
+        subprotocols = [websockets.Subprotocol(subprotocol)] if subprotocol is not None else None
+        try:
+            upstream = await asyncio.wait_for(
+                websockets.connect(
+                    url + LOCAL_PATH,
+                    origin=self._origin,
+                    subprotocols=subprotocols,
+                    loop=self.loop
+                ),
+                timeout=5,
+                loop=self.loop
+            )
+        except (asyncio.TimeoutError, OSError, websockets.exceptions.InvalidHandshake) as error:
+            raise uita.exceptions.AuthenticationError(f"Could not connect to {url}: {error}")
+        try:
+            auth_message = uita.message.AuthSessionMessage(session.handle, session.secret)
+            await upstream.send(str(auth_message))
+            reply = uita.message.decode(
+                await asyncio.wait_for(upstream.recv(), timeout=5, loop=self.loop)
+            )
+        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+            await upstream.close()
+            raise uita.exceptions.AuthenticationError(f"No response from {url}")
+        if reply.get("header") != uita.message.AuthSucceedMessage.header:
+            await upstream.close()
+            raise uita.exceptions.AuthenticationError(f"Session refused by {url}")
+        return upstream
@@ -1,7 +1,9 @@
 """Defines various container and running state types for the Discord API."""
 import asyncio
 import discord
-from typing import Dict, List, Optional
+import sys
+import weakref
+from typing import AbstractSet, Dict, List, Optional, Set, Tuple, Union
 
 import uita.audio
 import uita.utils
@@ -18,11 +20,24 @@ class DiscordState():
             by server ID.
         voice_connections (Dict[str, uita.types.DiscordVoiceClient]): Dict of voice channels bot is
             connected to indexed by server ID.
+        user_servers (Dict[str, Set[str]]): Dict of IDs for servers each user can access indexed
+            by user ID. Kept in sync with the user lists of ``servers``.
+        initialized (bool): Whether state has been initialized from a ``discord.Client``.
+        lazy_members (bool): Whether server members are checked on demand rather than loaded up
+            front. If set, server user lists only contain users that have been checked with
+            :meth:`server_verify_user`.
 
     """
     def __init__(self) -> None:
         self.servers: Dict[str, DiscordServer] = {}
         self.voice_connections: Dict[str, DiscordVoiceClient] = {}
+        self.user_servers: Dict[str, Set[str]] = {}
+        self.initialized = False
+        self.lazy_members = False
+        # Recently checked server and user ID pairs, with whether the user had access
+        self._verified_users: uita.utils.TTLCache[Tuple[str, str], bool] = uita.utils.TTLCache(
+            maxsize=10000, ttl=5 * 60
+        )
 
     def __str__(self) -> str:
         dump_str = f"DiscordState() {hash(self)}:\n"
@@ -37,6 +52,24 @@ class DiscordState():
     def _clear(self) -> None:
         self.servers = {}
         self.voice_connections = {}
+        self.user_servers = {}
+        self._verified_users.clear()
+
+    def _index_users(self, server: "DiscordServer") -> None:
+        for user_id in server.users:
+            self.user_servers.setdefault(user_id, set()).add(server.id)
+
+    def _unindex_users(self, server: "DiscordServer") -> None:
+        for user_id in server.users:
+            self._unindex_user(server.id, user_id)
+
+    def _unindex_user(self, server_id: str, user_id: str) -> None:
+        user_servers = self.user_servers.get(user_id)
+        if user_servers is None:
+            return
+        user_servers.discard(server_id)
+        if not user_servers:
+            del self.user_servers[user_id]
 
     def initialize_from_bot(self, bot: discord.Client) -> None:
         """Initialize Discord state from a ``discord.Client``
@@ -49,33 +82,68 @@ class DiscordState():
         self._clear()
 
         for server in bot.guilds:
-            discord_channels = {
-                str(channel.id): DiscordChannel(
-                    str(channel.id),
-                    channel.name,
-                    channel.type,
-                    str(channel.category_id) if channel.category_id else None,
-                    channel.position
-                )
-                for channel in server.channels
-                if uita.utils.verify_channel_visibility(channel, server.me)
-            }
-            role = uita.server.database.get_server_role(str(server.id))
-            discord_users = {
-                str(user.id):
-                user.name for user in server.members
-                if uita.utils.verify_user_permissions(user, role)
-            }
-            self.servers[str(server.id)] = DiscordServer(
-                str(server.id),
-                server.name,
-                discord_channels,
-                discord_users,
-                server.icon
-            )
+            self.servers[str(server.id)] = self._server_from_guild(server)
+            self._index_users(self.servers[str(server.id)])
             self.voice_connections[str(server.id)] = DiscordVoiceClient(str(server.id), bot.loop)
+        self.initialized = True
         log.info("Bot state synced to Discord")
 
+    def initialize_shard_from_bot(self, bot: discord.AutoShardedClient, shard_id: int) -> None:
+        """Re-initialize the Discord state of a single shard, leaving other shards untouched.
+
+        Args:
+            bot: Bot containing Discord state to copy.
+            shard_id: ID of shard to copy state for.
+
+        """
+        shard_count = bot.shard_count
+        assert shard_count is not None
+        guilds = [guild for guild in bot.guilds if guild.shard_id == shard_id]
+        server_ids = {str(guild.id) for guild in guilds}
+        # Drop servers left while the shard was disconnected
+        for server_id in list(self.servers):
+            if (
+                server_id not in server_ids
+                and uita.utils.shard_id(server_id, shard_count) == shard_id
+            ):
+                self.server_remove(server_id)
+        for guild in guilds:
+            server = self._server_from_guild(guild)
+            # Members checked on demand aren't loaded with the guild, so keep the ones known
+            if self.lazy_members and server.id in self.servers:
+                server.users = self.servers[server.id].users
+            self.server_add(server, bot)
+        # Remembered access may have changed while the shard was disconnected
+        self._verified_users.clear(lambda key: key[0] in server_ids)
+        log.info(f"Bot state synced to Discord shard {shard_id}")
+
+    def _server_from_guild(self, server: discord.Guild) -> "DiscordServer":
+        discord_channels = {
+            str(channel.id): DiscordChannel(
+                str(channel.id),
+                channel.name,
+                channel.type,
+                str(channel.category_id) if channel.category_id else None,
+                channel.position
+            )
+            for channel in server.channels
+            if uita.utils.verify_channel_visibility(channel, server.me)
+        }
+        role = uita.server.database.get_server_role(str(server.id))
+        discord_users = {
+            sys.intern(str(user.id)):
+            user.name for user in server.members
+            if uita.utils.verify_user_permissions(user, role)
+        } if not self.lazy_members else {}
+        return DiscordServer(
+            str(server.id),
+            server.name,
+            discord_channels,
+            discord_users,
+            server.icon,
+            role
+        )
+
     def server_add(self, server: "DiscordServer", bot: discord.Client) -> None:
         """Add an accessible server to Discord state.
 
@@ -85,7 +153,10 @@ class DiscordState():
 
         """
         log.debug(f"server_add {server.id}")
+        if server.id in self.servers:
+            self._unindex_users(self.servers[server.id])
         self.servers[server.id] = server
+        self._index_users(server)
         # Non-POD type with persistent connections, doesn't need to be updated
         if server.id not in self.voice_connections:
             self.voice_connections[server.id] = DiscordVoiceClient(server.id, bot.loop)
@@ -98,8 +169,10 @@ class DiscordState():
 
         """
         log.debug(f"server_remove {server_id}")
+        self._unindex_users(self.servers[server_id])
         del self.servers[server_id]
         del self.voice_connections[server_id]
+        self._verified_users.clear(lambda key: key[0] == server_id)
 
     def server_add_channel(self, server_id: str, channel: "DiscordChannel") -> None:
         """Add a server channel to Discord state.
@@ -111,6 +184,7 @@ class DiscordState():
         """
         log.debug(f"server_add_channel {channel.id}")
         self.servers[server_id].channels[channel.id] = channel
+        self.servers[server_id].channels_version += 1
 
     def server_remove_channel(self, server_id: str, channel_id: str) -> None:
         """Remove a server channel from Discord state.
@@ -122,6 +196,7 @@ class DiscordState():
         """
         log.debug(f"server_remove_channel {channel_id}")
         del self.servers[server_id].channels[channel_id]
+        self.servers[server_id].channels_version += 1
 
     def server_add_user(self, server_id: str, user_id: str, user_name: str) -> None:
         """Add an accessible server for a user.
@@ -132,7 +207,11 @@ class DiscordState():
             user_name: New username.
 
         """
+        user_id = sys.intern(user_id)
         self.servers[server_id].users[user_id] = user_name
+        self.user_servers.setdefault(user_id, set()).add(server_id)
+        if self.lazy_members:
+            self._verified_users.set((server_id, user_id), True)
 
     def server_remove_user(self, server_id: str, user_id: str) -> None:
         """Remove an inaccessible server for a user.
@@ -143,6 +222,72 @@ class DiscordState():
 
         """
         del self.servers[server_id].users[user_id]
+        self._unindex_user(server_id, user_id)
+        if self.lazy_members:
+            self._verified_users.set((server_id, user_id), False)
+
+    async def server_verify_user(
+        self,
+        server_id: str,
+        user_id: str,
+        bot: discord.Client,
+        refresh: bool = False
+    ) -> bool:
+        """Check whether a user can access a server, updating the server's user list.
+
+        Server user lists are complete unless :attr:`lazy_members` is set, in which case members
+        are fetched from Discord as needed and the result is remembered for a few minutes.
+
+        Args:
+            server_id: Server to check access to.
+            user_id: User to check.
+            bot: Bot to fetch members with.
+            refresh: Ignore any remembered result, fetching member again.
+
+        Returns:
+            ``True`` if user is a member of the server with access to bot commands.
+
+        """
+        if server_id not in self.servers:
+            return False
+        if not self.lazy_members:
+            return user_id in self.servers[server_id].users
+        verified = self._verified_users.get((server_id, user_id))
+        if verified is not None and not refresh:
+            return verified
+
+        guild = bot.get_guild(int(server_id))
+        member = guild.get_member(int(user_id)) if guild is not None else None
+        if guild is not None and member is None:
+            try:
+                member = await guild.fetch_member(int(user_id))
+            except discord.errors.NotFound:
+                pass
+        # Server may have been left while fetching
+        if server_id not in self.servers:
+            return False
+        if member is not None and uita.utils.verify_user_permissions(
+            member, self.servers[server_id].role
+        ):
+            self.server_add_user(server_id, user_id, member.name)
+            return True
+        if user_id in self.servers[server_id].users:
+            self.server_remove_user(server_id, user_id)
+        else:
+            self._verified_users.set((server_id, user_id), False)
+        return False
+
+    def user_get_servers(self, user_id: str) -> AbstractSet[str]:
+        """Get the servers that a user can access.
+
+        Args:
+            user_id: User to get servers for.
+
+        Returns:
+            IDs of servers that user has access to bot commands in.
+
+        """
+        return self.user_servers.get(user_id, frozenset())
 
     def server_get_role(self, server_id: str) -> Optional[str]:
         """Get the role required to use bot commands.
@@ -161,7 +306,7 @@ class DiscordState():
         # Get database value if server is not stored in state yet (like in on_guild_join)
         return uita.server.database.get_server_role(server_id)
 
-    def server_set_role(self, server_id: str, role_id: Optional[str]) -> None:
+    async def server_set_role(self, server_id: str, role_id: Optional[str]) -> None:
         """Set a role required to use bot commands. ``None`` for free access.
 
         Args:
@@ -169,11 +314,39 @@ class DiscordState():
             role_id: ID of required role. Can be ``None`` for no requirement.
 
         """
-        uita.server.database.set_server_role(server_id, role_id)
+        await uita.server.database.set_server_role(server_id, role_id)
+        self.server_update_role(server_id, role_id)
+
+    def server_update_role(self, server_id: str, role_id: Optional[str]) -> None:
+        """Applies a required role change that has already been stored, such as by another process.
+
+        Members are not re-checked against the new role.
+
+        Args:
+            server_id: Server to update.
+            role_id: ID of required role. Can be ``None`` for no requirement.
+
+        """
         try:
             self.servers[server_id].role = role_id
         except KeyError:
             pass
+        # Remembered access was checked against the old role
+        self._verified_users.clear(lambda key: key[0] == server_id)
+
+    def queued_files(self) -> List[str]:
+        """Get the local files queued for playback in every server.
+
+        Returns:
+            Absolute paths of queued files.
+
+        """
+        return [
+            track.path
+            for voice in self.voice_connections.values()
+            for track in voice.queue()
+            if track.local
+        ]
 
 
 class DiscordChannel():
@@ -195,6 +368,8 @@ class DiscordChannel():
         position (int): Ordered position in channel list.
 
     """
+    __slots__ = ("id", "name", "type", "category", "position")
+
     def __init__(
         self,
         id: str,
@@ -203,7 +378,7 @@ class DiscordChannel():
         category: Optional[str],
         position: int
     ) -> None:
-        self.id = id
+        self.id = sys.intern(id)
         self.name = name
         self.type = type
         self.category = category
@@ -219,6 +394,7 @@ class DiscordServer():
         channels: Dictionary of channels in server.
         users: Dictionary of users in server with access to bot commands.
         icon: Server icon hash.
+        role: Role ID needed to use bot commands. ``None`` for unrestricted access.
 
     Attributes:
         id (str): Unique server ID.
@@ -228,22 +404,48 @@ class DiscordServer():
         icon (Optional[str]): Server icon hash. ``None`` if no custom icon exists.
         role (Optional[str]): Role ID needed to use bot commands. Set to ``None`` for unrestricted
             access.
+        channels_version (int): Incremented whenever ``channels`` is changed through
+            :class:`~uita.types.DiscordState`.
 
     """
+    __slots__ = (
+        "id", "name", "channels", "users", "icon", "role", "channels_version", "_snapshots"
+    )
+
     def __init__(
         self,
         id: str,
         name: str,
         channels: Dict[str, DiscordChannel],
         users: Dict[str, str],
-        icon: Optional[str]
+        icon: Optional[str],
+        role: Optional[str] = None
     ) -> None:
-        self.id = id
+        self.id = sys.intern(id)
         self.name = name
         self.channels = channels
         self.users = users
         self.icon = icon
-        self.role: Optional[str] = uita.server.database.get_server_role(self.id)
+        self.role = role
+        self.channels_version = 0
+        self._snapshots = uita.message.SnapshotCache()
+
+    def encoded_channels(self, binary: bool) -> Union[str, bytes]:
+        """Gets the encoded channel list message for this server, reused until channels change.
+
+        Args:
+            binary: Get MessagePack encoding instead of JSON.
+
+        Returns:
+            Encoded :class:`~uita.message.ChannelListSendMessage`.
+
+        """
+        return self._snapshots.get(
+            uita.message.ChannelListSendMessage.header,
+            self.channels_version,
+            binary,
+            lambda: uita.message.ChannelListSendMessage(list(self.channels.values()))
+        )
 
 
 class DiscordUser():
@@ -264,6 +466,8 @@ class DiscordUser():
             not joined a server yet.
 
     """
+    __slots__ = ("id", "name", "avatar", "active_server_id", "__weakref__")
+
     def __init__(
         self,
         id: str,
@@ -271,7 +475,7 @@ class DiscordUser():
         avatar: str,
         active_server_id: Optional[str]
     ) -> None:
-        self.id = id
+        self.id = sys.intern(id)
         self.name = name
         # Hack for discord.py forcing WebP extensions even though it has terrible browser support
         # This also replaces animated GIFs with static PNGs, but thats for the best
@@ -279,6 +483,30 @@ class DiscordUser():
         self.active_server_id = active_server_id
 
 
+# Shared user records, so that a user's many queued tracks don't each keep their own copy
+_interned_users: "weakref.WeakValueDictionary[Tuple[str, str, str], DiscordUser]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def intern_user(user: DiscordUser) -> DiscordUser:
+    """Gets a shared record of a user, for long lived references such as queued tracks.
+
+    Args:
+        user: User to get record for.
+
+    Returns:
+        Record with the same ID, name and avatar as ``user``. Is not active in any server.
+
+    """
+    key = (user.id, user.name, user.avatar)
+    interned = _interned_users.get(key)
+    if interned is None:
+        interned = DiscordUser(user.id, user.name, user.avatar, None)
+        _interned_users[key] = interned
+    return interned
+
+
 class DiscordVoiceClient():
     """Container for Discord voice connections.
 
@@ -328,6 +556,7 @@ class DiscordVoiceClient():
 
         self._voice: Optional[discord.VoiceClient] = None
         self._voice_lock = asyncio.Lock(loop=self.loop)
+        self._snapshots = uita.message.SnapshotCache()
 
     @property
     def active_channel(self) -> Optional[DiscordChannel]:
@@ -404,7 +633,12 @@ class DiscordVoiceClient():
             uita.exceptions.ClientError: If called with an unusable audio URL.
 
         """
-        await self._playlist.enqueue_url(url, user)
+        await self._playlist.enqueue_url(
+            url,
+            user,
+            api_key=uita.server.config.youtube.api_key,
+            referrer=uita.utils.build_client_url(uita.server.config)
+        )
 
     def queue(self) -> List[uita.audio.Track]:
         """Retrieves a list of currently queued audio resources for this connection.
@@ -415,6 +649,26 @@ class DiscordVoiceClient():
         """
         return self._playlist.queue()
 
+    def encoded_queue(self, binary: bool) -> Union[str, bytes]:
+        """Gets the encoded queue message for this connection, reused until the queue changes.
+
+        Args:
+            binary: Get MessagePack encoding instead of JSON.
+
+        Returns:
+            Encoded :class:`~uita.message.PlayQueueSendMessage`.
+
+        """
+        # Offset of the playing track changes continuously, so it can't be reused while playing
+        if self._playlist.status == uita.audio.Status.PLAYING:
+            return uita.message.encode(uita.message.PlayQueueSendMessage(self.queue()), binary)
+        return self._snapshots.get(
+            uita.message.PlayQueueSendMessage.header,
+            self._playlist.version,
+            binary,
+            lambda: uita.message.PlayQueueSendMessage(self.queue())
+        )
+
     def queue_full(self) -> bool:
         """Tests if the queue is at capacity.
 
@@ -433,6 +687,23 @@ class DiscordVoiceClient():
         """
         return self._playlist.status
 
+    def encoded_status(self, binary: bool) -> Union[str, bytes]:
+        """Gets the encoded playback status message, reused until the status changes.
+
+        Args:
+            binary: Get MessagePack encoding instead of JSON.
+
+        Returns:
+            Encoded :class:`~uita.message.PlayStatusSendMessage`.
+
+        """
+        return self._snapshots.get(
+            uita.message.PlayStatusSendMessage.header,
+            self._playlist.version,
+            binary,
+            lambda: uita.message.PlayStatusSendMessage(self.status())
+        )
+
     async def move(self, track_id: str, position: int) -> None:
         """Moves a track to a new position in the playback queue.
 
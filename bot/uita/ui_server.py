@@ -1,10 +1,12 @@
 """Manages connections from UI frontend."""
 
 import asyncio
+import collections
 import ssl
 import websockets
 from typing import (
-    Any, Awaitable, Callable, Coroutine, Dict, Generic, List, Optional, Set, Tuple, Type, TypeVar
+    Any, Awaitable, Callable, Coroutine, Deque, Dict, Generic, List, Optional, Set, Tuple, Type,
+    TypeVar, Union
 )
 
 import uita.auth
@@ -12,6 +14,7 @@ import uita.config
 import uita.database
 import uita.exceptions
 import uita.message
+import uita.shards
 import uita.utils
 import uita
 
@@ -19,26 +22,247 @@ import logging
 log = logging.getLogger(__name__)
 
 
+def encode(
+    socket: websockets.WebSocketCommonProtocol,
+    message: uita.message.AbstractMessage
+) -> Union[str, bytes]:
+    """Serializes a message in the format that a connection negotiated.
+
+    Args:
+        socket: Websocket that message will be sent to.
+        message: Message to serialize.
+
+    Returns:
+        MessagePack encoded message if the connection uses
+        :data:`~uita.message.MSGPACK_SUBPROTOCOL`, otherwise JSON encoded message.
+
+    """
+    return uita.message.encode(
+        message, socket.subprotocol == uita.message.MSGPACK_SUBPROTOCOL
+    )
+
+
+def _is_routing_message(data: Union[str, bytes]) -> bool:
+    """Checks if a frame changes which process a relayed connection is served by."""
+    try:
+        message = uita.message.parse(data)
+    except uita.exceptions.MalformedMessage:
+        return False
+    return isinstance(
+        message, (uita.message.ServerJoinMessage, uita.message.ServerListGetMessage)
+    )
+
+
+class Outbox():
+    """Queue of messages waiting to be sent to a connection, drained by a single writer task.
+
+    Messages are sent in the order they were queued. Snapshot messages replace any older message
+    of the same type that is still waiting, so slow connections receive the latest state instead
+    of a backlog. Connections that fall too far behind anyway are closed.
+
+    Args:
+        socket: Websocket to send messages to.
+        loop: Event loop to run writer task in.
+        max_size: Maximum number of messages that can wait to be sent.
+
+    """
+    def __init__(
+        self,
+        socket: websockets.WebSocketServerProtocol,
+        loop: asyncio.AbstractEventLoop,
+        max_size: int = 100
+    ) -> None:
+        self.socket = socket
+        self.loop = loop
+        self.max_size = max_size
+        # Entries are [snapshot key, data], with data set to None once superseded
+        self._queue: Deque[List[Any]] = collections.deque()
+        self._snapshots: Dict[str, List[Any]] = {}
+        self._size = 0
+        self._ready = asyncio.Event(loop=loop)
+        self._writer_task: Optional[asyncio.Task[None]] = None
+        self._closed = False
+
+    def put(self, data: Union[str, bytes], snapshot_key: Optional[str] = None) -> None:
+        """Queues a message to be sent.
+
+        Args:
+            data: Encoded message.
+            snapshot_key: Key identifying the state contained in a snapshot message. Any queued
+                message with the same key is discarded. ``None`` if message is not a snapshot.
+
+        """
+        if self._closed:
+            return
+        if self._writer_task is None:
+            self._writer_task = self.loop.create_task(self._write())
+        entry: List[Any] = [snapshot_key, data]
+        if snapshot_key is not None:
+            superseded = self._snapshots.get(snapshot_key)
+            if superseded is not None:
+                superseded[1] = None
+                self._size -= 1
+            self._snapshots[snapshot_key] = entry
+        if self._size >= self.max_size:
+            log.debug("Websocket fell too far behind, closing")
+            self.close()
+            self.loop.create_task(self.socket.close(code=1013, reason="Too many queued messages"))
+            return
+        self._queue.append(entry)
+        self._size += 1
+        self._ready.set()
+
+    def close(self) -> None:
+        """Stops sending messages, discarding any still queued."""
+        self._closed = True
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+        self._queue.clear()
+        self._snapshots.clear()
+        self._size = 0
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                while self._queue:
+                    snapshot_key, data = self._queue.popleft()
+                    if data is None:
+                        continue
+                    self._size -= 1
+                    if snapshot_key is not None:
+                        del self._snapshots[snapshot_key]
+                    await self.socket.send(data)
+                self._ready.clear()
+        except websockets.exceptions.ConnectionClosed:
+            self.close()
+
+
+class Pipeline():
+    """Queue of events from a connection, run one at a time by a single worker task.
+
+    Events are run in the order they were queued, letting the connection keep reading messages
+    while earlier ones are processed without creating a task for each of them.
+
+    Args:
+        loop: Event loop to run worker task in.
+        max_size: Number of queued events at which :attr:`full` is set.
+
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_size: int = 100) -> None:
+        self.loop = loop
+        self.max_size = max_size
+        # Events stay queued until they are finished running
+        self._queue: Deque[Tuple[Callable[["Event[Any]"], Awaitable[None]], "Event[Any]"]] = (
+            collections.deque()
+        )
+        self._ready = asyncio.Event(loop=loop)
+        self._idle: Optional[asyncio.Future[None]] = None
+        self._worker_task: Optional[asyncio.Task[None]] = None
+        self._closed = False
+
+    @property
+    def full(self) -> bool:
+        """Whether the queue has reached its maximum size."""
+        return len(self._queue) >= self.max_size
+
+    def put(
+        self,
+        function: Callable[["Event[Any]"], Awaitable[None]],
+        event: "Event[Any]"
+    ) -> None:
+        """Queues an event to be run.
+
+        Args:
+            function: Function that runs event.
+            event: Event to run.
+
+        """
+        if self._closed:
+            return
+        if self._worker_task is None:
+            self._worker_task = self.loop.create_task(self._work())
+        self._queue.append((function, event))
+        self._ready.set()
+
+    async def join(self) -> None:
+        """Waits until every queued event has finished running."""
+        if not self._queue:
+            return
+        if self._idle is None:
+            self._idle = self.loop.create_future()
+        await asyncio.shield(self._idle, loop=self.loop)
+
+    def close(self) -> None:
+        """Stops accepting events. Events already queued are still run before the worker exits."""
+        self._closed = True
+        self._ready.set()
+
+    def cancel(self) -> None:
+        """Stops running events, discarding any still queued."""
+        self._closed = True
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+        self._queue.clear()
+        self._set_idle()
+
+    async def _work(self) -> None:
+        while True:
+            await self._ready.wait()
+            while self._queue:
+                function, event = self._queue[0]
+                try:
+                    await function(event)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.error("Uncaught exception in pipeline", exc_info=True)
+                self._queue.popleft()
+            self._ready.clear()
+            self._set_idle()
+            if self._closed:
+                return
+
+    def _set_idle(self) -> None:
+        if self._idle is not None and not self._idle.done():
+            self._idle.set_result(None)
+        self._idle = None
+
+
 class Connection():
     """Container for Server connections.
 
     Args:
         user: User connected to server. Can be ``None`` while connection is unauthenticated.
         socket: Websocket connected to user.
+        loop: Event loop to send queued messages and run queued events in.
 
     Attributes:
         user (Optional[uita.types.DiscordUser]): User connected to server. Can be ``None`` while
             connection is unauthenticated.
         socket (websockets.WebSocketServerProtocol): Websocket connected to user.
+        session (Optional[uita.auth.Session]): Session that user authenticated with. Can be
+            ``None`` while connection is unauthenticated.
+        relay (Optional[uita.shards.Relay]): Relay to the process running the user's active
+            server, if it is not this one.
+        outbox (Outbox): Messages waiting to be sent to user.
+        pipeline (Pipeline): Events waiting to be run for user.
 
     """
+    __slots__ = ("user", "socket", "session", "relay", "outbox", "pipeline")
+
     def __init__(
         self,
         user: Optional[uita.types.DiscordUser],
-        socket: websockets.WebSocketServerProtocol
+        socket: websockets.WebSocketServerProtocol,
+        loop: asyncio.AbstractEventLoop
     ) -> None:
         self.user = user
         self.socket = socket
+        self.outbox = Outbox(socket, loop)
+        self.pipeline = Pipeline(loop)
+        self.session: Optional[uita.auth.Session] = None
+        self.relay: Optional[uita.shards.Relay] = None
 
 
 _AbstractMessageType = TypeVar("_AbstractMessageType", bound=uita.message.AbstractMessage)
@@ -47,13 +271,11 @@ _AbstractMessageType = TypeVar("_AbstractMessageType", bound=uita.message.Abstra
 class Event(Generic[_AbstractMessageType]):
     """Container for Server event callbacks.
 
-    Can be set to block the main connection loop from running until this event is processed. Is
-    unblocking by default.
-
     Args:
         message (uita.message.AbstractMessage): Message that triggered event.
         user: User that triggered event.
         socket: Connection that triggered event.
+        outbox: Messages waiting to be sent to connection that triggered event.
         config: Configuration options.
         loop: Event loop that task is running in.
         active_server: Server that user is active in. ``None`` if not yet selected.
@@ -61,11 +283,15 @@ class Event(Generic[_AbstractMessageType]):
     Attributes:
         message (uita.message.AbstractMessage): Message that triggered event.
         user (uita.types.DiscordUser): User that triggered event.
-        socket (websockets.WebSocketProtocol): Connection that triggered event.
+        socket (websockets.WebSocketProtocol): Connection that triggered event. Replies should
+            be sent with :meth:`send` rather than to the socket directly, so that they are
+            ordered with other queued messages.
+        outbox (uita.ui_server.Outbox): Messages waiting to be sent to connection that
+            triggered event.
         config (uita.config.Config): Configuration options.
         loop (asyncio.AbstractEventLoop): Event loop that task is running in.
         active_server (Optional[uita.types.DiscordServer]): Server that user is active in. ``None``
-            if not yet selected.
+            if not yet selected. Looked up by the server when the event callback is run.
 
     """
     CallbackType = Callable[["Event[Any]"], Awaitable[None]]
@@ -75,6 +301,7 @@ class Event(Generic[_AbstractMessageType]):
         message: _AbstractMessageType,
         user: uita.types.DiscordUser,
         socket: websockets.WebSocketServerProtocol,
+        outbox: Outbox,
         config: uita.config.Config,
         loop: asyncio.AbstractEventLoop,
         active_server: Optional[uita.types.DiscordServer]
@@ -82,22 +309,120 @@ class Event(Generic[_AbstractMessageType]):
         self.message = message
         self.user = user
         self.socket = socket
+        self.outbox = outbox
         self.config = config
         self.loop = loop
         self.active_server = active_server
-        self._block_flag = asyncio.Event()
 
-    def block(self) -> None:
-        """Blocks the main connection loop from further socket reads."""
-        self._block_flag.clear()
+    @property
+    def binary(self) -> bool:
+        """Whether the connection that triggered event exchanges MessagePack encoded messages."""
+        return bool(self.socket.subprotocol == uita.message.MSGPACK_SUBPROTOCOL)
+
+    async def send(self, message: uita.message.AbstractMessage) -> None:
+        """Sends a message to the connection that triggered event.
+
+        Args:
+            message: Message to send, encoded in the format that the connection negotiated.
+
+        """
+        await self.send_data(
+            encode(self.socket, message), message.header if message.snapshot else None
+        )
+
+    async def send_data(
+        self,
+        data: Union[str, bytes],
+        snapshot_key: Optional[str] = None
+    ) -> None:
+        """Sends an encoded message to the connection that triggered event.
+
+        Args:
+            data: Message encoded in the format that the connection negotiated.
+            snapshot_key: Header of snapshot message, replacing any older one waiting to be
+                sent. ``None`` if message is not a snapshot.
+
+        """
+        self.outbox.put(data, snapshot_key)
 
-    def finish(self) -> None:
-        """Unblocks the main connection loop, allowing for further socket reads."""
-        self._block_flag.set()
 
-    async def wait(self) -> None:
-        """Waits until the event is not blocked."""
-        await self._block_flag.wait()
+class AdmissionControl():
+    """Limits the rate and concurrency of connection authentication.
+
+    Connections are admitted in the order they arrive, at a sustained ``rate`` with bursts of up
+    to ``burst``, and no more than ``max_concurrent`` at a time. Connections arriving while
+    ``max_queued`` others are already waiting are turned away with an estimate of when to retry.
+
+    Args:
+        rate: Sustained number of admissions per second.
+        burst: Maximum number of admissions that can happen at once after a quiet period.
+        max_concurrent: Maximum number of admitted connections that can be in progress at once.
+        max_queued: Maximum number of connections that can wait for admission.
+        loop: Event loop to wait on, defaults to ``asyncio.get_event_loop()``.
+
+    """
+    def __init__(
+        self,
+        rate: float = 50,
+        burst: int = 100,
+        max_concurrent: int = 20,
+        max_queued: int = 500,
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.loop = loop or asyncio.get_event_loop()
+        self._tokens = float(burst)
+        self._updated = self.loop.time()
+        self._active = 0
+        self._waiting: Deque[asyncio.Future[None]] = collections.deque()
+        self._wake_handle: Optional[asyncio.Handle] = None
+
+    async def acquire(self) -> None:
+        """Waits for admission, which must be released with :meth:`release` once finished.
+
+        Raises:
+            uita.exceptions.ClientError: If too many connections are already waiting.
+
+        """
+        if len(self._waiting) >= self.max_queued:
+            retry_after = (len(self._waiting) + 1) / self.rate
+            raise uita.exceptions.ClientError(uita.message.AuthRetryMessage(retry_after))
+        waiter = self.loop.create_future()
+        self._waiting.append(waiter)
+        self._wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Admission may have been granted after cancellation was requested
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._waiting.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        """Releases an admission, allowing the next connection in."""
+        self._active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        now = self.loop.time()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        while self._waiting and self._active < self.max_concurrent and self._tokens >= 1:
+            waiter = self._waiting.popleft()
+            self._tokens -= 1
+            self._active += 1
+            waiter.set_result(None)
+        # Come back when the next token is available, if it's the only thing anyone is waiting on
+        if self._waiting and self._tokens < 1 and self._wake_handle is None:
+            def wake() -> None:
+                self._wake_handle = None
+                self._wake()
+            self._wake_handle = self.loop.call_later((1 - self._tokens) / self.rate, wake)
 
 
 class Server():
@@ -106,17 +431,32 @@ class Server():
     Requires asynchronous programming, loop management expected from user.
 
     Attributes:
+        admission (Optional[AdmissionControl]): Limits connection authentication so that
+            reconnect storms don't overwhelm the server. ``None`` if the server has not yet
+            started.
         database (Optional[uita.database.Database]): Database containing user authentication data.
             ``None`` if the server has not yet started.
         loop (Optional[asyncio.AbstractEventLoop]): Event loop that listen server will attach to.
             ``None`` if the server has not yet started.
+        router (Optional[uita.shards.Router]): Routes users to the process running their active
+            server. ``None`` if every shard runs in this process.
+        session_cache (uita.auth.SessionCache): Recently verified sessions, used to authenticate
+            reconnecting users without contacting Discord.
 
     """
     def __init__(self) -> None:
         self._server: Optional[websockets.server.WebSocketServer] = None
         self._event_callbacks: Dict[str, Event.CallbackType] = {}
+        # Headers of messages with callbacks that aren't run in the connection pipeline
+        self._blocking_events: Set[str] = set()
+        self._concurrent_events: Set[str] = set()
         self._active_events: Set[asyncio.Task[None]] = set()
         self.connections: Dict[websockets.WebSocketServerProtocol, Connection] = {}
+        # Connections indexed by the Discord server they are active in
+        self._server_connections: Dict[str, Set[Connection]] = {}
+        self.session_cache = uita.auth.SessionCache()
+        self.admission: Optional[AdmissionControl] = None
+        self.router: Optional[uita.shards.Router] = None
 
     async def start(
         self,
@@ -142,29 +482,52 @@ class Server():
         """
         if self._server is not None:
             raise uita.exceptions.ServerError("Server.start() called while already running")
-        self.database = uita.database.Database(database_uri)
         self.config = config
         self.loop = loop or asyncio.get_event_loop()
+        self.database = uita.database.Database(database_uri, loop=self.loop)
+        await self.database.open()
+        self.session_cache = uita.auth.SessionCache()
+        self.admission = AdmissionControl(loop=self.loop)
+        if config.bot.sharding.workers:
+            self.router = uita.shards.Router(config, self.loop)
 
         # Setup an endless database maintenance task to run every 10 minutes
         async def database_maintenance() -> None:
             while True:
-                self.database.maintenance()
+                await self.database.maintenance()
                 await asyncio.sleep(600, loop=self.loop)
         self._create_task(database_maintenance())
 
         # Setup an endless cache pruning task to run every minute
         async def cache_prune() -> None:
             while True:
-                whitelist = []
-                for _, v in uita.state.voice_connections.items():
-                    for track in v.queue():
-                        if track.local:
-                            whitelist.append(track.path)
-                await uita.utils.prune_cache_dir(whitelist=whitelist)
+                # Uploads that are no longer queued are kept around while there is room for them,
+                # so that uploading the same file again doesn't need to transfer it
+                try:
+                    await uita.utils.prune_cache_dir(
+                        whitelist=uita.state.queued_files(),
+                        max_size=config.file.cache_max_size,
+                        loop=self.loop
+                    )
+                except OSError:
+                    log.error("Failed to prune cache", exc_info=True)
                 await asyncio.sleep(60, loop=self.loop)
         self._create_task(cache_prune())
 
+        # Members checked on demand are only checked again when they next join a server, so keep
+        # checking connected users every 5 minutes
+        if uita.state.lazy_members:
+            async def user_verification() -> None:
+                while True:
+                    await asyncio.sleep(300, loop=self.loop)
+                    try:
+                        await self.verify_active_users()
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        log.error("Failed to verify connected users", exc_info=True)
+            self._create_task(user_verification())
+
         ssl_context = None
         # Don't need to check ssl_key_file
         # If it is None load_cert_chain will attempt to find it in the cert file
@@ -173,7 +536,8 @@ class Server():
             ssl_context.load_cert_chain(config.ssl.cert_file, config.ssl.key_file)
         self._server = await websockets.serve(
             self._on_connect, port=config.bot.port,
-            loop=self.loop, origins=origins, ssl=ssl_context
+            loop=self.loop, origins=origins, ssl=ssl_context,
+            subprotocols=[websockets.Subprotocol(uita.message.MSGPACK_SUBPROTOCOL)]
         )
         log.info(f"Server listening on {uita.utils.build_websocket_url(self.config)}")
 
@@ -182,32 +546,42 @@ class Server():
         if self._server is None:
             return
         # Cancel active events first so they can access server internals before they are reset
+        for connection in self.connections.values():
+            connection.pipeline.cancel()
         await self._cancel_active_events()
         self._server.close()
         await self._server.wait_closed()
         # Close all active connections
         for conn in self.connections:
             await conn.close()
+        # Flush any writes still waiting to be committed
+        await self.database.close()
         self._server = None
         self.connections.clear()
+        self._server_connections.clear()
         log.info("Server closed")
 
     def on_message(
         self,
         message_type: Type[_AbstractMessageType],
         require_active_server: bool = True,
-        block: bool = False
+        block: bool = False,
+        concurrent: bool = False
     ) -> Callable[[Event.CallbackType], Event.CallbackType]:
         """Decorator to bind event callbacks.
 
-        Callback function should accept a :class:`~uita.ui_server.Event` as its only parameter
+        Callback function should accept a :class:`~uita.ui_server.Event` as its only parameter.
+        By default callbacks for each connection are run one at a time, in the order that their
+        messages arrived.
 
         Args:
             message_type: Message type to wait for.
             require_active_server: Verify that :attr:`~uita.ui_server.Event.active_server` is
                 valid, default ``True``.
             block: Block connection await loop until event callback is completed, default
-                ``False``.
+                ``False``. Used by callbacks that read from the socket themselves.
+            concurrent: Run event callback in its own task, out of order with other events,
+                default ``False``. Used by callbacks that wait on slow external requests.
 
         Raises:
             uita.exceptions.NoActiveServer: If ``require_active_server`` was set to ``True`` and
@@ -218,13 +592,34 @@ class Server():
             async def wrapper(event: Event[Any]) -> None:
                 if require_active_server is True and event.active_server is None:
                     raise uita.exceptions.NoActiveServer
-                if block is False:
-                    event.finish()
                 await function(event)
             self._event_callbacks[message_type.header] = wrapper
+            if block is True:
+                self._blocking_events.add(message_type.header)
+            if concurrent is True:
+                self._concurrent_events.add(message_type.header)
             return wrapper
         return decorator
 
+    def set_active_server(
+        self,
+        socket: websockets.WebSocketServerProtocol,
+        server_id: Optional[str]
+    ) -> None:
+        """Sets the Discord server that a connected user is active in.
+
+        Args:
+            socket: Websocket connected to user.
+            server_id: Discord server ID that user joined. ``None`` if user left their server.
+
+        """
+        conn = self.connections[socket]
+        assert conn.user is not None
+        self._unindex_connection(conn)
+        conn.user.active_server_id = server_id
+        if server_id is not None:
+            self._server_connections.setdefault(server_id, set()).add(conn)
+
     def send_all(self, message: uita.message.AbstractMessage, server_id: str) -> None:
         """Sends a :class:`~uita.message.AbstractMessage` to all :class:`~uita.types.DiscordUser`
         in a server.
@@ -234,40 +629,53 @@ class Server():
             server_id: Discord server ID to broadcast to.
 
         """
-        for socket, conn in self.connections.items():
-            if conn.user is not None and conn.user.active_server_id == server_id:
-                async def try_send(s: websockets.WebSocketServerProtocol, m: str) -> None:
-                    try:
-                        await s.send(m)
-                    except websockets.exceptions.ConnectionClosed:
-                        pass
-                    except asyncio.CancelledError:
-                        pass
-                self._create_task(try_send(socket, str(message)))
-
-    async def verify_active_servers(self) -> None:
+        connections = self._server_connections.get(server_id)
+        if not connections:
+            return
+        # Encoded once per format no matter how many users are listening
+        data: Dict[bool, Union[str, bytes]] = {}
+        snapshot_key = message.header if message.snapshot else None
+        for conn in connections:
+            binary = conn.socket.subprotocol == uita.message.MSGPACK_SUBPROTOCOL
+            if binary not in data:
+                data[binary] = uita.message.encode(message, binary)
+            conn.outbox.put(data[binary], snapshot_key)
+
+    async def verify_active_servers(self, server_id: Optional[str] = None) -> None:
         """Checks if any user is connected to an active server that is no longer accessible.
 
         If so, will force them back to the server select screen.
 
+        Args:
+            server_id: Discord server ID to check the users of. Checks every server if ``None``.
+
         """
-        # Might help to have an individual user check, but since connections aren't stored in a
-        # hash table (and the server lookups they need are), it probably wouldn't be much faster
-        # without reworking how data is stored. Also I don't expect many simultaneous active
-        # connections. So optimize this if it ever gets to be slow, but I don't think it will.
-        for socket, conn in self.connections.items():
-            if conn.user is None:
-                continue
-            if conn.user.active_server_id is None:
-                continue
-            if (
-                conn.user.active_server_id not in uita.state.servers
-                or conn.user.id not in uita.state.servers[conn.user.active_server_id].users
-            ):
-                conn.user.active_server_id = None
-                self._create_task(
-                    socket.send(str(uita.message.ServerKickMessage()))
-                )
+        server_ids = list(self._server_connections) if server_id is None else [server_id]
+        kick_message = uita.message.ServerKickMessage()
+        for active_server_id in server_ids:
+            discord_server = uita.state.servers.get(active_server_id)
+            for conn in list(self._server_connections.get(active_server_id, ())):
+                assert conn.user is not None
+                if discord_server is None or conn.user.id not in discord_server.users:
+                    self.set_active_server(conn.socket, None)
+                    conn.outbox.put(encode(conn.socket, kick_message))
+
+    async def verify_active_users(self) -> None:
+        """Checks again whether every connected user can still access their active server.
+
+        Any that can't are forced back to the server select screen. Only needed when members are
+        checked on demand, as changes are otherwise tracked as they happen.
+
+        """
+        for server_id in list(self._server_connections):
+            user_ids = {
+                conn.user.id
+                for conn in self._server_connections.get(server_id, ())
+                if conn.user is not None
+            }
+            for user_id in user_ids:
+                await uita.state.server_verify_user(server_id, user_id, uita.bot, refresh=True)
+            await self.verify_active_servers(server_id)
 
     async def _authenticate(
         self,
@@ -277,32 +685,38 @@ class Server():
         # Start by waiting for a data with either session info or an auth code for the Discord API
         try:
             data = await asyncio.wait_for(websocket.recv(), timeout=5, loop=self.loop)
-            if isinstance(data, bytes):
+            if (
+                isinstance(data, bytes)
+                and websocket.subprotocol != uita.message.MSGPACK_SUBPROTOCOL
+            ):
                 raise uita.exceptions.MalformedMessage("Websocket sent bytes unexpectedly")
         # If it takes more than 5 seconds, kick them out
         except asyncio.TimeoutError:
             raise uita.exceptions.AuthenticationError("Authentication timed out")
         message = uita.message.parse(data)
-        # Authenticating by session data
-        if isinstance(message, uita.message.AuthSessionMessage):
-            session = uita.auth.Session(handle=message.handle, secret=message.secret)
-            return await uita.auth.verify_session(
-                session,
-                self.database,
-                self.config,
-                self.loop
-            ), session
-        # Authenticating by authorization code
-        elif isinstance(message, uita.message.AuthCodeMessage):
-            session = await uita.auth.verify_code(
-                message.code, self.database, self.config, self.loop
-            )
-            return await uita.auth.verify_session(
-                session, self.database, self.config, self.loop
-            ), session
         # Unexpected data (port scanners, etc)
-        else:
+        if not isinstance(
+            message, (uita.message.AuthSessionMessage, uita.message.AuthCodeMessage)
+        ):
             raise uita.exceptions.AuthenticationError("Expected authentication message")
+        # Only verification is admitted, so idle sockets can't hold up others during reconnect
+        # storms
+        assert self.admission is not None
+        await self.admission.acquire()
+        try:
+            # Authenticating by session data
+            if isinstance(message, uita.message.AuthSessionMessage):
+                session = uita.auth.Session(handle=message.handle, secret=message.secret)
+            # Authenticating by authorization code
+            else:
+                session = await uita.auth.verify_code(
+                    message.code, self.database, self.config, self.loop
+                )
+            return await uita.auth.verify_session(
+                session, self.database, self.config, self.loop, self.session_cache
+            ), session
+        finally:
+            self.admission.release()
 
     async def _cancel_active_events(self) -> None:
         """Cancels all events spawned by the UI server."""
@@ -319,14 +733,44 @@ class Server():
         task.add_done_callback(lambda f: self._active_events.remove(f))
         self._active_events.add(task)
 
-    def _dispatch_event(self, event: Event[Any]) -> None:
-        """Finds and calls aproppriate callback for given event message.
+    def _unindex_connection(self, conn: Connection) -> None:
+        """Removes a connection from the index of its user's active server."""
+        if conn.user is None or conn.user.active_server_id is None:
+            return
+        connections = self._server_connections.get(conn.user.active_server_id)
+        if connections is not None:
+            connections.discard(conn)
+            if not connections:
+                del self._server_connections[conn.user.active_server_id]
+
+    async def _dispatch_event(self, conn: Connection, event: Event[Any]) -> None:
+        """Schedules the aproppriate callback for given event message."""
+        header = event.message.header
+        if header in self._blocking_events:
+            # Runs in place of the connection loop, after every event that arrived before it
+            await conn.pipeline.join()
+            await self._run_event(event)
+        elif header in self._concurrent_events:
+            self._create_task(self._run_event(event))
+        else:
+            # Wait for room rather than reading messages faster than they can be handled
+            if conn.pipeline.full:
+                await conn.pipeline.join()
+            conn.pipeline.put(self._run_event, event)
+
+    async def _run_event(self, event: Event[Any]) -> None:
+        """Calls aproppriate callback for given event message.
 
         If an event raises an exception it is logged and the connection is closed.
 
         """
-        # Log all events except heartbeats since they happen so often and aren't very useful
-        if event.message.header != "heartbeat":
+        # Events that were queued behind a server join need the server as it is now
+        active_server_id = event.user.active_server_id
+        # mypy gets confused passing None to .get(), so here's a redundant ternary check
+        event.active_server = (
+            uita.state.servers.get(active_server_id) if active_server_id is not None else None
+        )
+        if log.isEnabledFor(logging.DEBUG):
             log.debug("[{}:{}] {} {} -> {}".format(
                 event.user.name,
                 event.user.id,
@@ -334,59 +778,106 @@ class Server():
                 event.message.__dict__,
                 "No server" if not event.active_server else event.active_server.name
             ))
-        # Process the event
-        if event.message.header in self._event_callbacks:
-            async def wrapper() -> None:
-                try:
-                    await self._event_callbacks[event.message.header](event)
-                except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
-                    pass
-                except uita.exceptions.ClientError as e:
-                    log.debug(f"ClientError {e}")
-                    await event.socket.send(str(e))
-                except uita.exceptions.NoActiveServer:
-                    await event.socket.send(str(uita.message.ServerKickMessage()))
-                except Exception:
-                    log.warning("Uncaught exception in event", exc_info=True)
-                    await event.socket.close(
-                        code=1001,
-                        reason="Event callback caused exception"
-                    )
-                finally:
-                    event.finish()
-            self._create_task(wrapper())
-        else:
-            event.finish()
+        try:
+            await self._event_callbacks[event.message.header](event)
+        except asyncio.CancelledError:
+            raise
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except uita.exceptions.ClientError as e:
+            log.debug(f"ClientError {e}")
+            await event.send(e.message)
+        except uita.exceptions.NoActiveServer:
+            await event.send(uita.message.ServerKickMessage())
+        except Exception:
+            log.warning("Uncaught exception in event", exc_info=True)
+            await event.socket.close(
+                code=1001,
+                reason="Event callback caused exception"
+            )
+
+    async def _route(
+        self,
+        conn: Connection,
+        message: uita.message.AbstractMessage,
+        data: Union[str, bytes]
+    ) -> bool:
+        """Relays a message to the process running the user's active server.
+
+        Returns:
+            ``True`` if the message was handled by relaying it, ``False`` if it should be
+            dispatched locally.
+
+        """
+        if self.router is None:
+            return False
+        assert conn.user is not None and conn.session is not None
+        if isinstance(message, uita.message.ServerJoinMessage):
+            if conn.relay is not None:
+                await conn.relay.close()
+                conn.relay = None
+            try:
+                conn.relay = await self.router.relay(
+                    conn.socket, conn.outbox, conn.session, message.server_id
+                )
+            except uita.exceptions.AuthenticationError as error:
+                log.warning(f"Failed to relay {conn.user.name}:{conn.user.id}: {error}")
+                self.set_active_server(conn.socket, None)
+                conn.outbox.put(encode(conn.socket, uita.message.ServerKickMessage()))
+                return True
+            if conn.relay is None:
+                return False
+            # Not active in any server run by this process
+            self.set_active_server(conn.socket, None)
+        # Server lists are gathered from every process by this one
+        elif conn.relay is None or isinstance(message, uita.message.ServerListGetMessage):
+            return False
+        await conn.relay.send(data)
+        return True
 
     async def _on_connect(self, websocket: websockets.WebSocketServerProtocol, path: str) -> None:
         """Main loop for each connected client."""
         log.debug(f"Websocket connected {websocket.remote_address[0]} {path}")
         try:
             # Connection stub in case server stops during authentication
-            conn = Connection(None, websocket)
+            conn = Connection(None, websocket, self.loop)
             self.connections[websocket] = conn
             # Initialize user and connection data
             user, session = await self._authenticate(websocket)
             conn.user = user
+            conn.session = session
             # Notify client that they authenticated successfully
-            await websocket.send(str(uita.message.AuthSucceedMessage(user, session)))
+            conn.outbox.put(encode(websocket, uita.message.AuthSucceedMessage(user, session)))
             log.info(f"[{user.name}:{user.id}] connected ({websocket.remote_address[0]})")
             # Main loop, runs for the life of each connection
             while True:
                 # 90 second timeout to cull zombie connections, expects client heartbeats
                 data = await asyncio.wait_for(websocket.recv(), 90, loop=self.loop)
-                if isinstance(data, bytes):
+                # Relayed connections forward frames as they are, since some like file chunks
+                # aren't messages, only stopping for the messages that change where they go
+                if (
+                    path != uita.shards.LOCAL_PATH
+                    and conn.relay is not None
+                    and not _is_routing_message(data)
+                ):
+                    await conn.relay.send(data)
+                    continue
+                if (
+                    isinstance(data, bytes)
+                    and websocket.subprotocol != uita.message.MSGPACK_SUBPROTOCOL
+                ):
                     raise uita.exceptions.MalformedMessage("Websocket sent bytes unexpectedly")
                 # Parse data into message and dispatch to aproppriate event callback
                 message = uita.message.parse(data)
-                # mypy gets confused passing None to .get(), so here's a redundant ternary check
-                active_server = (
-                    uita.state.servers.get(user.active_server_id)
-                    if user.active_server_id is not None else None
-                )
-                event = Event(message, user, websocket, self.config, self.loop, active_server)
-                self._dispatch_event(event)
-                await event.wait()
+                # Messages for servers run by other processes are sent there instead
+                if path != uita.shards.LOCAL_PATH and await self._route(conn, message, data):
+                    continue
+                # Messages without callbacks, like heartbeats, only keep the connection alive
+                if message.header not in self._event_callbacks:
+                    continue
+                # Active server is filled in when the event runs
+                event = Event(message, user, websocket, conn.outbox, self.config, self.loop, None)
+                await self._dispatch_event(conn, event)
         except websockets.exceptions.ConnectionClosed as error:
             log.debug(f"Websocket disconnected: code {error.code},reason {error.reason}")
         except asyncio.CancelledError:
@@ -398,7 +889,7 @@ class Server():
             try:
                 # Notify client that their authentication failed before closing connection
                 await asyncio.wait_for(
-                    websocket.send(str(uita.message.AuthFailMessage())),
+                    websocket.send(encode(websocket, uita.message.AuthFailMessage())),
                     timeout=5,
                     loop=self.loop
                 )
@@ -408,14 +899,34 @@ class Server():
                 websockets.exceptions.ConnectionClosed
             ):
                 pass
+        except uita.exceptions.ClientError as error:
+            log.debug(f"Websocket turned away: {error.message.header}")
+            try:
+                await asyncio.wait_for(
+                    websocket.send(encode(websocket, error.message)), timeout=5, loop=self.loop
+                )
+            except (
+                asyncio.TimeoutError,
+                asyncio.CancelledError,
+                websockets.exceptions.ConnectionClosed
+            ):
+                pass
         except uita.exceptions.MalformedMessage as error:
             log.debug(f"Websocket sent malformed message: {error}")
+        except uita.exceptions.RateLimitError as error:
+            log.warning(f"Websocket failed to authenticate: {error}")
         except Exception:
             log.error("Uncaught exception", exc_info=True)
         finally:
             # Close and cleanup connection
             if conn.user is not None:
                 log.info(f"[{conn.user.name}:{conn.user.id}] disconnected")
+            if conn.relay is not None:
+                await conn.relay.close()
+            conn.outbox.close()
+            # Events that arrived before disconnecting are still run
+            conn.pipeline.close()
+            self._unindex_connection(conn)
             del self.connections[websocket]
             await websocket.close()
             log.debug("Websocket closed")
@@ -1,16 +1,25 @@
 """Utility functions."""
 import asyncio
+import collections
 import contextlib
 import discord
 import os
 import re
 import subprocess
 import sys
-from typing import Iterator, List, Optional, Tuple
+import time
+from typing import (
+    Any, Awaitable, Callable, Dict, Generic, Hashable, Iterator, List, Optional, Tuple, TypeVar
+)
 
 import uita.config
 
 
+_T = TypeVar("_T")
+_K = TypeVar("_K")
+_V = TypeVar("_V")
+
+
 async def dir_size(
     path: str,
     loop: Optional[asyncio.AbstractEventLoop] = None
@@ -43,6 +52,170 @@ async def dir_size(
 dir_size.lock = asyncio.Lock()  # type: ignore
 
 
+class _Flight(Generic[_T]):
+    def __init__(self, task: "asyncio.Future[_T]") -> None:
+        self.task = task
+        self.refs = 0
+
+
+class SingleFlight(Generic[_T]):
+    """Coalesces concurrent calls sharing a key into a single task.
+
+    The first caller for a key starts the task and any caller that arrives while it is still
+    running awaits that same task instead of starting its own. Waiting callers are reference
+    counted, so a cancelled caller only stops waiting. The shared task is cancelled once there
+    is nobody left waiting on it.
+
+    """
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, _Flight[_T]] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    async def run(
+        self,
+        key: Hashable,
+        function: Callable[[], Awaitable[_T]],
+        loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> _T:
+        """Runs a function, or joins an identical call that is already running.
+
+        Args:
+            key: Normalized key identifying the call. Calls with equal keys are coalesced.
+            function: Function returning an awaitable, only called if no call for ``key`` is
+                running.
+            loop: Event loop to run the shared task in, defaults to ``asyncio.get_event_loop()``.
+
+        Returns:
+            Result of the shared call.
+
+        """
+        loop = loop or asyncio.get_event_loop()
+        flight = self._flights.get(key) or self._start(key, function, loop)
+        flight.refs += 1
+        try:
+            return await asyncio.shield(flight.task, loop=loop)
+        finally:
+            flight.refs -= 1
+            if flight.refs == 0 and not flight.task.done():
+                # Deferred so that a caller joining later in the same loop iteration, like one
+                # replacing a cancelled caller, can still claim the task before it is abandoned
+                loop.call_soon(self._abandon, key, flight)
+
+    def _start(
+        self,
+        key: Hashable,
+        function: Callable[[], Awaitable[_T]],
+        loop: asyncio.AbstractEventLoop
+    ) -> _Flight[_T]:
+        flight = _Flight(asyncio.ensure_future(function(), loop=loop))
+        self._flights[key] = flight
+
+        def forget(_: Any) -> None:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.task.add_done_callback(forget)
+        return flight
+
+    def _abandon(self, key: Hashable, flight: _Flight[_T]) -> None:
+        if flight.refs > 0 or flight.task.done():
+            return
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        flight.task.cancel()
+
+
+class TTLCache(Generic[_K, _V]):
+    """Bounded key-value cache that forgets entries once they expire.
+
+    When full, the least recently used entry is evicted to make room for new entries.
+
+    Args:
+        maxsize: Maximum number of entries to hold.
+        ttl: Time in seconds that entries remain valid for.
+
+    Attributes:
+        maxsize (int): Maximum number of entries to hold.
+        ttl (float): Time in seconds that entries remain valid for.
+
+    """
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "collections.OrderedDict[_K, Tuple[float, _V]]" = collections.OrderedDict()
+
+    def __contains__(self, key: _K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: _K) -> Optional[_V]:
+        """Retrieves an entry, marking it as recently used.
+
+        Args:
+            key: Key of entry to retrieve.
+
+        Returns:
+            Cached value, or ``None`` if the key is missing or has expired.
+
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expiry, value = entry
+        if expiry <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: _K, value: _V, ttl: Optional[float] = None) -> None:
+        """Inserts or replaces an entry.
+
+        Args:
+            key: Key of entry to store.
+            value: Value to store.
+            ttl: Time in seconds that this entry remains valid for. Defaults to ``None`` which
+                uses :attr:`~uita.utils.TTLCache.ttl`.
+
+        """
+        self._entries[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: _K) -> Optional[_V]:
+        """Removes an entry.
+
+        Args:
+            key: Key of entry to remove.
+
+        Returns:
+            Removed value, or ``None`` if the key is missing or has expired.
+
+        """
+        value = self.get(key)
+        self._entries.pop(key, None)
+        return value
+
+    def clear(self, predicate: Optional[Callable[[_K], bool]] = None) -> None:
+        """Removes every entry.
+
+        Args:
+            predicate: Only remove entries with keys that this returns ``True`` for. Defaults
+                to ``None`` which removes everything.
+
+        """
+        if predicate is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+
 def install_dir() -> str:
     """Gets the absolute path to the script being run.
 
@@ -81,28 +254,82 @@ def config_file() -> str:
 
 async def prune_cache_dir(
     whitelist: Optional[List[str]] = None,
+    max_size: Optional[int] = None,
     loop: Optional[asyncio.AbstractEventLoop] = None
-) -> None:
+) -> int:
     """Prunes the cache directory of unused files.
 
+    Files with an expired :meth:`~uita.utils.prune_cache_lease` are always removed, then the
+    remaining files are removed in order of least recently modified until the directory fits
+    within ``max_size``.
+
     Args:
         whitelist: List of absolute paths to exempt from pruning.
+        max_size: Size in bytes that the directory is pruned down to, ``None`` to remove every
+            file not exempted.
         loop: Event loop to attach listen server to, defaults to ``asyncio.get_event_loop()``.
 
+    Returns:
+        Directory size in bytes after pruning.
+
     """
     safe_whitelist: List[str] = (whitelist or list())
     safe_whitelist += list(prune_cache_dir.whitelist)  # type: ignore
+    leases: Dict[str, float] = prune_cache_dir.leases  # type: ignore
+    now = time.monotonic()
+    expired = [path for path, expiry in leases.items() if expiry <= now]
+    for path in expired:
+        del leases[path]
+    safe_whitelist += list(leases)
     loop = loop or asyncio.get_event_loop()
 
-    def prune() -> None:
-        for directory, _, files in os.walk(cache_dir()):
-            for f in files:
+    def prune() -> int:
+        for path in expired:
+            if path not in safe_whitelist:
+                _remove_file(path)
+        files = []
+        for directory, _, filenames in os.walk(cache_dir()):
+            for f in filenames:
                 path = os.path.join(directory, f)
-                if path in safe_whitelist:
+                # Files can be removed by finished uploads or another prune while walking
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
                     continue
-                os.remove(path)
-    await loop.run_in_executor(None, prune)
+                files.append((stat.st_mtime, stat.st_size, path))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if max_size is not None and size <= max_size:
+                break
+            if path in safe_whitelist:
+                continue
+            _remove_file(path)
+            size -= file_size
+        return size
+    return await loop.run_in_executor(None, prune)
 prune_cache_dir.whitelist = set()  # type: ignore
+prune_cache_dir.leases = {}  # type: ignore
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def prune_cache_lease(path: str, ttl: float) -> None:
+    """Protects a path from :meth:`~uita.utils.prune_cache_dir` for a limited time.
+
+    Once the lease expires the path is removed by the next prune, regardless of cache size.
+    Leasing a path again replaces its previous lease.
+
+    Args:
+        path: Absolute path to be exempted from pruning.
+        ttl: Time in seconds that the path is exempted for.
+
+    """
+    prune_cache_dir.leases[path] = time.monotonic() + ttl  # type: ignore
 
 
 @contextlib.contextmanager
@@ -154,6 +381,20 @@ def build_websocket_url(config: uita.config.Config) -> str:
     )
 
 
+def shard_id(server_id: str, shard_count: int) -> int:
+    """Finds which Discord gateway shard a server belongs to.
+
+    Args:
+        server_id: Discord server ID.
+        shard_count: Total number of shards.
+
+    Returns:
+        ID of shard that receives events for the server.
+
+    """
+    return (int(server_id) >> 22) % shard_count
+
+
 def verify_channel_visibility(channel: discord.abc.GuildChannel, user: discord.Member) -> bool:
     """Checks whether a user can see a channel.
 
@@ -4,10 +4,11 @@ import re
 import requests
 import urllib.parse
 import youtube_dl
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncGenerator, Dict, Hashable, List, Optional
 from typing_extensions import Final
 
 import uita.exceptions
+import uita.utils
 
 import logging
 log = logging.getLogger(__name__)
@@ -19,11 +20,29 @@ BASE_HEADERS: Final = {
     "User-Agent": f"uitabot ({uita.__url__}, {uita.__version__})"
 }
 API_URL: Final = "https://www.googleapis.com/youtube/v3"
+VIDEO_ID_REGEX: Final = re.compile("^[0-9A-Za-z_-]{11}$")
+PLAYLIST_ID_REGEX: Final = re.compile("^[0-9A-Za-z_-]+$")
+YOUTUBE_DOMAINS: Final = ("youtube.com", "youtube-nocookie.com")
+YOUTUBE_SHORT_DOMAIN: Final = "youtu.be"
+PLAYLIST_PAGE_SIZE: Final = 50
+# Stream URLs stay valid for hours, but keep this short so scraped metadata doesn't go stale
+SCRAPE_CACHE_TTL: Final = 5 * 60
+
+# Identical requests that are still running are shared rather than repeated
+_scrape_flights: uita.utils.SingleFlight[Dict[str, Any]] = uita.utils.SingleFlight()
+_search_flights: uita.utils.SingleFlight[List[Dict[str, Any]]] = uita.utils.SingleFlight()
+_scrape_cache: uita.utils.TTLCache[Hashable, Dict[str, Any]] = uita.utils.TTLCache(
+    256, SCRAPE_CACHE_TTL
+)
 
 
 async def scrape(url: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> Dict[str, Any]:
     """Queries YouTube for URL metadata.
 
+    Concurrent calls for the same video or playlist are coalesced into a single request and
+    results are briefly cached, so the returned dict may be shared between callers and should not
+    be modified.
+
     Args:
         url: URL for audio resource to be played.
         loop: Event loop to attach to launch worker threads from.
@@ -35,7 +54,35 @@ async def scrape(url: str, loop: Optional[asyncio.AbstractEventLoop] = None) ->
         uita.exceptions.ClientError: If called with an unusable audio path.
 
     """
-    loop = loop or asyncio.get_event_loop()
+    async_loop = loop or asyncio.get_event_loop()
+    key = _scrape_key(url)
+    info = _scrape_cache.get(key)
+    if info is None:
+        info = await _scrape_flights.run(key, lambda: _scrape(url, async_loop), loop=async_loop)
+        _scrape_cache.set(key, info)
+    return info
+
+
+async def prefetch(urls: List[str], loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+    """Scrapes URLs ahead of time so that later calls to :func:`scrape` return immediately.
+
+    URLs are scraped one at a time in the given order to avoid competing with requests that are
+    actually needed. Cancelling a prefetch does not interrupt a :func:`scrape` call that has
+    joined the same request.
+
+    Args:
+        urls: URLs that are likely to be scraped soon, most likely first.
+        loop: Event loop to attach to launch worker threads from.
+
+    """
+    for url in urls:
+        try:
+            await scrape(url, loop=loop)
+        except uita.exceptions.ClientError:
+            pass
+
+
+async def _scrape(url: str, loop: asyncio.AbstractEventLoop) -> Dict[str, Any]:
     null_log = logging.Logger("dummy")
     null_log.addHandler(logging.NullHandler())
 
@@ -66,6 +113,61 @@ async def scrape(url: str, loop: Optional[asyncio.AbstractEventLoop] = None) ->
     raise uita.exceptions.ClientError(uita.message.ErrorUrlInvalidMessage())
 
 
+class SearchCache():
+    """Caches search results so that repeated and refined queries don't need new API requests.
+
+    Args:
+        maxsize: Maximum number of queries to cache results for.
+        ttl: Time in seconds that cached results remain valid for.
+
+    """
+    def __init__(self, maxsize: int = 1000, ttl: float = 600) -> None:
+        self._results: uita.utils.TTLCache[str, List[Dict[str, Any]]] = uita.utils.TTLCache(
+            maxsize, ttl
+        )
+
+    def get(self, query: str, results: int = 5) -> Optional[List[Dict[str, Any]]]:
+        """Retrieves cached results for a query.
+
+        If the query itself is not cached, results for the longest cached prefix of the query
+        are filtered down to titles containing every search term. These are only used if enough
+        of them remain, since a prefix search that was cut short may be missing better matches.
+
+        Args:
+            query: Search query.
+            results: Number of results needed.
+
+        Returns:
+            List of search results, or ``None`` if the query can't be answered from cache.
+
+        """
+        key = _search_terms(query)
+        cached = self._results.get(key)
+        if cached is not None:
+            return cached[:results]
+        terms = key.split()
+        for end in range(len(key) - 1, 0, -1):
+            cached = self._results.get(key[:end])
+            if cached is None:
+                continue
+            matches = [
+                result for result in cached
+                if all(term in result["title"].casefold() for term in terms)
+            ]
+            return matches[:results] if len(matches) >= results else None
+        return None
+
+    def set(self, query: str, results: List[Dict[str, Any]]) -> None:
+        """Stores the results of a query.
+
+        Args:
+            query: Search query.
+            results: List of search results.
+
+        """
+        self._results.set(_search_terms(query), results)
+
+
 async def search(
     query: str,
     api_key: Optional[str] = None,
@@ -84,13 +186,29 @@ async def search(
         loop: Event loop to attach to launch worker threads from.
 
     Returns:
-        List of search results.
+        List of search results. Concurrent calls for the same query are coalesced into a single
+        request, so the returned list may be shared between callers and should not be modified.
 
     Raises:
         uita.exceptions.ClientError: If called with an unusable search query.
 
     """
-    loop = loop or asyncio.get_event_loop()
+    async_loop = loop or asyncio.get_event_loop()
+    key = (api_key is not None, _search_terms(query), results)
+    return await _search_flights.run(
+        key,
+        lambda: _search(query, api_key, referrer, results, async_loop),
+        loop=async_loop
+    )
+
+
+async def _search(
+    query: str,
+    api_key: Optional[str],
+    referrer: Optional[str],
+    results: int,
+    loop: asyncio.AbstractEventLoop
+) -> List[Dict[str, Any]]:
     # Without an API key we take the much slower path using youtube-dl
     if api_key is None:
         return await _search_slow(query, results, loop)
@@ -141,6 +259,60 @@ async def search(
     } for r in search_results]
 
 
+async def playlist(
+    playlist_id: str,
+    api_key: str,
+    referrer: Optional[str] = None,
+    loop: Optional[asyncio.AbstractEventLoop] = None
+) -> AsyncGenerator[List[str], None]:
+    """Reads the videos of a YouTube playlist one page at a time.
+
+    Each page is only requested once the previous page has been consumed, so the start of a
+    playlist can be used before the rest has loaded and long playlists are never held in memory
+    all at once. Private and deleted videos are skipped.
+
+    Args:
+        playlist_id: ID of the playlist to read.
+        api_key: API key for Youtube requests.
+        referrer: Referrer for HTTP requests, in case API restrictions are in place.
+        loop: Event loop to attach to launch worker threads from.
+
+    Yields:
+        List of video IDs for each page of the playlist, in playlist order.
+
+    Raises:
+        uita.exceptions.ClientError: If the playlist cannot be read.
+
+    """
+    loop = loop or asyncio.get_event_loop()
+    headers = BASE_HEADERS.copy()
+    if referrer is not None:
+        headers["referer"] = referrer
+    page_token: Optional[str] = ""
+    while page_token is not None:
+        url = (
+            f"{API_URL}/playlistItems/?"
+            f"playlistId={urllib.parse.quote_plus(playlist_id)}"
+            f"&maxResults={PLAYLIST_PAGE_SIZE}"
+            f"&part=contentDetails,status"
+            f"&pageToken={urllib.parse.quote_plus(page_token)}"
+            f"&key={api_key}"
+        )
+        response = await loop.run_in_executor(
+            None,
+            lambda: requests.get(url, headers=headers)
+        )
+        if response.status_code != 200:
+            raise uita.exceptions.ClientError(uita.message.ErrorUrlInvalidMessage())
+        page = response.json()
+        page_token = page.get("nextPageToken")
+        yield [
+            item["contentDetails"]["videoId"]
+            for item in page["items"]
+            if item["status"]["privacyStatus"] in ("public", "unlisted")
+        ]
+
+
 def parse_time(time: str) -> int:
     """Converts a YouTube timestamp into seconds.
 
@@ -165,6 +337,52 @@ def parse_time(time: str) -> int:
     return duration
 
 
+def parse_video_id(url: str) -> Optional[str]:
+    """Extracts a YouTube video ID from a URL.
+
+    Args:
+        url: URL to a YouTube video, such as a ``watch``, ``youtu.be`` or ``embed`` link.
+
+    Returns:
+        Video ID if one was found, ``None`` otherwise.
+
+    """
+    parsed = urllib.parse.urlparse(url.strip())
+    domain = _strip_subdomain(parsed.hostname)
+    video_id = None
+    if domain == YOUTUBE_SHORT_DOMAIN:
+        video_id = parsed.path.lstrip("/").split("/")[0]
+    elif domain in YOUTUBE_DOMAINS:
+        if parsed.path.rstrip("/") == "/watch":
+            video_id = urllib.parse.parse_qs(parsed.query).get("v", [""])[0]
+        else:
+            match = re.match("^/(?:embed|v|shorts|live)/([^/]+)", parsed.path)
+            video_id = match.group(1) if match else None
+    if video_id is None or VIDEO_ID_REGEX.match(video_id) is None:
+        return None
+    return video_id
+
+
+def parse_playlist_id(url: str) -> Optional[str]:
+    """Extracts a YouTube playlist ID from a URL.
+
+    Args:
+        url: URL to a YouTube playlist, or to a video played from within a playlist.
+
+    Returns:
+        Playlist ID if one was found, ``None`` otherwise.
+
+    """
+    parsed = urllib.parse.urlparse(url.strip())
+    domain = _strip_subdomain(parsed.hostname)
+    if domain not in YOUTUBE_DOMAINS and domain != YOUTUBE_SHORT_DOMAIN:
+        return None
+    playlist_id = urllib.parse.parse_qs(parsed.query).get("list", [""])[0]
+    if PLAYLIST_ID_REGEX.match(playlist_id) is None:
+        return None
+    return playlist_id
+
+
 def build_url(video_id: str) -> str:
     """Converts a YouTube video ID into a valid URL.
 
@@ -178,6 +396,29 @@ def build_url(video_id: str) -> str:
     return f"https://youtube.com/watch?v={video_id}"
 
 
+def _strip_subdomain(hostname: Optional[str]) -> Optional[str]:
+    if hostname is None:
+        return None
+    for subdomain in ("www.", "m.", "music."):
+        if hostname.startswith(subdomain):
+            return hostname[len(subdomain):]
+    return hostname
+
+
+def _search_terms(query: str) -> str:
+    # Searches are case insensitive, so only the terms themselves need to match
+    return " ".join(query.split()).casefold()
+
+
+def _scrape_key(url: str) -> Hashable:
+    video_id = parse_video_id(url)
+    playlist_id = parse_playlist_id(url)
+    # Anything that isn't recognizably YouTube is only coalesced with the exact same URL
+    if video_id is None and playlist_id is None:
+        return url.strip()
+    return (video_id, playlist_id)
+
+
 async def _search_slow(
     query: str,
     results: int,
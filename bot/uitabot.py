@@ -5,6 +5,7 @@ try:
 
     import uita
     import uita.config
+    import uita.shards
     import uita.utils
 
     import logging
@@ -44,6 +45,11 @@ if __name__ == "__main__":
         config = uita.config.load(uita.utils.config_file())
         initialize_logging(level=logging.INFO if not config.bot.verbose_logging else logging.DEBUG)
         check_ffmpeg()
+        uita.state.lazy_members = config.bot.lazy_members
+        # Run every shard in this process unless they are split between several
+        uita.bot.shard_count = config.bot.sharding.shard_count
+        if config.bot.sharding.workers:
+            uita.bot.shard_ids = uita.shards.Router(config, uita.loop).shard_ids
         # Main loop
         uita.loop.create_task(uita.server.start(
             config.bot.database,
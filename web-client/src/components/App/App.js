@@ -24,6 +24,7 @@ export default class App extends React.Component {
         this.state = {
             connection: WebSocket.CLOSED,
             needLogin: false,
+            retrying: false,
             discordUser: null,
             discordServer: null,
             errors: Array()
@@ -31,6 +32,9 @@ export default class App extends React.Component {
 
         // Interval callback handler for sending heartbeat packets to server
         this.heartbeatInterval = null;
+
+        // Timeout callback handler for reconnecting when the server is too busy
+        this.retryTimeout = null;
     }
 
     componentDidMount() {
@@ -42,6 +46,14 @@ export default class App extends React.Component {
             this.setState({needLogin: true});
         });
 
+        // Handler for server being too busy to authenticate, reconnect when asked to
+        this.eventDispatcher.setMessageHandler("auth.retry", m => {
+            this.setState({retrying: true});
+            // Spread out reconnects so everyone turned away doesn't come back at once
+            const delay = m.retry_after * (1 + Math.random()) * 1000;
+            this.retryTimeout = setTimeout(() => this.connect(), delay);
+        });
+
         // Handler for authentication success
         this.eventDispatcher.setMessageHandler("auth.succeed", m => {
             Session.store({handle: m.session.handle, secret: m.session.secret});
@@ -59,8 +71,13 @@ export default class App extends React.Component {
         });
 
         // Setup the websocket after we're ready to receive and act on messages
+        this.connect();
+    }
+
+    connect() {
         try {
-            this.socket = new WebSocket(Config.bot_url);
+            this.socket = new WebSocket(Config.bot_url, [Message.MSGPACK_SUBPROTOCOL]);
+            this.socket.binaryType = "arraybuffer";
             this.socket.onmessage = e => this.eventDispatcher.dispatch(Message.parse(e.data));
             this.socket.onclose = e => this.onSocketClose();
             this.socket.onopen = e => this.onSocketOpen();
@@ -68,7 +85,7 @@ export default class App extends React.Component {
         }
         catch (e) {
             this.onError(e.message);
-            this.setState({connection: WebSocket.CLOSED});
+            this.setState({connection: WebSocket.CLOSED, retrying: false});
         }
     }
 
@@ -77,8 +94,10 @@ export default class App extends React.Component {
         if (this.socket) {
             this.socket.close();
         }
+        clearTimeout(this.retryTimeout);
         this.setState({errors: Array()});
         this.eventDispatcher.clearMessageHandler("auth.fail");
+        this.eventDispatcher.clearMessageHandler("auth.retry");
         this.eventDispatcher.clearMessageHandler("auth.succeed");
         this.eventDispatcher.clearMessageHandler("server.kick");
     }
@@ -104,7 +123,7 @@ export default class App extends React.Component {
     }
 
     onSocketOpen() {
-        this.setState({connection: WebSocket.OPEN});
+        this.setState({connection: WebSocket.OPEN, retrying: false});
     }
 
     onSocketClose() {
@@ -120,6 +139,11 @@ export default class App extends React.Component {
             return <Login url={oauthUrl}/>;
         }
 
+        // Server was too busy and will be reconnected to shortly
+        if (this.state.retrying) {
+            return <Loading>Server is busy, reconnecting</Loading>;
+        }
+
         // Establishing connection with backend, SSL handshake, etc
         if (this.state.connection == WebSocket.CONNECTING) {
             return <Loading>Connecting</Loading>;
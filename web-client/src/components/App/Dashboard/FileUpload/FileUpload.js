@@ -20,6 +20,11 @@ var UploadStatus = {
 };
 Object.freeze(UploadStatus);
 
+// Number of times to reconnect and resume an upload after losing the connection
+const MAX_RECONNECTS = 5;
+// Time in milliseconds to wait before reconnecting
+const RECONNECT_DELAY = 2000;
+
 // Allows nested components to upload files programmatically (upload buttons, etc)
 export const FileUploadContext = React.createContext(() => {});
 
@@ -78,22 +83,38 @@ class DropZone extends React.Component {
         }
     }
 
-    async fileSend(file, socket, dispatcher, progressCallback) {
-        socket.send(new Message.FileUploadStartMessage(file.size).str());
-        // Stream the file data in chunks
-        //
-        // Ideally this number scales depending on the user's ping and bandwidth to get the best
-        // available throughput, but that is a lot of added effort for a small feature in a small
-        // project.
-        const chunk_size = 1024 * 512;
+    async fileSend(file, sha256, socket, dispatcher, progressCallback) {
+        // Server acknowledges chunks as it receives them, allowing a window of chunks past the
+        // last acknowledged one to be sent without waiting
+        let allowed = 0;
+        const onAck = m => {
+            allowed = Math.max(allowed, m.received + m.window);
+        };
+        dispatcher.setMessageHandler("file.upload.ack", onAck);
+        // Server skips ahead past anything it received before an earlier connection was lost
         let start = 0;
         let end = 0;
+        dispatcher.setMessageHandler("file.upload.resume", m => {
+            end = m.offset;
+        });
+        socket.send(new Message.FileUploadStartMessage(file.size, sha256).str());
+        // Stream the file data in chunks
+        const chunk_size = 1024 * 512;
+        let chunk = 0;
         while (end < file.size) {
-            // Wait for the server response
-            await this.fileReady(dispatcher);
+            if (chunk >= allowed) {
+                // Wait for the server to make room in the window
+                const cached = await this.fileReady(dispatcher, onAck, () => chunk < allowed);
+                if (cached) {
+                    // Server already had a file with the same hash and queued that instead
+                    progressCallback(0);
+                    return;
+                }
+            }
             start = end;
             end = Math.min(end + chunk_size, file.size);
             socket.send(file.slice(start, end));
+            chunk++;
             if (!this._isMounted || this._cancelUploadFlag) {
                 throw "Cancelled";
             }
@@ -103,11 +124,30 @@ class DropZone extends React.Component {
         await this.fileComplete(dispatcher, socket);
     }
 
-    fileReady(dispatcher) {
-        // Create an awaitable event that triggers after a server response
+    async fileHash(file) {
+        // Hash the file contents so the server can skip uploads of files it already has cached
+        const data = await new Promise((resolve, reject) => {
+            let reader = new FileReader();
+            reader.onload = e => resolve(e.target.result);
+            reader.onerror = e => reject("Could not read file");
+            reader.readAsArrayBuffer(file);
+        });
+        const digest = new Uint8Array(await crypto.subtle.digest("SHA-256", data));
+        return Array.from(digest, byte => byte.toString(16).padStart(2, "0")).join("");
+    }
+
+    fileReady(dispatcher, onAck, ready) {
+        // Create an awaitable event that triggers once the server allows more chunks to be sent,
+        // or resolves true if the server completes the upload without needing any
         return new Promise((resolve, reject) => {
-            dispatcher.setMessageHandler("file.upload.start", m => {
-                resolve();
+            dispatcher.setMessageHandler("file.upload.ack", m => {
+                onAck(m);
+                if (ready()) {
+                    resolve(false);
+                }
+            });
+            dispatcher.setMessageHandler("file.upload.complete", m => {
+                resolve(true);
             });
             dispatcher.setMessageHandler("error.file.invalid", m => {
                 reject(m.error);
@@ -166,6 +206,8 @@ class DropZone extends React.Component {
                 progress: 0.0,
                 status: UploadStatus.QUEUED,
                 blob: file,
+                sha256: null,
+                reconnects: 0,
                 error: ""
             };
         }));
@@ -259,6 +301,7 @@ class DropZone extends React.Component {
     }
 
     async _uploadTask(socket, dispatcher) {
+        let reconnect = false;
         try {
             // Select the server to upload files to
             socket.send(new Message.ServerJoinMessage(this.props.discordServer.id).str());
@@ -283,7 +326,10 @@ class DropZone extends React.Component {
                     });
 
                     const file = this.uploadQueue[index];
-                    await this.fileSend(file.blob, socket, dispatcher, (buffered) => {
+                    if (file.sha256 === null) {
+                        file.sha256 = await this.fileHash(file.blob);
+                    }
+                    await this.fileSend(file.blob, file.sha256, socket, dispatcher, (buffered) => {
                         this.uploadQueue[index].status = UploadStatus.UPLOADING;
                         this.uploadQueue[index].progress = (file.size - buffered) / file.size;
                         this.setState({progress: this.uploadQueue, showProgress: true});
@@ -299,21 +345,43 @@ class DropZone extends React.Component {
                     }
                     this.uploadQueue[index].status = UploadStatus.COMPLETED;
                 } catch (error) {
-                    this.uploadQueue[index].status = UploadStatus.CANCELLED;
-                    this.uploadQueue[index].error = error;
+                    // Uploads interrupted by a lost connection are resumed by the server from
+                    // where they left off once reconnected
+                    const file = this.uploadQueue[index];
+                    if (
+                        socket.readyState != WebSocket.OPEN
+                        && file.reconnects < MAX_RECONNECTS
+                        && this._isMounted
+                        && !this._cancelUploadFlag
+                    ) {
+                        file.status = UploadStatus.QUEUED;
+                        file.reconnects++;
+                        reconnect = true;
+                        break;
+                    }
+                    file.status = UploadStatus.CANCELLED;
+                    file.error = error;
                 } finally {
-                    this.uploadQueue[index].progress = 1.0;
+                    if (!reconnect) {
+                        this.uploadQueue[index].progress = 1.0;
+                    }
                     this.setState({progress: this.uploadQueue, showProgress: true});
                 }
             }
         } finally {
-            // Make sure that _isUploading resets in the same synchronous control block as the
-            // while loop exits, so the component knows to spawn new tasks for later files
-            this._isUploading = false;
-            this.uploadQueue = Array();
-            this._cancelUploadFlag = false;
-            this.setState({showProgress: false});
             socket.close(1000);
+            if (reconnect) {
+                // Upload queue and flag are kept so that files added in the meantime are sent
+                // after reconnecting instead of spawning another task
+                setTimeout(() => this._spawnUploadTask(), RECONNECT_DELAY);
+            } else {
+                // Make sure that _isUploading resets in the same synchronous control block as
+                // the while loop exits, so the component knows to spawn new tasks for later files
+                this._isUploading = false;
+                this.uploadQueue = Array();
+                this._cancelUploadFlag = false;
+                this.setState({showProgress: false});
+            }
         }
     }
 
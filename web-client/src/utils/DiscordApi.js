@@ -18,7 +18,8 @@ Object.freeze(ChannelType);
 // Generates a "login" URL based on config.json and Discord requirements
 export function createOauthUrl(clientId, redirectUrl) {
     const encodedUrl = encodeURIComponent(redirectUrl);
-    const scope = encodeURIComponent("identify");
+    // Server list lets the bot check membership on demand for servers with lazily loaded members
+    const scope = encodeURIComponent("identify guilds");
     return "https://discord.com/api/oauth2/authorize"
         // Identifies our app to Discord
         + `?client_id=${clientId}`
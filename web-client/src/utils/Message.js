@@ -2,6 +2,11 @@
 // Utility classes for parsing and building network packets
 // For detailed breakdown on protocol uses, see /bot/uita/message.py
 
+import * as MessagePack from "utils/MessagePack";
+
+// Websocket subprotocol for receiving MessagePack encoded messages in binary frames
+export const MSGPACK_SUBPROTOCOL = "uita.msgpack";
+
 // Abstract base class for network messages
 export class AbstractMessage {
     static get header() {
@@ -32,6 +37,17 @@ export class AuthFailMessage extends AbstractMessage {
     }
 }
 
+export class AuthRetryMessage extends AbstractMessage {
+    static get header() {
+        return "auth.retry";
+    }
+
+    constructor(retry_after) {
+        super();
+        this.retry_after = retry_after;
+    }
+}
+
 export class AuthSessionMessage extends AbstractMessage {
     static get header() {
         return "auth.session";
@@ -135,9 +151,33 @@ export class FileUploadStartMessage extends AbstractMessage {
         return "file.upload.start";
     }
 
-    constructor(size) {
+    constructor(size, sha256) {
         super();
         this.size = size;
+        this.sha256 = sha256;
+    }
+}
+
+export class FileUploadAckMessage extends AbstractMessage {
+    static get header() {
+        return "file.upload.ack";
+    }
+
+    constructor(received, window) {
+        super();
+        this.received = received;
+        this.window = window;
+    }
+}
+
+export class FileUploadResumeMessage extends AbstractMessage {
+    static get header() {
+        return "file.upload.resume";
+    }
+
+    constructor(offset) {
+        super();
+        this.offset = offset;
     }
 }
 
@@ -230,6 +270,29 @@ export class PlayURLMessage extends AbstractMessage {
     }
 }
 
+export class SearchQueryMessage extends AbstractMessage {
+    static get header() {
+        return "search.query";
+    }
+
+    constructor(query) {
+        super();
+        this.query = query;
+    }
+}
+
+export class SearchResultsMessage extends AbstractMessage {
+    static get header() {
+        return "search.results";
+    }
+
+    constructor(query, results) {
+        super();
+        this.query = query;
+        this.results = results;
+    }
+}
+
 export class ServerKickMessage extends AbstractMessage {
     static get header() {
         return "server.kick";
@@ -268,6 +331,7 @@ export class ServerListSendMessage extends AbstractMessage {
 const VALID_MESSAGES = {
     "auth.code": [AuthCodeMessage, ["code"]],
     "auth.fail": [AuthFailMessage, []],
+    "auth.retry": [AuthRetryMessage, ["retry_after"]],
     "auth.session": [AuthSessionMessage, ["handle", "secret"]],
     "auth.succeed": [AuthSucceedMessage, ["user", "session"]],
     "channel.active.get": [ChannelActiveGetMessage, []],
@@ -279,7 +343,9 @@ const VALID_MESSAGES = {
     "error.file.invalid": [ErrorFileInvalidMessage, ["error"]],
     "error.queue.full": [ErrorQueueFullMessage, []],
     "error.url.invalid": [ErrorUrlInvalidMessage, []],
-    "file.upload.start": [FileUploadStartMessage, ["size"]],
+    "file.upload.ack": [FileUploadAckMessage, ["received", "window"]],
+    "file.upload.start": [FileUploadStartMessage, ["size", "sha256"]],
+    "file.upload.resume": [FileUploadResumeMessage, ["offset"]],
     "file.upload.complete": [FileUploadCompleteMessage, []],
     "heartbeat": [HeartbeatMessage, []],
     "play.queue.get": [PlayQueueGetMessage, []],
@@ -289,6 +355,8 @@ const VALID_MESSAGES = {
     "play.status.get": [PlayStatusGetMessage, []],
     "play.status.send": [PlayStatusSendMessage, ["status"]],
     "play.url": [PlayURLMessage, ["url"]],
+    "search.query": [SearchQueryMessage, ["query"]],
+    "search.results": [SearchResultsMessage, ["query", "results"]],
     "server.kick": [ServerKickMessage, []],
     "server.join": [ServerJoinMessage, ["server_id"]],
     "server.list.get": [ServerListGetMessage, []],
@@ -325,7 +393,7 @@ export class EventDispatcher {
 
 // Turns raw network data into Message classes
 export function parse(message) {
-    let obj = JSON.parse(message);
+    let obj = typeof message === "string" ? JSON.parse(message) : MessagePack.decode(message);
     let args = Array();
     // Verify that the expected arguments match with what is in the message
     for (let arg of VALID_MESSAGES[obj.header][1]) {
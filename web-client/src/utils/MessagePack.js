@@ -0,0 +1,121 @@
+// --- MessagePack.js ----------------------------------------------------------
+// Decodes MessagePack encoded network packets, sent by the bot in binary frames
+// Only the types the bot ever sends are supported, see /bot/uita/message.py
+
+class Decoder {
+    constructor(buffer) {
+        this.bytes = new Uint8Array(buffer);
+        this.view = new DataView(this.bytes.buffer, this.bytes.byteOffset, this.bytes.byteLength);
+        this.offset = 0;
+    }
+
+    decode() {
+        const type = this.uint(1);
+        // Types with values packed into the type byte
+        if (type <= 0x7f) {
+            return type;
+        }
+        if (type >= 0xe0) {
+            return type - 0x100;
+        }
+        if (type >= 0x80 && type <= 0x8f) {
+            return this.map(type & 0x0f);
+        }
+        if (type >= 0x90 && type <= 0x9f) {
+            return this.array(type & 0x0f);
+        }
+        if (type >= 0xa0 && type <= 0xbf) {
+            return this.str(type & 0x1f);
+        }
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return this.bin(this.uint(1));
+            case 0xc5: return this.bin(this.uint(2));
+            case 0xc6: return this.bin(this.uint(4));
+            case 0xca: return this.read(4, o => this.view.getFloat32(o));
+            case 0xcb: return this.read(8, o => this.view.getFloat64(o));
+            case 0xcc: return this.uint(1);
+            case 0xcd: return this.uint(2);
+            case 0xce: return this.uint(4);
+            case 0xcf: return this.read(8, o => Number(this.view.getBigUint64(o)));
+            case 0xd0: return this.read(1, o => this.view.getInt8(o));
+            case 0xd1: return this.read(2, o => this.view.getInt16(o));
+            case 0xd2: return this.read(4, o => this.view.getInt32(o));
+            case 0xd3: return this.read(8, o => Number(this.view.getBigInt64(o)));
+            case 0xd9: return this.str(this.uint(1));
+            case 0xda: return this.str(this.uint(2));
+            case 0xdb: return this.str(this.uint(4));
+            case 0xdc: return this.array(this.uint(2));
+            case 0xdd: return this.array(this.uint(4));
+            case 0xde: return this.map(this.uint(2));
+            case 0xdf: return this.map(this.uint(4));
+            default:
+                throw new TypeError(`Unsupported MessagePack type 0x${type.toString(16)}`);
+        }
+    }
+
+    read(length, reader) {
+        if (this.offset + length > this.bytes.length) {
+            throw new RangeError("MessagePack data ended unexpectedly");
+        }
+        const value = reader(this.offset);
+        this.offset += length;
+        return value;
+    }
+
+    uint(length) {
+        switch (length) {
+            case 1: return this.read(1, o => this.view.getUint8(o));
+            case 2: return this.read(2, o => this.view.getUint16(o));
+            case 4: return this.read(4, o => this.view.getUint32(o));
+        }
+    }
+
+    str(length) {
+        const bytes = this.bin(length);
+        let codePoints = Array();
+        for (let i = 0; i < bytes.length; i++) {
+            const byte = bytes[i];
+            // Count of continuation bytes is given by the leading bits of the first byte
+            const extra = byte >= 0xf0 ? 3 : byte >= 0xe0 ? 2 : byte >= 0xc0 ? 1 : 0;
+            let codePoint = extra ? byte & (0x3f >> extra) : byte;
+            for (let j = 0; j < extra; j++) {
+                codePoint = (codePoint << 6) | (bytes[++i] & 0x3f);
+            }
+            codePoints.push(codePoint);
+        }
+        return String.fromCodePoint(...codePoints);
+    }
+
+    bin(length) {
+        return this.read(length, o => this.bytes.subarray(o, o + length));
+    }
+
+    array(length) {
+        let array = Array(length);
+        for (let i = 0; i < length; i++) {
+            array[i] = this.decode();
+        }
+        return array;
+    }
+
+    map(length) {
+        let map = {};
+        for (let i = 0; i < length; i++) {
+            const key = this.decode();
+            map[key] = this.decode();
+        }
+        return map;
+    }
+}
+
+export function decode(buffer) {
+    const decoder = new Decoder(buffer);
+    const value = decoder.decode();
+    if (decoder.offset != decoder.bytes.length) {
+        throw new RangeError("MessagePack data has trailing bytes");
+    }
+    return value;
+}
@@ -6,6 +6,7 @@ import * as Errors from "components/App/Errors/Errors";
 import * as Message from "utils/Message";
 import * as Session from "utils/Session";
 
+import {createHash} from "crypto";
 import React from "react";
 import {
     render,
@@ -21,8 +22,20 @@ import {Simulate} from "react-dom/test-utils";
 const discordServer = {id: "12345"};
 const fileData = new Uint8Array(128).map(() => Math.random() * 255);
 const file = new File([fileData], "test.ogg", {type: "audio/vorbis"});
+const fileHash = createHash("sha256").update(fileData).digest("hex");
 const session = {handle: "handle", secret: "secret"};
 
+// jsdom doesn't implement the Web Crypto API
+Object.defineProperty(global, "crypto", {
+    value: {
+        subtle: {
+            digest: async (algorithm, data) => {
+                return createHash("sha256").update(new Uint8Array(data)).digest();
+            }
+        }
+    }
+});
+
 // Bless this mess, testing long running asynchronous tasks is not pretty
 describe("file uploads", () => {
     // Socket to spy on
@@ -47,9 +60,9 @@ describe("file uploads", () => {
     async function uploadProtocol(socket) {
         mockSocket.onopen();
         mockSocket.onmessage({data: new Message.AuthSucceedMessage(null, null).str()});
-        mockSocket.onmessage({data: new Message.FileUploadStartMessage(fileData.length).str()});
-        // Yield control back to the upload task
-        await wait();
+        mockSocket.onmessage({data: new Message.FileUploadAckMessage(0, 8).str()});
+        // Yield control back to the upload task until the file has been hashed and sent
+        await wait(() => expect(mockSocket.send).toHaveBeenCalledTimes(4));
         mockSocket.onmessage({data: new Message.FileUploadCompleteMessage(fileData.length).str()});
         // Yield control back to the upload task (once for each await)
         await wait();
@@ -70,7 +83,7 @@ describe("file uploads", () => {
         const expectedCalls = [
             [new Message.AuthSessionMessage(session.handle, session.secret).str()],
             [new Message.ServerJoinMessage(discordServer.id).str()],
-            [new Message.FileUploadStartMessage(fileData.length).str()],
+            [new Message.FileUploadStartMessage(fileData.length, fileHash).str()],
             [fileData]
         ];
         // Simple string comparisons
@@ -105,6 +118,27 @@ describe("file uploads", () => {
         await uploadProtocol(mockSocket);
         await checkResults(mockSocket.send.mock.calls);
     });
+
+    test("cached file skips upload", async () => {
+        const {getByTestId} = render(
+            <FileUpload discordServer={discordServer}>
+                <FileUploadContext.Consumer>
+                    {upload => <button data-testid="upload" onClick={(e) => upload([file])}/>}
+                </FileUploadContext.Consumer>
+            </FileUpload>
+        );
+        fireEvent.click(getByTestId("upload"));
+
+        mockSocket.onopen();
+        mockSocket.onmessage({data: new Message.AuthSucceedMessage(null, null).str()});
+        await wait(() => expect(mockSocket.send).toHaveBeenCalledTimes(3));
+        // Server completes the upload right away when it has the file hash cached
+        mockSocket.onmessage({data: new Message.FileUploadCompleteMessage().str()});
+        await wait(() => expect(mockSocket.close).toHaveBeenCalled());
+        const calls = mockSocket.send.mock.calls;
+        expect(calls.length).toBe(3);
+        expect(calls[2][0]).toBe(new Message.FileUploadStartMessage(file.size, fileHash).str());
+    });
 });
 
 test("drop effects change with file type", () => {
@@ -44,3 +44,16 @@ test("parse throws on invalid object parameters", () => {
     const missingParams = () => Message.parse(`{"header":"server.join"}`);
     expect(missingParams).toThrow(TypeError);
 });
+
+test("parse accepts MessagePack encoded messages", () => {
+    // {"header": "server.join", "server_id": "1a1a1a1a1a"}
+    const mockBinaryMessage = new Uint8Array([
+        0x82, 0xa6, ...Array.from("header", c => c.charCodeAt(0)),
+        0xab, ...Array.from("server.join", c => c.charCodeAt(0)),
+        0xa9, ...Array.from("server_id", c => c.charCodeAt(0)),
+        0xaa, ...Array.from(mockServerId, c => c.charCodeAt(0))
+    ]).buffer;
+    const message = Message.parse(mockBinaryMessage);
+    expect(message instanceof Message.ServerJoinMessage).toBe(true);
+    expect(message.server_id).toBe(mockServerId);
+});